@@ -8,8 +8,6 @@ python -m canvas_crony --all --email --only "acbart@udel.edu"
 
 import argparse
 
-from canvas_crony import canvas_crony
-
 parser = argparse.ArgumentParser(description="A tool for summarizing data from Canvas")
 
 parser.add_argument(
@@ -54,6 +52,90 @@ parser.add_argument(
     help="The folder to store the generated PDF files into. Files will be named after the course and "
     "time.",
 )
+parser.add_argument(
+    "--jobs",
+    type=int,
+    default=None,
+    help="How many worker processes to render reports with. Defaults to the number of cores.",
+)
+parser.add_argument(
+    "--changed-only",
+    dest="changed_only",
+    action="store_true",
+    help="Skip rendering and emailing reports whose contents have not changed since they were "
+    "last emailed.",
+)
+parser.add_argument(
+    "--state",
+    default=None,
+    help="The file that remembers each report's fingerprint for --changed-only. "
+    "Defaults to crony_state.json",
+)
+parser.add_argument(
+    "--summaries",
+    default=None,
+    help="The folder to store mergeable score summaries into, so that they can be rolled up "
+    "across courses and terms.",
+)
+parser.add_argument(
+    "--rollup",
+    action="store_true",
+    help="Only merge the score summaries in --summaries into rollups per staff member, per "
+    "instructor and overall, logged and written to --output as rollup.csv.",
+)
+parser.add_argument(
+    "--outbox",
+    default=None,
+    help="The folder that keeps emails until they are delivered. Defaults to crony_outbox",
+)
+parser.add_argument(
+    "--flush-outbox",
+    dest="flush_outbox",
+    action="store_true",
+    help="Only resend the emails still waiting in the outbox, without building any reports.",
+)
+parser.add_argument(
+    "--daemon",
+    action="store_true",
+    help="Keep running, and run each course on the schedule given in its course file.",
+)
+parser.add_argument(
+    "--resume",
+    action="store_true",
+    help="Continue the last run from its checkpoint, redoing only what its failed courses "
+    "had left to do.",
+)
+parser.add_argument(
+    "--checkpoint",
+    default=None,
+    help="The folder to keep each course's progress in during a run, for --resume. Runs are "
+    "only checkpointed with --checkpoint or --resume, in crony_checkpoint if not given.",
+)
+parser.add_argument(
+    "--profile",
+    default=None,
+    help="The folder to write the timings of each stage of the run into, as a summary table "
+    "and as collapsed stacks for flame graphs.",
+)
+parser.add_argument(
+    "--profiler",
+    default=None,
+    choices=["cprofile", "sample"],
+    help="Also run a Python profiler for --profile: cprofile (the main thread) or sample "
+    "(every thread).",
+)
+parser.add_argument(
+    "--trace",
+    default=None,
+    help="The file to append the timed spans of each run to, as JSON lines of trace events. "
+    "Defaults to crony_trace.jsonl",
+)
+parser.add_argument(
+    "--no-trace",
+    dest="no_trace",
+    action="store_true",
+    help="Do not write the trace of this run.",
+)
 parser.add_argument(
     "--log",
     default=None,
@@ -67,4 +149,7 @@ parser.add_argument(
 
 args = parser.parse_args()
 
+# Imported after parsing, so that --help and bad arguments do not wait for it
+from canvas_crony import canvas_crony
+
 canvas_crony(vars(args))
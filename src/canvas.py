@@ -1,18 +1,99 @@
 from __future__ import annotations
 
-from typing import Optional
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+import logging
+import os
+import tempfile
 
-from canvas_data import clean_user, RawCourseData, CourseData, Submission, Assignment
+from canvas_data import (
+    clean_user,
+    RawCourseData,
+    CourseData,
+    Submission,
+    Assignment,
+    StudentSummary,
+    AssignmentAnalytics,
+)
 from canvas_request import CanvasRequest
+from gradebook_export import load_gradebook_submissions
+import profiling
 from settings import Settings
 
+logger = logging.getLogger("crony")
+
+# Courses with more (students x assignments) than this get their submissions from
+# a gradebook export, instead of paging through every submission. Off unless a
+# course opts in, since the export has no graders for the score and grading reports
+BULK_EXPORT_ABOVE: Optional[int] = None
+# The submissions that the gradebook export cannot describe (no times or graders)
+UNGRADED_STATES = ["submitted", "pending_review"]
+SUBMISSION_INCLUDES = ["visibility", "rubric_assessment"]
+# How many finished exports can be downloaded at the same time
+EXPORT_DOWNLOADS = 4
+
 
 class CanvasApi(CanvasRequest):
-    def __init__(self, settings: Settings, cache: bool):
+    def __init__(self, settings: Settings, cache: bool, progress: bool = False):
         self.settings = settings
-        super().__init__(self.settings, cache)
+        super().__init__(self.settings, cache, progress)
+        self.downloads = ThreadPoolExecutor(
+            EXPORT_DOWNLOADS, thread_name_prefix="export"
+        )
 
     def rehydrate_course(self, raw_course_data: RawCourseData) -> CourseData:
+        return self.finish_course(*self.start_course(raw_course_data))
+
+    def rehydrate_courses(
+        self,
+        raw_courses: list[RawCourseData],
+        on_done: Optional[Callable[[CourseData], None]] = None,
+        on_error: Optional[Callable[[int, Exception], None]] = None,
+    ) -> list[CourseData]:
+        """
+        Rehydrate every course, with all of their gradebook exports (if any)
+        running on Canvas at the same time.
+        :param on_done: Called with each course as soon as it is rehydrated; if it
+            raises, the course failed like any other error.
+        :param on_error: Called with the id of a course that failed and its error,
+            after which the other courses carry on without it. Without this, the
+            first error is raised.
+        :return: The courses that were rehydrated.
+        """
+        started = []
+        for raw_course in raw_courses:
+            with profiling.span(
+                f"course {raw_course['id']}", course_id=raw_course["id"]
+            ):
+                try:
+                    started.append(self.start_course(raw_course))
+                except Exception as exception:
+                    if on_error is None:
+                        raise
+                    on_error(raw_course["id"], exception)
+        finished = []
+        for course, export in started:
+            with profiling.span(f"course {course['id']}", course_id=course["id"]):
+                try:
+                    course = self.finish_course(course, export)
+                    if on_done is not None:
+                        on_done(course)
+                except Exception as exception:
+                    if on_error is None:
+                        raise
+                    on_error(course["id"], exception)
+                    continue
+            finished.append(course)
+        return finished
+
+    def start_course(
+        self, raw_course_data: RawCourseData
+    ) -> tuple[CourseData, Optional[Future]]:
+        """
+        Get everything but the submissions, and start the gradebook export if the
+        course is big enough to need one.
+        :return: The partial course, and the future for its exported submissions.
+        """
         cloned = raw_course_data.copy()
         course_id = cloned["id"]
         # Actual course data
@@ -91,17 +172,33 @@ class CanvasApi(CanvasRequest):
             assignment["id"]: self.hydrate_assignment(assignment, cloned)
             for assignment in assignments
         }
+        if self.use_bulk_export(raw_course_data, cloned):
+            logger.info(
+                f"Exporting the gradebook of course {course_id}; its graded"
+                " submissions will have no graders"
+            )
+            return cloned, self.start_gradebook_export(course_id)
+        return cloned, None
+
+    def finish_course(self, cloned: CourseData, export: Optional[Future]) -> CourseData:
+        course_id = cloned["id"]
         # Submissions
-        submissions = self.get(
-            "students/submissions",
-            all=True,
-            course=course_id,
-            data={
-                "student_ids[]": "all",
-                # 'assignment_ids[]': list(cloned['assignments'].keys()),
-                "include[]": ["visibility", "rubric_assessment"],
-            },
-        )
+        if export is not None:
+            submissions = self.get_exported_submissions(course_id, export)
+            submissions = [
+                s for s in submissions if s["assignment_id"] in cloned["assignments"]
+            ]
+        else:
+            submissions = self.get(
+                "students/submissions",
+                all=True,
+                course=course_id,
+                data={
+                    "student_ids[]": "all",
+                    # 'assignment_ids[]': list(cloned['assignments'].keys()),
+                    "include[]": SUBMISSION_INCLUDES,
+                },
+            )
         cloned["submissions"] = {
             submission["id"]: self.hydrate_submission(submission, cloned)
             for submission in submissions
@@ -110,6 +207,13 @@ class CanvasApi(CanvasRequest):
         cloned["submissions"] = {
             sid: s for sid, s in cloned["submissions"].items() if s
         }
+        # Activity summaries, in a couple of bulk requests instead of per student
+        if cloned.get("analytics"):
+            cloned["student_summaries"] = self.get_student_summaries(course_id)
+            cloned["assignment_analytics"] = self.get_assignment_analytics(course_id)
+        else:
+            cloned["student_summaries"] = {}
+            cloned["assignment_analytics"] = {}
         # Speed grader URL
         cloned["speed_grader_url"] = (
             "https://udel.instructure.com/courses/{course_id}/gradebook/speed_grader?assignment_id={assignment_id}&student_id={user_id}"
@@ -117,6 +221,144 @@ class CanvasApi(CanvasRequest):
         # All done
         return cloned
 
+    def refresh_assignments(
+        self, course: CourseData, assignment_ids: set[int]
+    ) -> CourseData:
+        """
+        Download just these assignments, with their dates and overrides, and their
+        submissions again, for a course that was already rehydrated. Assignments
+        that are gone (e.g., deleted) are dropped along with their submissions.
+        :return: A copy of the course with the new assignments and submissions.
+        """
+        assignments = self.get(
+            "assignments",
+            all=True,
+            course=course["id"],
+            data={
+                "assignment_ids[]": sorted(assignment_ids),
+                "include[]": ["all_dates", "overrides"],
+            },
+        )
+        refreshed = course.copy()
+        refreshed["assignments"] = {
+            assignment_id: assignment
+            for assignment_id, assignment in course["assignments"].items()
+            if assignment_id not in assignment_ids
+        }
+        for assignment in assignments:
+            refreshed["assignments"][assignment["id"]] = self.hydrate_assignment(
+                assignment, refreshed
+            )
+        submissions = self.get(
+            "students/submissions",
+            all=True,
+            course=course["id"],
+            data={
+                "student_ids[]": "all",
+                "assignment_ids[]": sorted(assignment_ids),
+                "include[]": SUBMISSION_INCLUDES,
+            },
+        )
+        refreshed["submissions"] = {
+            submission_id: submission
+            for submission_id, submission in course["submissions"].items()
+            if submission["assignment"]["id"] not in assignment_ids
+        }
+        for submission in submissions:
+            if submission["assignment_id"] not in refreshed["assignments"]:
+                continue
+            hydrated = self.hydrate_submission(submission, refreshed)
+            if hydrated:
+                refreshed["submissions"][hydrated["id"]] = hydrated
+        return refreshed
+
+    def use_bulk_export(self, raw_course_data: RawCourseData, course: CourseData):
+        """
+        Whether the course is big enough to export its gradebook instead of
+        paging through its submissions. Courses opt in by setting a threshold with
+        `bulk_export_above`; their graded submissions then have no graders.
+        """
+        threshold = raw_course_data.get("bulk_export_above", BULK_EXPORT_ABOVE)
+        if threshold is None:
+            return False
+        return len(course["students"]) * len(course["assignments"]) > threshold
+
+    def start_gradebook_export(self, course_id: int) -> Future:
+        """
+        Start a gradebook CSV export, without waiting for Canvas to finish it.
+        :return: A future for the export's raw submissions.
+        """
+        (export,) = self.post(
+            "gradebook_csv", course=course_id, result_type=dict, use_api=False
+        )
+        progress = self.watch_progress(export["progress_id"])
+        return self.downloads.submit(
+            profiling.inherit(self.download_gradebook),
+            course_id,
+            export["attachment_id"],
+            progress,
+        )
+
+    def download_gradebook(
+        self, course_id: int, attachment_id: int, progress: Future
+    ) -> list[dict]:
+        """
+        Once the export is done, download it and read its submissions.
+        """
+        with profiling.span("wait for gradebook export"):
+            progress.result()
+        (attachment,) = self.get(
+            f"files/{attachment_id}", course=None, result_type=dict
+        )
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, f"gradebook_{course_id}.csv")
+            with profiling.span("download gradebook"):
+                self.download_file(attachment["url"], path)
+            return load_gradebook_submissions(path)
+
+    def get_exported_submissions(self, course_id: int, export: Future) -> list[dict]:
+        """
+        Every (student, assignment) submission, from one gradebook export plus the
+        ungraded submissions from the API, which keep their times for the reports.
+        """
+        # Fetched while Canvas is still working on the export
+        ungraded = [
+            submission
+            for state in UNGRADED_STATES
+            for submission in self.get(
+                "students/submissions",
+                all=True,
+                course=course_id,
+                data={
+                    "student_ids[]": "all",
+                    "workflow_state": state,
+                    "include[]": SUBMISSION_INCLUDES,
+                },
+            )
+        ]
+        replaced = {(s["user_id"], s["assignment_id"]) for s in ungraded}
+        return ungraded + [
+            s
+            for s in export.result()
+            if (s["user_id"], s["assignment_id"]) not in replaced
+        ]
+
+    def get_student_summaries(self, course_id: int) -> dict[int, StudentSummary]:
+        """
+        Page views, participations and tardiness for every student, in one paginated stream.
+        """
+        summaries = self.get("analytics/student_summaries", all=True, course=course_id)
+        return {summary["id"]: summary for summary in summaries}
+
+    def get_assignment_analytics(
+        self, course_id: int
+    ) -> dict[int, AssignmentAnalytics]:
+        """
+        Score quartiles and tardiness fractions for every published assignment.
+        """
+        assignments = self.get("analytics/assignments", all=True, course=course_id)
+        return {assignment["assignment_id"]: assignment for assignment in assignments}
+
     def hydrate_assignment(self, assignment: dict, course: CourseData) -> Assignment:
         assignment["assignment_group"] = course["assignment_groups"][
             assignment["assignment_group_id"]
@@ -28,17 +28,38 @@ We also need a secrets file to hold the connection data. Should be able to speci
 from __future__ import annotations
 
 import sys
-from tqdm import tqdm
+from contextlib import nullcontext
+from typing import Optional, TYPE_CHECKING
 import logging
 from logging.handlers import RotatingFileHandler
 
-from email_service import send_emails
-from cli_config import CronyConfiguration
-from canvas_data import load_course_data, load_course_folder
+from email_service import queue_emails, deliver_outbox
+from cli_config import CronyConfiguration, get_only_emails
+from canvas_data import (
+    CourseData,
+    RawCourseData,
+    load_course_data,
+    load_course_folder,
+)
 from canvas import CanvasApi
-from reports import make_reports
+from checkpoints import Checkpoint, DEFAULT_CHECKPOINT, DOWNLOADED, RENDERED, DONE
+from daemon import CronyDaemon
+from outbox import DEFAULT_OUTBOX
+import profiling
+import tracing
 from reports.report_types import ReportSet
-from settings import yaml_load
+from reports.rendering import render_report_sets
+from reports.fingerprints import (
+    DEFAULT_STATE_PATH,
+    load_fingerprints,
+    save_fingerprints,
+    drop_unchanged,
+    select_recipients,
+)
+from settings import Settings, yaml_load
+
+if TYPE_CHECKING:
+    from tqdm import tqdm
 
 logger = logging.getLogger("crony")
 
@@ -66,47 +87,308 @@ class CanvasCrony:
 
     def run_safely(self, args: CronyConfiguration) -> list[ReportSet]:
         self.init_logger(args)
+        if args.get("profile"):
+            profiling.start(args.get("profiler"))
+        if not args.get("no_trace"):
+            tracing.start(args.get("trace") or tracing.DEFAULT_TRACE_PATH)
+        # The daemon traces each of its runs on its own, instead of one for its
+        # whole lifetime (see `CronyDaemon`)
+        run_span = nullcontext() if args.get("daemon") else profiling.span("run")
         try:
-            return self.run(args)
+            with run_span:
+                return self.run(args)
         except Exception as exception:
             logger.error(f"Error during execution: {exception}")
             if args["unsafe"]:
                 raise exception
+        finally:
+            if args.get("profile"):
+                profiling.finish(args["profile"])
+            tracing.finish()
 
     def run(self, args: CronyConfiguration) -> list[ReportSet]:
         settings = yaml_load(args["settings"])
+        outbox_folder = args.get("outbox") or DEFAULT_OUTBOX
+        if args.get("flush_outbox"):
+            logger.info("Sending the emails left in the outbox")
+            deliver_outbox(outbox_folder, settings)
+            return []
+        if args.get("rollup"):
+            self.rollup(args)
+            return []
+        if args.get("daemon"):
+            CronyDaemon(self, args, settings).run_forever()
+            return []
         self.start_progress_bar(args["progress"])
+        # Only checkpointed when asked to, so that runs write nothing else by default
+        checkpoint = None
+        if args.get("checkpoint") or args.get("resume"):
+            checkpoint_folder = args.get("checkpoint") or DEFAULT_CHECKPOINT
+            checkpoint = Checkpoint(checkpoint_folder, args, args.get("resume"))
         logger.info("Downloading Course Data")
-        canvas = CanvasApi(settings, args["cache"])
-        if args["course"] is not None:
-            courses = [load_course_data(args["course"])]
-        elif args["courses"] is not None:
-            courses = load_course_folder(args["courses"])
-        else:
-            logger.error("Need to have either `courses` or `course` provided")
-            raise ValueError("Need to have either `courses` or `course` provided")
+        canvas = CanvasApi(settings, args["cache"], args["progress"])
+        with profiling.span("load courses"):
+            if args["course"] is not None:
+                raw_courses = [load_course_data(args["course"])]
+            elif args["courses"] is not None:
+                raw_courses = list(load_course_folder(args["courses"]))
+            else:
+                logger.error("Need to have either `courses` or `course` provided")
+                raise ValueError("Need to have either `courses` or `course` provided")
+        profiling.annotate(courses=len(raw_courses))
         self.update_progress()
-        courses = [canvas.rehydrate_course(course) for course in courses]
+        with profiling.span("download"):
+            courses = self.download(canvas, raw_courses, args, checkpoint)
         self.update_progress()
+        report_sets = self.report(courses, args, settings, checkpoint)
+        if checkpoint is not None:
+            checkpoint.finish([raw_course["id"] for raw_course in raw_courses])
+        return report_sets
+
+    def rollup(self, args: CronyConfiguration):
+        from reports.summary_store import write_rollup
+
+        if not args.get("summaries"):
+            raise ValueError(
+                "Need `summaries` to know which score summaries to roll up"
+            )
+        logger.info(f"Rolling up the score summaries in {args['summaries']}")
+        rows = write_rollup(args["summaries"], args.get("output"))
+        widths = [
+            max(len(row[column]) for row in rows) for column in range(len(rows[0]))
+        ]
+        for row in rows:
+            line = "  ".join(cell.ljust(width) for cell, width in zip(row, widths))
+            logger.info(line.rstrip())
+
+    def download(
+        self,
+        canvas: CanvasApi,
+        raw_courses: list[RawCourseData],
+        args: CronyConfiguration,
+        checkpoint: Optional[Checkpoint] = None,
+    ) -> list[CourseData]:
+        """
+        Rehydrate the courses, except the ones the checkpoint (if any) already has
+        (or is done with), checkpointing each one as soon as it is downloaded.
+        """
+        downloaded: dict[int, CourseData] = {}
+        missing = []
+        for raw_course in raw_courses:
+            course_id = raw_course["id"]
+            if checkpoint is None:
+                missing.append(raw_course)
+            elif checkpoint.reached(course_id, DONE):
+                logger.info(f"Course {course_id} was already done, skipping it")
+            elif checkpoint.reached(course_id, DOWNLOADED):
+                downloaded[course_id] = checkpoint.load_course(course_id)
+            else:
+                missing.append(raw_course)
+        courses = canvas.rehydrate_courses(
+            missing,
+            on_done=checkpoint.save_course if checkpoint is not None else None,
+            on_error=lambda course_id, error: self.course_failed(
+                course_id, "downloading", error, args, checkpoint
+            ),
+        )
+        for course in courses:
+            downloaded[course["id"]] = course
+        return [
+            downloaded[raw_course["id"]]
+            for raw_course in raw_courses
+            if raw_course["id"] in downloaded
+        ]
+
+    def report(
+        self,
+        courses: list[CourseData],
+        args: CronyConfiguration,
+        settings: Settings,
+        checkpoint: Optional[Checkpoint] = None,
+        deliver: bool = True,
+    ) -> list[ReportSet]:
+        """
+        Build, render, save and send the reports for already downloaded courses.
+        A course that fails is logged and left out, and the others carry on.
+        :param checkpoint: Where to record how far each course got, and to find
+            the reports of the courses that got further in an earlier run.
+        :param deliver: Whether to deliver the emails, rather than only leave them
+            in the outbox (e.g., for the daemon to deliver between its runs).
+        """
+        # Loads the reporters (and numpy), which runs like --flush-outbox never need
+        from reports import make_reports
+
+        if args.get("changed_only"):
+            state_path = args.get("state") or DEFAULT_STATE_PATH
+            fingerprints = load_fingerprints(state_path)
         logger.info("Building Reports")
-        report_sets = [make_reports(course, args) for course in courses]
+        resumed, built = [], []
+        changed: dict[int, dict[str, str]] = {}
+        with profiling.span("build reports"):
+            for course in courses:
+                if checkpoint is not None and checkpoint.reached(
+                    course["id"], RENDERED
+                ):
+                    resumed.append(checkpoint.load_reports(course["id"]))
+                    continue
+                with profiling.span(f"course {course['id']}", course_id=course["id"]):
+                    try:
+                        report_set = make_reports(course, args)
+                    except Exception as exception:
+                        self.course_failed(
+                            course["id"],
+                            "building the reports of",
+                            exception,
+                            args,
+                            checkpoint,
+                        )
+                        continue
+                if args.get("changed_only"):
+                    changed[course["id"]] = drop_unchanged([report_set], fingerprints)
+                built.append(report_set)
+        logger.info("Rendering Reports")
+        with profiling.span("render", courses=len(built)):
+            built = self.render(built, args, checkpoint)
+        if checkpoint is not None:
+            for report_set in built:
+                course_id = report_set.course["id"]
+                checkpoint.save_reports(report_set, changed.get(course_id, {}))
+        # Back in the order of the courses
+        order = {course["id"]: index for index, course in enumerate(courses)}
+        report_sets = sorted(
+            resumed + built, key=lambda report_set: order[report_set.course["id"]]
+        )
         self.update_progress()
         if args["output"]:
-            for report_set in report_sets:
-                report_set.output()
+            with profiling.span("output"):
+                for report_set in report_sets:
+                    report_set.output()
         self.update_progress()
         if args["email"]:
             logger.info("Sending emails")
-            only_emails = args["only"].split(",") if args["only"] else []
-            send_emails(report_sets, only_emails, settings)
+            only_emails = get_only_emails(args)
+            outbox_folder = args.get("outbox") or DEFAULT_OUTBOX
+            with profiling.span("email"):
+                emailed = [
+                    report_set
+                    for report_set in report_sets
+                    if self.queue_course_emails(
+                        report_set, only_emails, settings, args, checkpoint
+                    )
+                ]
+                if deliver:
+                    with profiling.span("deliver emails"):
+                        deliver_outbox(outbox_folder, settings)
         else:
             logger.info("Skipping emails")
+            self.mark_done(report_sets, checkpoint)
+        if args.get("changed_only") and args["email"]:
+            # Only remember the reports that made it into the outbox; the others
+            # still count as changed next time
+            sent = {report_set.course["id"] for report_set in emailed}
+            queued = {}
+            for course_id, course_fingerprints in changed.items():
+                if course_id in sent:
+                    queued.update(course_fingerprints)
+            if checkpoint is not None:
+                queued.update(checkpoint.get_fingerprints())
+            fingerprints.update(select_recipients(queued, get_only_emails(args)))
+            save_fingerprints(state_path, fingerprints)
         self.update_progress()
         logger.info("All done!")
         return report_sets
 
+    def render(
+        self,
+        report_sets: list[ReportSet],
+        args: CronyConfiguration,
+        checkpoint: Optional[Checkpoint] = None,
+    ) -> list[ReportSet]:
+        """
+        Render every course's reports together; if that fails, render them course
+        by course, to leave out only the courses that fail.
+        :return: The report sets that were rendered.
+        """
+        try:
+            return render_report_sets(report_sets, args.get("jobs"))
+        except Exception as exception:
+            if args["unsafe"]:
+                raise
+            logger.error(
+                f"Error while rendering, retrying course by course: {exception}"
+            )
+        rendered = []
+        for report_set in report_sets:
+            try:
+                render_report_sets([report_set], args.get("jobs"))
+            except Exception as exception:
+                self.course_failed(
+                    report_set.course["id"],
+                    "rendering the reports of",
+                    exception,
+                    args,
+                    checkpoint,
+                )
+                continue
+            rendered.append(report_set)
+        return rendered
+
+    def queue_course_emails(
+        self,
+        report_set: ReportSet,
+        only_emails: list[str],
+        settings: Settings,
+        args: CronyConfiguration,
+        checkpoint: Optional[Checkpoint] = None,
+    ) -> bool:
+        """
+        Put one course's emails in the outbox, and mark the course done: once in
+        the outbox, they are delivered even if this run fails. A course that fails
+        is left out, remembering which of its messages were already queued.
+        :return: Whether all of the course's emails were queued.
+        """
+        course_id = report_set.course["id"]
+        outbox_folder = args.get("outbox") or DEFAULT_OUTBOX
+        queued = checkpoint.get_queued(course_id) if checkpoint is not None else set()
+        try:
+            queue_emails([report_set], only_emails, settings, outbox_folder, queued)
+        except Exception as exception:
+            if checkpoint is not None:
+                checkpoint.save_queued(course_id, queued)
+            self.course_failed(
+                course_id, "emailing the reports of", exception, args, checkpoint
+            )
+            return False
+        self.mark_done([report_set], checkpoint)
+        return True
+
+    def mark_done(self, report_sets: list[ReportSet], checkpoint: Optional[Checkpoint]):
+        if checkpoint is not None:
+            for report_set in report_sets:
+                checkpoint.mark(report_set.course["id"], DONE)
+
+    def course_failed(
+        self,
+        course_id: int,
+        stage: str,
+        exception: Exception,
+        args: CronyConfiguration,
+        checkpoint: Optional[Checkpoint] = None,
+    ):
+        """
+        Log that a course failed and will be left out of the rest of the run (or,
+        with --unsafe, stop the run).
+        """
+        logger.error(f"Error while {stage} course {course_id}: {exception}")
+        if checkpoint is not None:
+            checkpoint.fail(course_id, exception)
+        if args["unsafe"]:
+            raise exception
+
     def start_progress_bar(self, progress: bool):
         if progress:
+            from tqdm import tqdm
+
             self.progress_bar = tqdm(total=5, desc="Cronying")
 
     def update_progress(self, amount=1):
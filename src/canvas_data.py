@@ -129,12 +129,78 @@ class Submission(TypedDict):
     html_url: str
 
 
+class TardinessBreakdown(TypedDict):
+    total: int
+    on_time: int
+    late: int
+    missing: int
+    floating: int
+
+
+class StudentSummary(TypedDict):
+    """
+    A student's activity in the course, from the Analytics API
+    """
+
+    id: int
+    page_views: int
+    max_page_views: int
+    page_views_level: int
+    participations: int
+    max_participations: int
+    participations_level: int
+    tardiness_breakdown: TardinessBreakdown
+
+
+class AssignmentTardiness(TypedDict):
+    # Fractions of the students, rather than counts
+    on_time: float
+    late: float
+    missing: float
+
+
+class AssignmentAnalytics(TypedDict):
+    """
+    An assignment's score distribution and tardiness, from the Analytics API
+    """
+
+    assignment_id: int
+    title: str
+    points_possible: float
+    due_at: str
+    min_score: float
+    max_score: float
+    median: float
+    first_quartile: float
+    third_quartile: float
+    tardiness_breakdown: AssignmentTardiness
+
+
+class CourseSchedule(TypedDict):
+    # An interval like "30m", "6h" or "1d"
+    every: str
+    # Local times of day, like "07:00"
+    at: list[str]
+
+
 class RawCourseData(TypedDict):
     id: int
     # Whether the course should be forced to be active or not; if None then use course time period
     active: Optional[bool]
     cohorts: dict[str, dict[str, list[str]]]
     instructors: list[str]
+    # Names of the reporters to run (e.g., "ungraded", "score"); all of them if not given
+    reports: Optional[list[str]]
+    # Emails of staff who want PDF attachments instead of reports in the email body
+    pdf_reports: Optional[list[str]]
+    # Whether to pull the student and assignment summaries from the Analytics API
+    analytics: Optional[bool]
+    # Export the gradebook when (students x assignments) is bigger than this (off if not
+    # given); graded submissions from the export have no grader, so the score and
+    # grading reports cannot credit them to anyone
+    bulk_export_above: Optional[int]
+    # When to run the course in --daemon mode (once a day if not given)
+    schedule: Optional[CourseSchedule]
 
 
 class CourseData(TypedDict):
@@ -143,6 +209,9 @@ class CourseData(TypedDict):
     # Course file Data
     cohorts: dict[str, list[User]]
     instructors: list[User]
+    reports: Optional[list[str]]
+    pdf_reports: Optional[list[str]]
+    analytics: Optional[bool]
     # Pulled data
     course: Course
     users: dict[int, User]
@@ -156,6 +225,9 @@ class CourseData(TypedDict):
     staff: dict[int, User]
     students: dict[int, User]
     speed_grader_url: str
+    # Only pulled when the course turns on `analytics` (otherwise empty)
+    student_summaries: dict[int, StudentSummary]
+    assignment_analytics: dict[int, AssignmentAnalytics]
 
 
 class Report(TypedDict):
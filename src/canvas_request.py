@@ -1,13 +1,37 @@
 from __future__ import annotations
-from typing import TypedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import TypedDict, Optional
+import os
+import re
+import threading
 import requests
-import time
 import json
-from datetime import datetime
-import requests_cache
+from datetime import datetime, timedelta
+from progress_poller import ProgressPoller, ProgressFailed
+import profiling
 from settings import Settings
 
 CANVAS_DATE_STRING = "%Y-%m-%dT%H:%M:%SZ"
+# Canvas only recomputes course analytics about once a day, so cached copies are
+# reused for a while instead of kept forever like everything else
+ANALYTICS_EXPIRE_AFTER = timedelta(hours=12)
+
+DOWNLOAD_CHUNK_SIZE = 512 * 1024
+# Files bigger than this are downloaded in ranges of this size, in parallel
+DOWNLOAD_PART_SIZE = 16 * 1024 * 1024
+DOWNLOAD_PARTS = 4
+# How many files `download_files` downloads at once
+DOWNLOAD_FILES = 4
+DOWNLOAD_RETRIES = 3
+DOWNLOAD_TIMEOUT = 60
+DOWNLOAD_ERRORS = (
+    requests.ConnectionError,
+    requests.Timeout,
+    requests.exceptions.ChunkedEncodingError,
+)
+CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+|\*)")
+UNSATISFIED_RANGE = re.compile(r"bytes \*/(\d+)")
+ENDPOINT_IDS = re.compile(r"\d+")
 
 
 def from_canvas_date(d1):
@@ -64,19 +88,96 @@ def check_response_errors(response, from_url):
         )
 
 
+def get_endpoint_group(verb, command) -> str:
+    """
+    A name for the endpoint that groups its requests together, whatever the ids
+    in it (e.g., "GET groups/*/users").
+    """
+    return f"{verb.__name__.upper()} {ENDPOINT_IDS.sub('*', command) or 'course'}"
+
+
+def get_download_size(response) -> Optional[int]:
+    """
+    The size of the whole file, from a full or partial (ranged) response.
+    """
+    if response.status_code == 206:
+        match = CONTENT_RANGE.match(response.headers.get("Content-Range", ""))
+        if match and match.group(3) != "*":
+            return int(match.group(3))
+        return None
+    if response.status_code == 416:
+        match = UNSATISFIED_RANGE.match(response.headers.get("Content-Range", ""))
+        return int(match.group(1)) if match else None
+    length = response.headers.get("Content-Length")
+    return int(length) if length is not None else None
+
+
+def get_ranges_path(partial: str) -> str:
+    """
+    Where a download in parallel ranges records which of its ranges are finished.
+    """
+    return partial + ".ranges"
+
+
+def load_finished_ranges(partial: str) -> Optional[dict]:
+    """
+    The finished ranges of a download in parallel ranges left from an earlier
+    failure, or None if the partial file (if any) was written from the start.
+    """
+    path = get_ranges_path(partial)
+    if not os.path.exists(path):
+        return None
+    with open(path) as ranges_file:
+        return json.load(ranges_file)
+
+
+def save_finished_ranges(partial: str, finished: dict):
+    # Write to a temporary file first, so a crash never leaves a corrupted record
+    path = get_ranges_path(partial)
+    with open(path + ".tmp", "w") as ranges_file:
+        json.dump(finished, ranges_file)
+    os.replace(path + ".tmp", path)
+
+
+def get_download_offset(response) -> int:
+    """
+    Where in the file a response starts (servers may ignore the requested range).
+    """
+    if response.status_code == 206:
+        match = CONTENT_RANGE.match(response.headers.get("Content-Range", ""))
+        if match:
+            return int(match.group(1))
+    return 0
+
+
 class CanvasData(TypedDict):
     pass
 
 
 class CanvasRequest:
-    def __init__(self, settings: Settings, cache: bool):
+    def __init__(self, settings: Settings, cache: bool, progress: bool = False):
         self.canvas_url = settings["canvas_url"] + "/"
         self.canvas_api_url = self.canvas_url + "api/v1/"
         self.canvas_token = settings["canvas_token"]
         if cache:
-            self.session = requests_cache.CachedSession("cron_cache")
+            import requests_cache
+
+            self.session = requests_cache.CachedSession(
+                "cron_cache",
+                urls_expire_after={
+                    "*/analytics/*": ANALYTICS_EXPIRE_AFTER,
+                    # Export progress and download links change from one request to the next
+                    "*/progress/*": requests_cache.DO_NOT_CACHE,
+                    "*/files/*": requests_cache.DO_NOT_CACHE,
+                },
+            )
         else:
             self.session = requests.Session()
+        # Progress jobs are polled from another thread, with its own session
+        self.progress_session = requests.Session()
+        # Downloads are streamed (never cached), with a session per thread
+        self.download_sessions = threading.local()
+        self.poller = ProgressPoller(self.fetch_progress, progress)
 
     def _canvas_request(
         self,
@@ -105,31 +206,39 @@ class CanvasRequest:
             next_url += f"courses/{course_id}/"
         next_url += command
         data["access_token"] = self.canvas_token
-        # Handle getting all the results
-        if all:
-            data["per_page"] = 100
-            final_result = []
-            while True:
+        with profiling.span(
+            get_endpoint_group(verb, command), endpoint=command, course_id=course_id
+        ):
+            # Handle getting all the results
+            if all:
+                data["per_page"] = 100
+                final_result = []
+                pages = 0
+                while True:
+                    response = verb(next_url, data=data, params=params)
+                    check_response_errors(response, next_url)
+                    if result_type == list:
+                        final_result += decode_response_or_error(response, next_url)
+                    elif result_type == dict:
+                        final_result.append(
+                            decode_response_or_error(response, next_url)
+                        )
+                    else:
+                        final_result = response
+                    pages += 1
+                    if "next" in response.links:
+                        next_url = response.links["next"]["url"]
+                    else:
+                        profiling.annotate(pages=pages)
+                        return final_result
+            # Only get one result
+            else:
                 response = verb(next_url, data=data, params=params)
                 check_response_errors(response, next_url)
-                if result_type == list:
-                    final_result += decode_response_or_error(response, next_url)
+                if result_type in (list, None):
+                    return decode_response_or_error(response, next_url)
                 elif result_type == dict:
-                    final_result.append(decode_response_or_error(response, next_url))
-                else:
-                    final_result = response
-                if "next" in response.links:
-                    next_url = response.links["next"]["url"]
-                else:
-                    return final_result
-        # Only get one result
-        else:
-            response = verb(next_url, data=data, params=params)
-            check_response_errors(response, next_url)
-            if result_type in (list, None):
-                return decode_response_or_error(response, next_url)
-            elif result_type == dict:
-                return [decode_response_or_error(response, next_url)]
+                    return [decode_response_or_error(response, next_url)]
 
     def get(
         self,
@@ -215,37 +324,190 @@ class CanvasRequest:
             use_api=use_api,
         )
 
-    def progress_loop(self, progress_id, DELAY=3):
-        while True:
-            (result,) = self._canvas_request(
-                self.session.get,
-                f"progress/{progress_id}",
-                None,
-                None,
-                False,
-                None,
-                dict,
-                True,
-            )
-            if result["workflow_state"] == "completed":
-                return True
-            elif result["workflow_state"] == "failed":
-                return False
+    def fetch_progress(self, progress_id) -> dict:
+        url = self.canvas_api_url + f"progress/{progress_id}"
+        response = self.progress_session.get(
+            url, data={"access_token": self.canvas_token}
+        )
+        check_response_errors(response, url)
+        return decode_response_or_error(response, url)
+
+    def watch_progress(self, progress_id) -> Future:
+        """
+        Follow a Canvas progress job without waiting for it.
+        :return: A future for the job's final progress object.
+        """
+        return self.poller.watch(progress_id)
+
+    def progress_loop(self, progress_id) -> bool:
+        """
+        Wait for a Canvas progress job, and say whether it completed.
+        """
+        try:
+            self.watch_progress(progress_id).result()
+            return True
+        except ProgressFailed:
+            return False
+
+    def request_range(self, url, start=0, end=None) -> requests.Response:
+        """
+        Start streaming the bytes of a file from `start` to `end` (inclusive).
+        """
+        if not hasattr(self.download_sessions, "session"):
+            self.download_sessions.session = requests.Session()
+        headers = {
+            "Range": f"bytes={start}-{'' if end is None else end}",
+            # Sizes are checked against the bytes on disk, so nothing compressed
+            "Accept-Encoding": "identity",
+        }
+        # Files redirect to signed URLs elsewhere, which must not get the token
+        if url.startswith(self.canvas_url):
+            headers["Authorization"] = f"Bearer {self.canvas_token}"
+        return self.download_sessions.session.get(
+            url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT
+        )
+
+    def download_file(self, url, destination, parts=DOWNLOAD_PARTS):
+        """
+        Stream a file to disk. Big files are downloaded in parallel byte ranges when
+        the server allows it, and a partial download left from an earlier failure
+        (`destination` + ".part") is resumed instead of started over.
+        :return: The destination path.
+        """
+        partial = destination + ".part"
+        finished = load_finished_ranges(partial)
+        if finished is not None:
+            # Ranged downloads fill in a file of the full size, so they are not a
+            # prefix to continue from, only a set of finished ranges
+            offset = 0
+        else:
+            offset = os.path.getsize(partial) if os.path.exists(partial) else 0
+        response = self.request_range(url, offset)
+        if response.status_code == 416 and get_download_size(response) != offset:
+            # The partial file is not from this file, so start over
+            response.close()
+            offset = 0
+            response = self.request_range(url)
+        if response.status_code == 416:
+            # Nothing left to download
+            response.close()
+            open(partial, "ab").close()
+            size = offset
+        else:
+            check_response_errors(response, url)
+            size = get_download_size(response)
+            ranged = response.status_code == 206
+            big = size is not None and size > DOWNLOAD_PART_SIZE
+            if ranged and offset == 0 and parts > 1 and big:
+                response.close()
+                self.download_ranges(response.url, partial, size, parts, finished)
             else:
-                # TODO: Replace with TQDM, proper logging
-                print(
-                    result["workflow_state"],
-                    result["message"],
-                    str(int(round(result["completion"] * 10)) / 10) + "%",
-                )
-                time.sleep(DELAY)
-
-    def download_file(self, url, destination):
-        data = {"access_token": self.canvas_token}
-        r = self.session.get(url, data=data)
-        f = open(destination, "wb")
-        for chunk in r.iter_content(chunk_size=512 * 1024):
-            if chunk:  # filter out keep-alive new chunks
-                f.write(chunk)
-        f.close()
+                if finished is not None:
+                    # Streamed from the start instead, over the ranges
+                    os.remove(get_ranges_path(partial))
+                self.download_stream(url, partial, response)
+        actual = os.path.getsize(partial)
+        if size is not None and actual != size:
+            os.remove(partial)
+            raise Exception(f"Downloaded {actual} bytes instead of {size} from:\n{url}")
+        os.replace(partial, destination)
         return destination
+
+    def download_stream(self, url, partial, response):
+        """
+        Write the rest of the file from one response, resuming where it stopped if
+        the connection drops.
+        """
+        for attempt in range(DOWNLOAD_RETRIES + 1):
+            # Servers that ignore the range send the whole file again
+            offset = get_download_offset(response)
+            try:
+                with open(partial, "r+b" if offset else "wb") as partial_file:
+                    partial_file.seek(offset)
+                    partial_file.truncate()
+                    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        partial_file.write(chunk)
+                return
+            except DOWNLOAD_ERRORS:
+                if attempt == DOWNLOAD_RETRIES:
+                    raise
+                response = self.request_range(url, os.path.getsize(partial))
+                check_response_errors(response, url)
+
+    def download_ranges(self, url, partial, size, parts, finished=None):
+        """
+        Download the file in parallel ranges into a file of its full size,
+        recording each finished range (see `get_ranges_path`), so that a failed
+        download resumes with only the ranges it is missing.
+        :param finished: The finished ranges left from an earlier failure, if any.
+        """
+        matching = (
+            finished is not None
+            and finished["size"] == size
+            and finished["part_size"] == DOWNLOAD_PART_SIZE
+            and os.path.exists(partial)
+            and os.path.getsize(partial) == size
+        )
+        if not matching:
+            finished = {"size": size, "part_size": DOWNLOAD_PART_SIZE, "starts": []}
+            # Recorded before the file is filled with zeroes, which are never
+            # mistaken for downloaded bytes
+            save_finished_ranges(partial, finished)
+            with open(partial, "wb") as partial_file:
+                partial_file.truncate(size)
+        done = set(finished["starts"])
+        ranges = [
+            (start, min(start + DOWNLOAD_PART_SIZE, size) - 1)
+            for start in range(0, size, DOWNLOAD_PART_SIZE)
+            if start not in done
+        ]
+        lock = threading.Lock()
+
+        def download_range(start, end):
+            self.download_range(url, partial, start, end)
+            with lock:
+                finished["starts"].append(start)
+                save_finished_ranges(partial, finished)
+
+        with ThreadPoolExecutor(parts, thread_name_prefix="download") as executor:
+            futures = [
+                executor.submit(download_range, start, end) for start, end in ranges
+            ]
+            for future in futures:
+                future.result()
+        os.remove(get_ranges_path(partial))
+
+    def download_range(self, url, partial, start, end):
+        """
+        Write one byte range of the file, resuming within it if the connection drops.
+        """
+        position = start
+        for attempt in range(DOWNLOAD_RETRIES + 1):
+            response = self.request_range(url, position, end)
+            check_response_errors(response, url)
+            if response.status_code != 206:
+                raise Exception(f"Server stopped honoring byte ranges for:\n{url}")
+            try:
+                with open(partial, "r+b") as partial_file:
+                    partial_file.seek(position)
+                    for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE):
+                        partial_file.write(chunk)
+                        position += len(chunk)
+                if position != end + 1:
+                    raise requests.exceptions.ChunkedEncodingError(
+                        f"Range ended at {position} instead of {end + 1}"
+                    )
+                return
+            except DOWNLOAD_ERRORS:
+                if attempt == DOWNLOAD_RETRIES:
+                    raise
+
+    def download_files(self, downloads: list[tuple[str, str]]) -> list[str]:
+        """
+        Download several (url, destination) files at the same time.
+        :return: The destination paths.
+        """
+        with ThreadPoolExecutor(DOWNLOAD_FILES, thread_name_prefix="files") as executor:
+            return list(
+                executor.map(lambda download: self.download_file(*download), downloads)
+            )
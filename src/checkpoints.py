@@ -0,0 +1,186 @@
+"""
+Checkpoints of a run, so that a failure late in a long run does not throw away
+everything before it: `--resume` picks up where the last run stopped.
+
+Each course is checkpointed as it goes: its snapshot once it is downloaded, its
+rendered reports once they are built, and a mark once its emails are in the
+outbox (which takes care of delivering them from there). A course whose emails
+only partly made it into the outbox remembers which ones did, so that `--resume`
+does not send them twice. A course that fails is
+logged and left behind, while the other courses carry on; `--resume` then only
+redoes what the failed courses had left to do. A run that finishes every course
+removes its checkpoint. Runs are only checkpointed when given `--checkpoint` (or
+`--resume`), so that by default they write nothing besides their output.
+
+    crony_checkpoint/
+        run.json             # The run's arguments, and how far each course got
+        course_<id>.pickle   # The downloaded course
+        reports_<id>.pickle  # Its rendered reports
+
+Courses are pickled, since they are full of shared references (every
+submission points at its assignment and user) that JSON would copy apart.
+"""
+
+from __future__ import annotations
+import json
+import logging
+import os
+import pickle
+import re
+
+from canvas_data import CourseData
+from cli_config import CronyConfiguration
+from outbox import write_atomically
+from reports.report_types import ReportSet
+
+logger = logging.getLogger("crony")
+
+DEFAULT_CHECKPOINT = "crony_checkpoint"
+# The stages each course goes through, in order
+DOWNLOADED = "downloaded"
+RENDERED = "rendered"
+DONE = "done"
+STAGES = [DOWNLOADED, RENDERED, DONE]
+# The arguments that change what a run makes; a checkpoint from a run with
+# different ones is not resumed
+RUN_ARGUMENTS = ["course", "courses", "email", "only", "output", "changed_only"]
+# The files a checkpoint writes (with the temporary ones of atomic writes)
+CHECKPOINT_FILES = re.compile(r"^(run\.json|(course|reports)_\d+\.pickle)(\.tmp)?$")
+
+
+def get_run_arguments(args: CronyConfiguration) -> dict:
+    return {name: args.get(name) for name in RUN_ARGUMENTS}
+
+
+class Checkpoint:
+    """
+    How far each course of the run got, with what it had made so far.
+    :param folder: Where to keep the checkpoint.
+    :param args: The arguments of the run.
+    :param resume: Whether to continue from the checkpoint already in the folder
+        (if it is from a run with the same arguments), instead of starting over.
+    """
+
+    def __init__(self, folder: str, args: CronyConfiguration, resume: bool = False):
+        self.folder = folder
+        self.run = {"arguments": get_run_arguments(args), "courses": {}}
+        if resume:
+            self.load()
+        else:
+            self.clear()
+
+    def get_path(self, filename: str) -> str:
+        return os.path.join(self.folder, filename)
+
+    def load(self):
+        path = self.get_path("run.json")
+        if not os.path.exists(path):
+            logger.info(f"No checkpoint in {self.folder} to resume, starting over")
+            return
+        with open(path) as run_file:
+            run = json.load(run_file)
+        if run["arguments"] != self.run["arguments"]:
+            logger.warning(
+                f"The checkpoint in {self.folder} is from a run with different"
+                f" arguments ({run['arguments']}), starting over"
+            )
+            self.clear()
+            return
+        self.run = run
+        logger.info(f"Resuming the run checkpointed in {self.folder}")
+
+    def write(self, filename: str, data: bytes):
+        os.makedirs(self.folder, exist_ok=True)
+        write_atomically(self.get_path(filename), data)
+
+    def save(self):
+        self.write("run.json", json.dumps(self.run, indent=1).encode("utf-8"))
+
+    def clear(self):
+        """
+        Remove the checkpoint's own files (and the folder, if that leaves it
+        empty), but nothing else that might be in the folder.
+        """
+        if not os.path.isdir(self.folder):
+            return
+        for filename in os.listdir(self.folder):
+            if CHECKPOINT_FILES.match(filename):
+                os.remove(self.get_path(filename))
+        try:
+            os.rmdir(self.folder)
+        except OSError:
+            pass
+
+    def get_course(self, course_id: int) -> dict:
+        return self.run["courses"].setdefault(str(course_id), {})
+
+    def reached(self, course_id: int, stage: str) -> bool:
+        """Whether the course already got through this stage."""
+        reached = self.run["courses"].get(str(course_id), {}).get("stage")
+        return reached is not None and STAGES.index(reached) >= STAGES.index(stage)
+
+    def mark(self, course_id: int, stage: str):
+        course = self.get_course(course_id)
+        course["stage"] = stage
+        course.pop("error", None)
+        self.save()
+
+    def fail(self, course_id: int, error: Exception):
+        self.get_course(course_id)["error"] = str(error)
+        self.save()
+
+    def save_course(self, course: CourseData):
+        data = pickle.dumps(course, protocol=pickle.HIGHEST_PROTOCOL)
+        self.write(f"course_{course['id']}.pickle", data)
+        self.mark(course["id"], DOWNLOADED)
+
+    def load_course(self, course_id: int) -> CourseData:
+        with open(self.get_path(f"course_{course_id}.pickle"), "rb") as course_file:
+            return pickle.load(course_file)
+
+    def save_reports(self, report_set: ReportSet, fingerprints: dict[str, str]):
+        """
+        :param fingerprints: The fingerprints of the reports (for --changed-only),
+            kept until the run is over and they can be saved.
+        """
+        course_id = report_set.course["id"]
+        data = pickle.dumps(report_set, protocol=pickle.HIGHEST_PROTOCOL)
+        self.write(f"reports_{course_id}.pickle", data)
+        self.get_course(course_id)["fingerprints"] = fingerprints
+        self.mark(course_id, RENDERED)
+
+    def load_reports(self, course_id: int) -> ReportSet:
+        with open(self.get_path(f"reports_{course_id}.pickle"), "rb") as reports_file:
+            return pickle.load(reports_file)
+
+    def get_queued(self, course_id: int) -> set[str]:
+        """The keys of the course's messages that are already in the outbox."""
+        return set(self.run["courses"].get(str(course_id), {}).get("queued", []))
+
+    def save_queued(self, course_id: int, queued: set[str]):
+        self.get_course(course_id)["queued"] = sorted(queued)
+        self.save()
+
+    def get_fingerprints(self) -> dict[str, str]:
+        """The fingerprints of the reports of every course done so far."""
+        fingerprints = {}
+        for course in self.run["courses"].values():
+            if course.get("stage") == DONE:
+                fingerprints.update(course.get("fingerprints", {}))
+        return fingerprints
+
+    def finish(self, course_ids: list[int]):
+        """
+        Remove the checkpoint if every course is done; otherwise keep it, so that
+        `--resume` can retry the rest.
+        """
+        unfinished = [
+            course_id for course_id in course_ids if not self.reached(course_id, DONE)
+        ]
+        if unfinished:
+            logger.warning(
+                f"Courses {unfinished} did not finish; run again with --resume to"
+                f" retry them (the checkpoint is in {self.folder})"
+            )
+        else:
+            self.clear()
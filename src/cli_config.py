@@ -1,6 +1,4 @@
-"""
-
-"""
+""" """
 
 from __future__ import annotations
 from typing import TypedDict, Optional
@@ -16,5 +14,39 @@ class CronyConfiguration(TypedDict):
     settings: Optional[str]
     output: Optional[str]
     log: str
+    # How many worker processes render reports (defaults to the number of cores)
+    jobs: Optional[int]
+    # Skip reports whose inputs are unchanged since the last run (tracked in `state`)
+    changed_only: bool
+    state: Optional[str]
+    # Folder to store mergeable per-course score summaries in, for rollups
+    summaries: Optional[str]
+    # Only roll up the summaries already in `summaries`, instead of running
+    rollup: bool
+    # Folder of emails waiting to be delivered, and whether to only send those
+    outbox: Optional[str]
+    flush_outbox: bool
+    # Stay resident, running each course on the schedule in its course file
+    daemon: bool
+    # Folder to write timings of the run's stages into, and which Python profiler
+    # (cprofile or sample) to run alongside, if any
+    profile: Optional[str]
+    profiler: Optional[str]
+    # Continue the last run from its checkpoint (kept in `checkpoint`), instead of
+    # starting over; runs are only checkpointed when either is given
+    resume: bool
+    checkpoint: Optional[str]
+    # File to append the spans of every run to (unless no_trace), as trace events
+    trace: Optional[str]
+    no_trace: bool
     # Whether to re-raise exceptions (unsafe) or suppress them (safe). Logs either way
     unsafe: bool
+
+
+def get_only_emails(args: CronyConfiguration) -> list[str]:
+    """
+    The emails that reports are restricted to (empty if everyone should get them).
+    """
+    if not args.get("only"):
+        return []
+    return [email.strip().lower() for email in args["only"].split(",")]
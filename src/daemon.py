@@ -0,0 +1,329 @@
+"""
+A resident mode (`--daemon`) that runs each course on its own schedule, instead
+of starting from scratch for every cron invocation.
+
+Between runs it keeps the Canvas session (and its connection pool), the parsed
+course files and the last downloaded copy of each course. Course files are
+checked for changes before every wake up, and only the ones that changed on disk
+are parsed again. Schedules come from each course file, e.g.:
+
+    schedule:
+      every: 6h              # Run every six hours (also "30m", "1d")
+      at: ["07:00", "19:00"] # And/or at these local times each day
+
+Courses without a schedule run once a day. In between, every assignment's due
+and lock dates are tracked (see `deadlines`), and passing one refreshes only that
+assignment and the reports about it. Emails get one delivery attempt after each
+run; whatever fails is retried on later wake ups (backing off), rather than
+holding up the courses and deadlines that come due meanwhile.
+"""
+
+from __future__ import annotations
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Optional, TYPE_CHECKING
+import logging
+import os
+import re
+import signal
+import threading
+
+from canvas import CanvasApi
+from canvas_data import CourseData, CourseSchedule, RawCourseData, load_course_data
+from cli_config import CronyConfiguration, get_only_emails
+from deadlines import (
+    DeadlineQueue,
+    DEADLINE_REPORTS,
+    get_affected_staff,
+    get_postponed,
+)
+from email_service import deliver_outbox, get_retry_delay
+import outbox
+from outbox import DEFAULT_OUTBOX
+from reports.registry import get_enabled_reporters
+import profiling
+import tracing
+from settings import Settings
+
+if TYPE_CHECKING:
+    from canvas_crony import CanvasCrony
+
+logger = logging.getLogger("crony")
+
+DEFAULT_SCHEDULE: CourseSchedule = {"every": "1d"}
+# How often to look for changed course files, even if nothing is due
+RELOAD_INTERVAL = timedelta(minutes=1)
+# The longest to wait before trying to deliver emails again (in seconds)
+MAX_DELIVERY_DELAY = 60 * 60
+INTERVAL = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([smhd])\s*$")
+INTERVAL_UNITS = {"s": "seconds", "m": "minutes", "h": "hours", "d": "days"}
+
+
+def parse_interval(interval: str) -> timedelta:
+    match = INTERVAL.match(str(interval))
+    if not match:
+        raise ValueError(f"Not a schedule interval (like 30m or 6h): {interval!r}")
+    amount, unit = match.groups()
+    return timedelta(**{INTERVAL_UNITS[unit]: float(amount)})
+
+
+def next_run(
+    schedule: CourseSchedule, now: datetime, last_run: Optional[datetime]
+) -> datetime:
+    """
+    When a course should next run: the soonest of its interval since the last run
+    (or right away, if it never ran) and its next daily time.
+    """
+    candidates = []
+    if schedule.get("every"):
+        every = parse_interval(schedule["every"])
+        candidates.append(now if last_run is None else last_run + every)
+    for time_of_day in schedule.get("at", []):
+        hour, minute = (int(part) for part in time_of_day.split(":"))
+        today = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+        candidates.append(today if today > now else today + timedelta(days=1))
+    if not candidates:
+        raise ValueError(f"Schedules need `every` or `at`: {schedule!r}")
+    return min(candidates)
+
+
+@dataclass
+class CourseJob:
+    path: str
+    modified: float
+    raw: RawCourseData
+    due: datetime
+    last_run: Optional[datetime] = None
+    # The course as of its last run
+    snapshot: Optional[CourseData] = None
+
+    @property
+    def schedule(self) -> CourseSchedule:
+        return self.raw.get("schedule") or DEFAULT_SCHEDULE
+
+
+class CronyDaemon:
+    """
+    Runs the crony's courses on their schedules until stopped (Ctrl+C or SIGTERM).
+    """
+
+    def __init__(
+        self, crony: CanvasCrony, args: CronyConfiguration, settings: Settings
+    ):
+        self.crony = crony
+        self.args = args
+        self.settings = settings
+        self.canvas = CanvasApi(settings, args["cache"], args["progress"])
+        self.jobs: dict[str, CourseJob] = {}
+        # When each course file that could not be loaded was last changed, so
+        # that it is only tried again once it changes
+        self.broken: dict[str, float] = {}
+        self.deadlines = DeadlineQueue()
+        self.stopping = threading.Event()
+        # When to next deliver the emails in the outbox, and how many times in a
+        # row that has left some behind
+        self.deliver_at: Optional[datetime] = datetime.now()
+        self.delivery_retries = 0
+
+    def get_course_paths(self) -> list[str]:
+        if self.args["course"] is not None:
+            return [self.args["course"]]
+        if self.args["courses"] is not None:
+            return [
+                os.path.join(self.args["courses"], filename)
+                for filename in sorted(os.listdir(self.args["courses"]))
+            ]
+        raise ValueError("Need to have either `courses` or `course` provided")
+
+    def reload_courses(self):
+        """
+        Parse the course files that are new or changed on disk, and forget the
+        ones that are gone. A course file that cannot be loaded is logged and
+        skipped, keeping the last version of it that could.
+        """
+        now = datetime.now()
+        paths = self.get_course_paths()
+        for path in set(self.jobs) - set(paths):
+            logger.info(f"Course file {path} is gone, no longer scheduling it")
+            del self.jobs[path]
+            self.deadlines.forget(path)
+        for path in set(self.broken) - set(paths):
+            del self.broken[path]
+        for path in paths:
+            try:
+                self.reload_course(path, now)
+            except Exception as exception:
+                kept = ", keeping its last version" if path in self.jobs else ""
+                logger.error(
+                    f"Error while loading course file {path}{kept}: {exception}"
+                )
+                if self.args["unsafe"]:
+                    raise
+
+    def reload_course(self, path: str, now: datetime):
+        modified = os.path.getmtime(path)
+        job = self.jobs.get(path)
+        if job is not None and job.modified == modified:
+            return
+        if self.broken.get(path) == modified:
+            return
+        # Remembered first, so that a broken file is not retried until it changes
+        self.broken[path] = modified
+        raw = load_course_data(path)
+        if not isinstance(raw, dict) or "id" not in raw:
+            raise ValueError("Course files need to have an `id`")
+        schedule = raw.get("schedule") or DEFAULT_SCHEDULE
+        due = next_run(schedule, now, job.last_run if job is not None else None)
+        del self.broken[path]
+        if job is None:
+            logger.info(f"Scheduling course {raw['id']} from {path}")
+            self.jobs[path] = CourseJob(path, modified, raw, due)
+        else:
+            logger.info(f"Reloading changed course file {path}")
+            job.modified, job.raw, job.due = modified, raw, due
+
+    def run_due(self):
+        now = datetime.now()
+        due = [job for job in self.jobs.values() if job.due <= now]
+        if not due:
+            return
+        tracing.new_trace()
+        try:
+            with profiling.span("scheduled run", courses=len(due)):
+                # A course that fails to download does not hold up the others
+                courses = self.canvas.rehydrate_courses(
+                    [job.raw for job in due],
+                    on_error=lambda course_id, error: self.crony.course_failed(
+                        course_id, "downloading", error, self.args
+                    ),
+                )
+                self.crony.report(courses, self.args, self.settings, deliver=False)
+            self.deliver_at = datetime.now()
+            downloaded = {course["id"]: course for course in courses}
+            for job in due:
+                if job.raw["id"] in downloaded:
+                    job.snapshot = downloaded[job.raw["id"]]
+                    self.deadlines.reschedule(job.path, job.snapshot, datetime.now())
+        except Exception as exception:
+            logger.error(f"Error during scheduled run: {exception}")
+            if self.args["unsafe"]:
+                raise
+        finally:
+            # Failed runs wait for their next turn, rather than retrying at once
+            for job in due:
+                job.last_run = now
+                job.due = next_run(job.schedule, datetime.now(), now)
+
+    def run_deadlines(self):
+        for path, passed in self.deadlines.pop_due(datetime.now()).items():
+            job = self.jobs.get(path)
+            if job is None or job.snapshot is None:
+                continue
+            tracing.new_trace()
+            try:
+                with profiling.span(
+                    "deadline",
+                    course_id=job.raw["id"],
+                    assignments=len(passed),
+                ):
+                    self.run_deadline(job, passed)
+            except Exception as exception:
+                logger.error(f"Error after a deadline in {path}: {exception}")
+                if self.args["unsafe"]:
+                    raise
+
+    def run_deadline(self, job: CourseJob, passed: dict[int, set[datetime]]):
+        """
+        Refresh the assignments whose deadlines just passed, and remake only the
+        reports they affect, only for the staff they affect. Assignments whose
+        deadlines were moved to later are skipped, and wait for their new dates.
+        :param passed: The dates that passed for each assignment.
+        """
+        course = self.canvas.refresh_assignments(job.snapshot, set(passed))
+        postponed = get_postponed(job.snapshot, course, passed, datetime.now())
+        job.snapshot = course
+        self.deadlines.reschedule(job.path, course, datetime.now())
+        if postponed:
+            logger.info(
+                f"Deadlines of assignments {sorted(postponed)} of course"
+                f" {course['id']} were moved, waiting for them"
+            )
+        assignment_ids = set(passed) - postponed
+        if not assignment_ids:
+            return
+        reports = [
+            reporter.name
+            for reporter in get_enabled_reporters(course)
+            if reporter.name in DEADLINE_REPORTS
+        ]
+        emails = get_affected_staff(course, assignment_ids)
+        only_emails = get_only_emails(self.args)
+        if only_emails:
+            emails = [email for email in emails if email in only_emails]
+        if not reports or not emails:
+            return
+        logger.info(
+            f"Deadlines passed for assignments {sorted(assignment_ids)} of course"
+            f" {course['id']}, remaking {reports} for {len(emails)} staff"
+        )
+        args = {**self.args, "only": ",".join(emails)}
+        self.crony.report(
+            [{**course, "reports": reports}], args, self.settings, deliver=False
+        )
+        self.deliver_at = datetime.now()
+
+    def deliver_emails(self):
+        """
+        Try once to deliver the emails in the outbox, when it is time to. Failed
+        ones are retried on a later wake up, backing off while they keep failing,
+        so that the daemon never sleeps on them.
+        """
+        if self.deliver_at is None or self.deliver_at > datetime.now():
+            return
+        folder = self.args.get("outbox") or DEFAULT_OUTBOX
+        with profiling.span("deliver emails"):
+            deliver_outbox(folder, self.settings, rounds=1, stopping=self.stopping)
+        if outbox.pending(folder):
+            delay = min(get_retry_delay(self.delivery_retries), MAX_DELIVERY_DELAY)
+            self.delivery_retries += 1
+            self.deliver_at = datetime.now() + timedelta(seconds=delay)
+        else:
+            self.delivery_retries = 0
+            self.deliver_at = None
+
+    def wait(self):
+        """
+        Sleep until the next course is due, waking up now and then to look for
+        changed course files.
+        """
+        wake_up = datetime.now() + RELOAD_INTERVAL
+        if self.jobs:
+            wake_up = min(wake_up, min(job.due for job in self.jobs.values()))
+        if self.deadlines.next_time() is not None:
+            wake_up = min(wake_up, self.deadlines.next_time())
+        if self.deliver_at is not None:
+            wake_up = min(wake_up, self.deliver_at)
+        self.stopping.wait(max(0.0, (wake_up - datetime.now()).total_seconds()))
+
+    def stop(self, *signal_arguments):
+        logger.info("Stopping the Canvas Crony daemon")
+        self.stopping.set()
+
+    def run_forever(self):
+        logger.info("Starting the Canvas Crony daemon")
+        signal.signal(signal.SIGTERM, self.stop)
+        try:
+            while not self.stopping.is_set():
+                # Nothing that goes wrong in one wake up stops the daemon
+                try:
+                    self.reload_courses()
+                    self.run_due()
+                    self.run_deadlines()
+                    self.deliver_emails()
+                except Exception as exception:
+                    logger.error(f"Error in the Canvas Crony daemon: {exception}")
+                    if self.args["unsafe"]:
+                        raise
+                self.wait()
+        except KeyboardInterrupt:
+            self.stop()
@@ -0,0 +1,135 @@
+"""
+A timer queue of every assignment's due and lock dates (including overrides),
+so that `--daemon` can react right after a deadline passes: it refreshes only
+that assignment and its submissions, and only remakes the reports about ungraded
+work for the staff whose students just became ready to grade. Deadlines moved to
+later in the meantime are waited for instead.
+"""
+
+from __future__ import annotations
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+import heapq
+
+from canvas_data import CourseData, NOT_CRITICAL
+from canvas_request import from_canvas_date
+from reports.course_helpers import classify_submission, get_staff_for_student
+
+# Canvas takes a moment to mark submissions late or missing after a deadline
+DEADLINE_GRACE = timedelta(minutes=2)
+# The reporters whose reports change when a deadline passes
+DEADLINE_REPORTS = ["ungraded", "progress"]
+
+
+def local_time(canvas_date: str) -> datetime:
+    """A Canvas (UTC) date as a naive local time, like `datetime.now()`."""
+    utc = from_canvas_date(canvas_date).replace(tzinfo=timezone.utc)
+    return utc.astimezone().replace(tzinfo=None)
+
+
+def get_deadlines(course: CourseData) -> set[tuple[datetime, int]]:
+    """
+    Every (time, assignment id) at which one of the course's deadlines passes.
+    """
+    deadlines = set()
+    for assignment in course["assignments"].values():
+        if not assignment.get("published", True):
+            continue
+        for dated in [assignment, *(assignment.get("overrides") or [])]:
+            for key in ("due_at", "lock_at"):
+                if dated.get(key):
+                    deadlines.add((local_time(dated[key]), assignment["id"]))
+    return deadlines
+
+
+@dataclass(order=True)
+class Deadline:
+    at: datetime
+    path: str = field(compare=False)
+    assignment_id: int = field(compare=False)
+
+
+class DeadlineQueue:
+    """
+    The upcoming deadlines of every scheduled course, soonest first.
+    """
+
+    def __init__(self):
+        self.heap: list[Deadline] = []
+
+    def reschedule(self, path: str, course: CourseData, now: datetime):
+        """Replace the deadlines of the course from this course file."""
+        self.heap = [deadline for deadline in self.heap if deadline.path != path]
+        for at, assignment_id in get_deadlines(course):
+            if at + DEADLINE_GRACE > now:
+                self.heap.append(Deadline(at + DEADLINE_GRACE, path, assignment_id))
+        heapq.heapify(self.heap)
+
+    def forget(self, path: str):
+        self.heap = [deadline for deadline in self.heap if deadline.path != path]
+        heapq.heapify(self.heap)
+
+    def next_time(self) -> Optional[datetime]:
+        return self.heap[0].at if self.heap else None
+
+    def pop_due(self, now: datetime) -> dict[str, dict[int, set[datetime]]]:
+        """
+        Take the deadlines that have passed.
+        :return: The dates that passed for each assignment, for each course file.
+        """
+        due: dict[str, dict[int, set[datetime]]] = {}
+        while self.heap and self.heap[0].at <= now:
+            deadline = heapq.heappop(self.heap)
+            passed = due.setdefault(deadline.path, {})
+            passed.setdefault(deadline.assignment_id, set()).add(
+                deadline.at - DEADLINE_GRACE
+            )
+        return due
+
+
+def get_postponed(
+    old: CourseData,
+    new: CourseData,
+    passed: dict[int, set[datetime]],
+    now: datetime,
+) -> set[int]:
+    """
+    The assignments whose deadlines had passed by the old course, but not by the
+    new (refreshed) one: their dates were moved to later (or dropped) since then.
+    :param passed: The dates that passed for each assignment, as of the old course.
+    """
+    old_dates: dict[int, set[datetime]] = {}
+    for at, assignment_id in get_deadlines(old):
+        old_dates.setdefault(assignment_id, set()).add(at)
+    new_dates: dict[int, set[datetime]] = {}
+    for at, assignment_id in get_deadlines(new):
+        new_dates.setdefault(assignment_id, set()).add(at)
+    postponed = set()
+    for assignment_id, dates in passed.items():
+        dates_now = new_dates.get(assignment_id, set())
+        moved = dates_now - old_dates.get(assignment_id, set())
+        if dates & dates_now:
+            continue
+        if any(at + DEADLINE_GRACE <= now for at in moved):
+            continue
+        postponed.add(assignment_id)
+    return postponed
+
+
+def get_affected_staff(course: CourseData, assignment_ids: set[int]) -> list[str]:
+    """
+    The emails of the staff with students whose work on these assignments needs
+    attention (e.g., just became ready to grade).
+    """
+    staff_for_student = get_staff_for_student(course)
+    emails = set()
+    for submission in course["submissions"].values():
+        if submission["assignment"]["id"] not in assignment_ids:
+            continue
+        status = classify_submission(submission, course["group_membership_ids"])
+        if status in NOT_CRITICAL:
+            continue
+        for ta in staff_for_student.get(submission["user"]["id"], []):
+            emails.add(ta["email"])
+    return sorted(emails)
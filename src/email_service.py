@@ -1,19 +1,194 @@
 from __future__ import annotations
-import os
-from collections import defaultdict
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from email.message import EmailMessage
+from io import BytesIO
+from typing import Optional
+import hashlib
+import math
+import queue
 import smtplib
+import ssl
+import threading
+import time
 import logging
+import zipfile
 
+import outbox
+import profiling
+from outbox import DEFAULT_OUTBOX
+from reports.fingerprints import fingerprint, report_key
+from reports.html_tools import html_page
 from reports.report_types import Report, ReportSet
 from settings import Settings
 
 logger = logging.getLogger("crony")
 
+# Defaults for the optional mail settings
+MAIL_CONNECTIONS = 4
+MAIL_MESSAGES_PER_CONNECTION = 100
+SMTP_TIMEOUT = 60
+# Errors that mean the connection is gone, rather than that the message was bad
+DROPPED_CONNECTION = (smtplib.SMTPServerDisconnected, ConnectionError)
+# Messages bigger than this (in bytes) are split up; relays often refuse ~10MB
+MAX_MESSAGE_SIZE = 8 * 1024 * 1024
+BUNDLE_FILENAME = "reports.zip"
+# Rounds of delivery in one run, waiting longer before each retry
+DELIVERY_ROUNDS = 4
+RETRY_DELAY = 10
+RETRY_BACKOFF = 3
+
+
+class RateLimiter:
+    """
+    Blocks senders so that no more than `per_minute` messages go out in any minute.
+    """
+
+    def __init__(self, per_minute: Optional[int]):
+        self.per_minute = per_minute
+        self.sent: deque[float] = deque()
+        self.lock = threading.Lock()
+
+    def wait(self):
+        if not self.per_minute:
+            return
+        with self.lock:
+            while True:
+                now = time.monotonic()
+                while self.sent and self.sent[0] <= now - 60:
+                    self.sent.popleft()
+                if len(self.sent) < self.per_minute:
+                    break
+                time.sleep(self.sent[0] + 60 - now)
+            self.sent.append(now)
+
+
+class SmtpConnection:
+    def __init__(self, server: smtplib.SMTP):
+        self.server = server
+        self.sent = 0
+
+    def close(self):
+        try:
+            self.server.quit()
+        except smtplib.SMTPException:
+            self.server.close()
+
+
+class SmtpPool:
+    """
+    A few persistent SMTP connections, shared by the sending threads. Connections
+    are opened when first needed, replaced when they drop, and retired after
+    sending `mail_messages_per_connection` messages.
+    """
+
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.size = settings.get("mail_connections") or MAIL_CONNECTIONS
+        self.per_connection = (
+            settings.get("mail_messages_per_connection") or MAIL_MESSAGES_PER_CONNECTION
+        )
+        self.limiter = RateLimiter(settings.get("mail_messages_per_minute"))
+        self.idle: queue.LifoQueue[SmtpConnection] = queue.LifoQueue()
+
+    def connect(self) -> SmtpConnection:
+        server = smtplib.SMTP(
+            self.settings["mail_server"],
+            self.settings["mail_server_port"],
+            timeout=SMTP_TIMEOUT,
+        )
+        if self.settings.get("mail_starttls"):
+            server.starttls(context=ssl.create_default_context())
+        if self.settings.get("mail_username"):
+            server.login(
+                self.settings["mail_username"], self.settings.get("mail_password", "")
+            )
+        return SmtpConnection(server)
+
+    def acquire(self) -> SmtpConnection:
+        # At most `size` threads send at once, so this never opens more connections
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            return self.connect()
+
+    def release(self, connection: SmtpConnection):
+        if connection.sent >= self.per_connection:
+            connection.close()
+        else:
+            self.idle.put(connection)
+
+    def send(self, message: EmailMessage) -> dict:
+        """
+        Send one message over a pooled connection, reconnecting once if it dropped.
+        :return: The recipients that the server refused, if any.
+        """
+        self.limiter.wait()
+        connection = self.acquire()
+        try:
+            try:
+                refused = connection.server.send_message(message)
+            except DROPPED_CONNECTION:
+                connection.server.close()
+                connection = self.connect()
+                refused = connection.server.send_message(message)
+        except Exception:
+            connection.server.close()
+            raise
+        connection.sent += 1
+        self.release(connection)
+        return refused
+
+    def close(self):
+        while not self.idle.empty():
+            self.idle.get_nowait().close()
+
 
 def send_emails(
-    report_sets: list[ReportSet], only_emails: list[str], settings: Settings
-):
+    report_sets: list[ReportSet],
+    only_emails: list[str],
+    settings: Settings,
+    outbox_folder: str = DEFAULT_OUTBOX,
+) -> int:
+    """
+    Put each recipient's reports in the outbox as one message, and deliver them.
+    :return: How many messages were delivered.
+    """
+    queue_emails(report_sets, only_emails, settings, outbox_folder)
+    with profiling.span("deliver emails"):
+        delivered = deliver_outbox(outbox_folder, settings)
+        profiling.annotate(delivered=delivered)
+    return delivered
+
+
+def get_message_key(reports: list[Report]) -> str:
+    """
+    Names one recipient's message after the reports in it (and their contents).
+    """
+    digest = hashlib.sha256()
+    for report in reports:
+        digest.update(f"{report_key(report)} {fingerprint(report)}\n".encode("utf-8"))
+    return digest.hexdigest()[:16]
+
+
+def queue_emails(
+    report_sets: list[ReportSet],
+    only_emails: list[str],
+    settings: Settings,
+    outbox_folder: str = DEFAULT_OUTBOX,
+    queued: Optional[set[str]] = None,
+) -> int:
+    """
+    Put each recipient's reports in the outbox as one message (or a few, if they
+    are too big), without delivering them yet.
+    :param queued: The keys (see `get_message_key`) of the messages that are
+        already queued, e.g., by an earlier run, which are skipped. Each newly
+        queued message's key is added to it as soon as it is in the outbox.
+    :return: How many messages were queued.
+    """
+    if queued is None:
+        queued = set()
     grouped_targets = defaultdict(list)
     for report_set in report_sets:
         for report in report_set.reports:
@@ -21,11 +196,161 @@ def send_emails(
             if only_emails and email not in only_emails:
                 continue
             grouped_targets[email].append(report)
-    for email, reports in grouped_targets.items():
-        send_email(reports, settings)
+    max_size = settings.get("mail_max_message_size") or MAX_MESSAGE_SIZE
+    with profiling.span("prepare emails", recipients=len(grouped_targets)):
+        messages = 0
+        for reports in grouped_targets.values():
+            key = get_message_key(reports)
+            if key in queued:
+                continue
+            for part, message in enumerate(make_messages(reports, max_size), 1):
+                outbox.enqueue(outbox_folder, message, f"{key}-{part}")
+                messages += 1
+            queued.add(key)
+        profiling.annotate(messages=messages)
+    return messages
+
 
+def get_retry_delay(retries: int) -> float:
+    """Seconds to wait before trying failed deliveries again, after `retries` retries."""
+    return RETRY_DELAY * RETRY_BACKOFF**retries
 
-def send_email(reports: list[Report], settings: Settings) -> bool:
+
+def deliver_outbox(
+    folder: str,
+    settings: Settings,
+    rounds: int = DELIVERY_ROUNDS,
+    stopping: Optional[threading.Event] = None,
+) -> int:
+    """
+    Send the messages waiting in the outbox, retrying failures with backoff.
+    Whatever still fails stays in the outbox for the next run or --flush-outbox.
+    :param rounds: How many times to try (e.g., just once, to retry later instead).
+    :param stopping: Set to stop waiting for the next round, e.g., on shutdown.
+    :return: How many messages were delivered.
+    """
+    delivered = 0
+    stopping = stopping or threading.Event()
+    pool = SmtpPool(settings)
+    try:
+        for attempt in range(rounds):
+            waiting = outbox.pending(folder)
+            if not waiting:
+                break
+            if attempt:
+                delay = get_retry_delay(attempt - 1)
+                logger.info(f"Retrying {len(waiting)} emails in {delay} seconds")
+                if stopping.wait(delay):
+                    break
+            send = profiling.inherit(lambda path: deliver_message(path, pool))
+            with ThreadPoolExecutor(pool.size, thread_name_prefix="smtp") as executor:
+                delivered += sum(executor.map(send, waiting))
+    finally:
+        pool.close()
+    remaining = len(outbox.pending(folder))
+    if remaining:
+        logger.warning(
+            f"{remaining} emails are still in the outbox ({folder}); "
+            "send them later with --flush-outbox"
+        )
+    return delivered
+
+
+@dataclass
+class Attachment:
+    data: bytes
+    maintype: str
+    subtype: str
+    filename: str
+
+    def encoded_size(self) -> int:
+        # Base64 turns every 3 bytes into 4, in lines of 76 characters
+        return math.ceil(len(self.data) / 3) * 4 * 78 // 76
+
+
+def bundle_attachments(attachments: list[Attachment]) -> Optional[Attachment]:
+    """
+    A zip of all the attachments, if that is any smaller than sending them as-is.
+    """
+    if len(attachments) < 2:
+        return None
+    archive = BytesIO()
+    with zipfile.ZipFile(archive, "w", zipfile.ZIP_DEFLATED) as zip_file:
+        for attachment in attachments:
+            zip_file.writestr(attachment.filename, attachment.data)
+    bundle = Attachment(archive.getvalue(), "application", "zip", BUNDLE_FILENAME)
+    if len(bundle.data) < sum(len(attachment.data) for attachment in attachments):
+        return bundle
+    return None
+
+
+def split_attachments(
+    attachments: list[Attachment], budget: int
+) -> list[list[Attachment]]:
+    """
+    Group the attachments (in order) so that each group fits in the budget. An
+    attachment too big for any message goes alone, and the server may refuse it.
+    """
+    groups = [[]]
+    used = 0
+    for attachment in attachments:
+        size = attachment.encoded_size()
+        if groups[-1] and used + size > budget:
+            groups.append([])
+            used = 0
+        if size > budget:
+            logger.warning(f"{attachment.filename} is bigger than a whole email")
+        groups[-1].append(attachment)
+        used += size
+    return groups
+
+
+def make_messages(
+    reports: list[Report], max_size: int = MAX_MESSAGE_SIZE
+) -> list[EmailMessage]:
+    """
+    The messages for one recipient's reports: one, unless their attachments are
+    too big for a single message, in which case they are split over several.
+    """
+    msg = make_message(reports)
+    budget = max_size - len(msg.as_bytes())
+    attachments = [
+        Attachment(report.render(), report.maintype, report.subtype, report.filename)
+        for report in reports
+        if not report.embedded
+    ]
+    # A zip cannot be split up, so it is only used if it fits in one message
+    bundle = bundle_attachments(attachments)
+    if bundle is not None and bundle.encoded_size() <= budget:
+        attachments = [bundle]
+    groups = split_attachments(attachments, budget)
+    messages = [msg]
+    for part, group in enumerate(groups[1:], start=2):
+        more = EmailMessage()
+        more["Subject"] = f"{msg['Subject']} (part {part} of {len(groups)})"
+        more["From"], more["To"] = msg["From"], msg["To"]
+        more.set_content(
+            f"Here are more of your reports (part {part} of {len(groups)})."
+        )
+        messages.append(more)
+    if len(groups) > 1:
+        msg.replace_header("Subject", f"{msg['Subject']} (part 1 of {len(groups)})")
+    for message, group in zip(messages, groups):
+        for attachment in group:
+            message.add_attachment(
+                attachment.data,
+                maintype=attachment.maintype,
+                subtype=attachment.subtype,
+                filename=attachment.filename,
+            )
+    return messages
+
+
+def make_message(reports: list[Report]) -> EmailMessage:
+    """
+    The message for one recipient's reports, with the embedded ones in its body
+    (attachments are added by `make_messages`).
+    """
     # Arbitrarily choose first report, they should all have the same header info!
     report = reports[0]
     msg = EmailMessage()
@@ -36,39 +361,62 @@ def send_email(reports: list[Report], settings: Settings) -> bool:
             course_name=report.course["course"]["name"], user_name=report.target["name"]
         )
     msg["From"] = "Canvas Crony Tool <noreply+canvas_crony@udel.edu>"
-    msg["To"] = f"{report.target['name']} <{report.target['email']}"
+    msg["To"] = f"{report.target['name']} <{report.target['email']}>"
     # definitely don't mess with the .preamble
 
     if len(reports) > 1:
-        msg.set_content(
+        greeting = (
             "Hi, I am the Canvas Crony! I send you regular updates on some of your courses."
             " I have some reports for you!"
         )
     else:
-        msg.set_content(
+        greeting = (
             "Hi, I am the Canvas Crony! I send you regular updates on some of your courses."
             " I have a report for you!"
         )
 
-    for report in reports:
-        with open(report.path, "rb") as fp:
-            msg.add_attachment(
-                fp.read(),
-                maintype=report.maintype,
-                subtype=report.subtype,
-                filename=report.filename,
-            )
+    # Lightweight reports go right in the body, with a plain text alternative
+    embedded = [report for report in reports if report.embedded]
+    msg.set_content("\n\n".join([greeting, *(report.text() for report in embedded)]))
+    if embedded:
+        msg.add_alternative(
+            html_page(
+                msg["Subject"],
+                [f"<p>{greeting}</p>", *(report.html() for report in embedded)],
+            ),
+            subtype="html",
+        )
 
-    # Notice how smtplib now includes a send_message() method
-    mail_server = settings["mail_server"]
-    mail_server_port = settings["mail_server_port"]
+    return msg
+
+
+def is_permanent(error: Exception) -> bool:
+    """
+    Whether the server rejected the message itself, so retrying cannot help.
+    """
+    if isinstance(error, smtplib.SMTPRecipientsRefused):
+        return True
+    return isinstance(error, smtplib.SMTPResponseException) and error.smtp_code >= 500
+
+
+def deliver_message(path: str, pool: SmtpPool) -> bool:
+    """
+    Send one message from the outbox, and take it out once it is sent.
+    """
+    message = outbox.load_message(path)
     try:
-        with smtplib.SMTP(mail_server, mail_server_port) as s:
-            result = s.send_message(msg)
-            if result:
-                logger.info(result)
-            else:
-                logger.info(f"Sent {len(reports)} reports to {msg['To']}")
+        with profiling.span("email"):
+            result = pool.send(message)
     except Exception as exception:
-        logger.error(f"Error while sending email to {msg['To']}: {exception}")
-    return False
+        retrying = outbox.record_failure(path, exception, is_permanent(exception))
+        logger.error(
+            f"Error while sending email to {message['To']}: {exception}"
+            + (" (will retry)" if retrying else " (gave up)")
+        )
+        return False
+    if result:
+        logger.info(result)
+    else:
+        logger.info(f"Sent reports to {message['To']}")
+    outbox.remove(path)
+    return True
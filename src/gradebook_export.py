@@ -0,0 +1,97 @@
+"""
+Reading Canvas's gradebook CSV export into the same submission records that the
+`students/submissions` endpoint returns.
+
+The export has one row per student and one column per assignment (named like
+"Homework 1 (123456)"), holding the score, "EX" for excused, or nothing. It has
+no submission times or graders, so the submissions made from it only say
+whether each assignment was graded; `CanvasApi` fills in the ungraded ones
+from the API.
+"""
+
+from __future__ import annotations
+import csv
+import re
+from typing import Iterator
+
+ASSIGNMENT_COLUMN = re.compile(r"\((\d+)\)\s*$")
+EXCUSED_GRADE = "EX"
+
+
+def get_assignment_columns(header: list[str]) -> dict[int, int]:
+    """
+    Which assignment each column holds, by the id at the end of its name.
+    """
+    columns = {}
+    for index, name in enumerate(header):
+        match = ASSIGNMENT_COLUMN.search(name)
+        if match:
+            columns[index] = int(match.group(1))
+    return columns
+
+
+def read_gradebook_csv(path: str) -> Iterator[tuple[int, int, str]]:
+    """
+    Each (user id, assignment id, grade) in the export, skipping the header rows
+    (points possible, posting policies) that have no student id.
+    """
+    with open(path, newline="", encoding="utf-8-sig") as export_file:
+        rows = csv.reader(export_file)
+        header = next(rows)
+        id_column = header.index("ID")
+        assignment_columns = get_assignment_columns(header)
+        for row in rows:
+            user_id = row[id_column].strip()
+            if not user_id.isdigit():
+                continue
+            for index, assignment_id in assignment_columns.items():
+                yield int(user_id), assignment_id, row[index].strip()
+
+
+def parse_score(grade: str):
+    try:
+        return float(grade)
+    except ValueError:
+        return None
+
+
+def make_exported_submission(
+    submission_id: int, user_id: int, assignment_id: int, grade: str
+) -> dict:
+    """
+    A raw submission (as from the API) for one cell of the gradebook export.
+    """
+    excused = grade == EXCUSED_GRADE
+    return {
+        "id": submission_id,
+        "user_id": user_id,
+        "assignment_id": assignment_id,
+        "attempt": None,
+        "grade": grade or None,
+        "score": None if excused else parse_score(grade),
+        "submission_type": None,
+        "submitted_at": None,
+        "grader_id": None,
+        "graded_at": None,
+        "late": False,
+        "excused": excused,
+        "missing": False,
+        "late_policy_status": None,
+        "seconds_late": 0,
+        "workflow_state": "graded" if grade else "unsubmitted",
+        "redo_request": False,
+        "html_url": None,
+    }
+
+
+def load_gradebook_submissions(path: str) -> list[dict]:
+    """
+    The export's raw submissions. Canvas does not include submission ids in the
+    export, so these get negative ids that cannot clash with real ones.
+    """
+    return [
+        make_exported_submission(-index, user_id, assignment_id, grade)
+        for index, (user_id, assignment_id, grade) in enumerate(
+            read_gradebook_csv(path), start=1
+        )
+    ]
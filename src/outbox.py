@@ -0,0 +1,102 @@
+"""
+An on-disk outbox of fully built emails, so that nothing is lost when the mail
+server is down: messages stay in the folder until they are delivered, and can be
+sent later (`--flush-outbox`) without talking to Canvas or rebuilding reports.
+
+Each message is an `.eml` file; a `.json` file beside it remembers how many
+times delivering it has failed. Messages that keep failing, or that the server
+rejects outright, are moved into the `failed` subfolder for a human to look at.
+"""
+
+from __future__ import annotations
+from email import message_from_binary_file, policy
+from email.message import EmailMessage
+from typing import Optional
+import json
+import os
+import time
+import uuid
+
+DEFAULT_OUTBOX = "crony_outbox"
+FAILED_FOLDER = "failed"
+# Deliveries that fail this many times (across runs) are given up on
+MAX_ATTEMPTS = 10
+
+
+def write_atomically(path: str, data: bytes):
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as temporary_file:
+        temporary_file.write(data)
+    os.replace(temporary, path)
+
+
+def enqueue(folder: str, message: EmailMessage, key: Optional[str] = None) -> str:
+    """
+    Store a message in the outbox.
+    :param key: Names the message (e.g., after what is in it), so that queuing
+        the same message again does nothing while it is still waiting.
+    :return: The path of the stored message.
+    """
+    if key is not None:
+        for path in pending(folder):
+            if path.endswith(f"-{key}.eml"):
+                return path
+    os.makedirs(folder, exist_ok=True)
+    name = f"{time.strftime('%Y%m%d-%H%M%S')}-{key or uuid.uuid4().hex[:8]}.eml"
+    path = os.path.join(folder, name)
+    write_atomically(path, message.as_bytes(policy=policy.SMTP))
+    return path
+
+
+def pending(folder: str) -> list[str]:
+    """
+    The paths of the messages waiting in the outbox, oldest first.
+    """
+    if not os.path.isdir(folder):
+        return []
+    return [
+        os.path.join(folder, name)
+        for name in sorted(os.listdir(folder))
+        if name.endswith(".eml")
+    ]
+
+
+def load_message(path: str) -> EmailMessage:
+    with open(path, "rb") as message_file:
+        return message_from_binary_file(message_file, policy=policy.default)
+
+
+def get_attempts(path: str) -> int:
+    status_path = path[: -len(".eml")] + ".json"
+    if not os.path.exists(status_path):
+        return 0
+    with open(status_path) as status_file:
+        return json.load(status_file)["attempts"]
+
+
+def remove(path: str):
+    """
+    Take a delivered message out of the outbox.
+    """
+    status_path = path[: -len(".eml")] + ".json"
+    if os.path.exists(status_path):
+        os.remove(status_path)
+    os.remove(path)
+
+
+def record_failure(path: str, error: Exception, permanent: bool = False) -> bool:
+    """
+    Remember a failed delivery, and give up on the message if it is hopeless.
+    :return: Whether the message is still in the outbox, to be tried again.
+    """
+    attempts = get_attempts(path) + 1
+    status_path = path[: -len(".eml")] + ".json"
+    status = {"attempts": attempts, "error": str(error)}
+    write_atomically(status_path, json.dumps(status).encode("utf-8"))
+    if not permanent and attempts < MAX_ATTEMPTS:
+        return True
+    failed = os.path.join(os.path.dirname(path), FAILED_FOLDER)
+    os.makedirs(failed, exist_ok=True)
+    for moved in (path, status_path):
+        os.replace(moved, os.path.join(failed, os.path.basename(moved)))
+    return False
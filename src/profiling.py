@@ -0,0 +1,329 @@
+"""
+Timing spans, to find where the time of a real run goes: totaled up for
+`--profile`, and written one by one to the run's trace (see `tracing`).
+
+Each stage of a run is wrapped in a span, and so are the pieces within it: the
+courses, the Canvas endpoints (grouped by path, without ids), the reporters, the
+report renders and the emails. Spans can carry attributes (e.g., the course id),
+given when they start or added with `annotate` while they run. Spans nest per
+thread; work handed to a thread pool is wrapped with `inherit`, so that it nests
+under the span that started it (and, running in parallel, can add up to more
+than its parent). When a profiled run ends, the profile folder gets:
+
+* stages.txt: a table of every span, with its count, total and self time
+* stages.folded: the spans' self times (in microseconds) as collapsed stacks,
+  for flame graph tools like flamegraph.pl or speedscope
+
+Optionally, a Python profiler runs alongside: `cprofile` profiles the main
+thread into python.prof (for pstats or snakeviz) and python.txt, and `sample`
+samples the stacks of every thread into python.folded.
+
+When neither profiling nor tracing, a span costs a couple of global lookups.
+"""
+
+from __future__ import annotations
+from contextlib import contextmanager, nullcontext
+from dataclasses import dataclass
+from typing import Any, Callable, Iterator, Optional
+import functools
+import logging
+import os
+import sys
+import threading
+import time
+
+import tracing
+
+logger = logging.getLogger("crony")
+
+PROFILERS = ["cprofile", "sample"]
+# Seconds between the sampling profiler's looks at every thread
+SAMPLE_INTERVAL = 0.005
+# How many functions python.txt lists
+CPROFILE_LINES = 60
+
+SpanPath = tuple[str, ...]
+
+
+@dataclass
+class ActiveSpan:
+    path: SpanPath
+    # Only spans that are traced have ids
+    span_id: Optional[str]
+    attributes: dict[str, Any]
+
+
+ROOT = ActiveSpan((), None, {})
+
+
+@dataclass
+class SpanTotal:
+    count: int = 0
+    seconds: float = 0.0
+
+
+class Sampler:
+    """
+    A sampling profiler: counts how often each stack of each thread is seen.
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL):
+        self.interval = interval
+        self.counts: dict[str, int] = {}
+        self.stopping = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="sampler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while not self.stopping.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == self.thread.ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    filename = os.path.basename(code.co_filename)
+                    stack.append(f"{code.co_name} ({filename}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(ident, "thread"))
+                key = ";".join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+
+    def stop(self):
+        self.stopping.set()
+        self.thread.join()
+
+    def folded(self) -> str:
+        return "".join(f"{stack} {count}\n" for stack, count in self.counts.items())
+
+
+class Profile:
+    """
+    The total time of every span of a run, keyed by the path of spans leading to it.
+    :param profiler: Which Python profiler to run alongside, if any (see PROFILERS).
+    """
+
+    def __init__(self, profiler: Optional[str] = None):
+        self.totals: dict[SpanPath, SpanTotal] = {}
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+        self.profiler = profiler
+        self.cprofile = None
+        self.sampler: Optional[Sampler] = None
+        if profiler == "cprofile":
+            import cProfile
+
+            self.cprofile = cProfile.Profile()
+            self.cprofile.enable()
+        elif profiler == "sample":
+            self.sampler = Sampler()
+            self.sampler.start()
+        elif profiler is not None:
+            raise ValueError(
+                f"Unknown profiler {profiler!r}, expected one of {PROFILERS}"
+            )
+
+    def record(self, path: SpanPath, seconds: float):
+        with self.lock:
+            total = self.totals.setdefault(path, SpanTotal())
+            total.count += 1
+            total.seconds += seconds
+
+    def get_self_seconds(self) -> dict[SpanPath, float]:
+        """
+        The time of each span not spent in its children (never below zero, since
+        parallel children can add up to more than their parent).
+        """
+        children: dict[SpanPath, float] = {}
+        for path, total in self.totals.items():
+            if len(path) > 1:
+                children[path[:-1]] = children.get(path[:-1], 0) + total.seconds
+        return {
+            path: max(0.0, total.seconds - children.get(path, 0))
+            for path, total in self.totals.items()
+        }
+
+    def summary(self) -> str:
+        """
+        A table of the spans as a tree, with the slowest children first.
+        """
+        elapsed = time.perf_counter() - self.started
+        self_seconds = self.get_self_seconds()
+        ordered: list[SpanPath] = []
+
+        def add_children(parent: SpanPath):
+            children = [
+                path
+                for path in self.totals
+                if len(path) == len(parent) + 1 and path[:-1] == parent
+            ]
+            for path in sorted(children, key=lambda p: -self.totals[p].seconds):
+                ordered.append(path)
+                add_children(path)
+
+        add_children(())
+        labels = ["  " * (len(path) - 1) + path[-1] for path in ordered]
+        width = max([len("Span"), *(len(label) for label in labels)])
+        lines = [
+            f"{'Span':<{width}}  {'Count':>7}  {'Total (s)':>10}  {'Self (s)':>10}  {'Share':>6}"
+        ]
+        for label, path in zip(labels, ordered):
+            total = self.totals[path]
+            share = total.seconds / elapsed if elapsed else 0
+            lines.append(
+                f"{label:<{width}}  {total.count:>7}  {total.seconds:>10.3f}"
+                f"  {self_seconds[path]:>10.3f}  {share:>6.1%}"
+            )
+        return "\n".join(lines) + "\n"
+
+    def folded(self) -> str:
+        return "".join(
+            f"{';'.join(path)} {round(seconds * 1_000_000)}\n"
+            for path, seconds in self.get_self_seconds().items()
+            if seconds > 0
+        )
+
+    def write(self, folder: str):
+        """
+        Stop the Python profiler (if any), and write everything to the folder.
+        """
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, "stages.txt"), "w") as summary_file:
+            summary_file.write(self.summary())
+        with open(os.path.join(folder, "stages.folded"), "w") as folded_file:
+            folded_file.write(self.folded())
+        if self.cprofile is not None:
+            import pstats
+
+            self.cprofile.disable()
+            self.cprofile.dump_stats(os.path.join(folder, "python.prof"))
+            with open(os.path.join(folder, "python.txt"), "w") as stats_file:
+                stats = pstats.Stats(self.cprofile, stream=stats_file)
+                stats.sort_stats("cumulative").print_stats(CPROFILE_LINES)
+        if self.sampler is not None:
+            self.sampler.stop()
+            with open(os.path.join(folder, "python.folded"), "w") as folded_file:
+                folded_file.write(self.sampler.folded())
+
+
+# The profile of the current run, if it is being profiled
+PROFILE: Optional[Profile] = None
+NOT_PROFILING = nullcontext()
+
+
+def start(profiler: Optional[str] = None) -> Profile:
+    global PROFILE
+    PROFILE = Profile(profiler)
+    return PROFILE
+
+
+def finish(folder: str):
+    """
+    Write the profile of the run into the folder, and stop profiling.
+    """
+    global PROFILE
+    profile, PROFILE = PROFILE, None
+    if profile is None:
+        return
+    profile.write(folder)
+    logger.info(f"Wrote the profile to {folder}:\n{profile.summary()}")
+
+
+# The span that each thread is in
+CURRENT = threading.local()
+
+
+def current() -> ActiveSpan:
+    return getattr(CURRENT, "span", ROOT)
+
+
+@contextmanager
+def under(parent: ActiveSpan) -> Iterator[None]:
+    previous = current()
+    CURRENT.span = parent
+    try:
+        yield
+    finally:
+        CURRENT.span = previous
+
+
+def end_span(
+    active: ActiveSpan, parent_id: Optional[str], start: float, seconds: float
+):
+    if PROFILE is not None:
+        PROFILE.record(active.path, seconds)
+    if active.span_id is not None and tracing.TRACER is not None:
+        tracing.TRACER.emit(
+            active.path[-1],
+            active.span_id,
+            parent_id,
+            start,
+            seconds,
+            active.attributes,
+        )
+
+
+@contextmanager
+def timed_span(name: str, attributes: dict[str, Any]) -> Iterator[None]:
+    parent = current()
+    span_id = tracing.new_span_id() if tracing.TRACER is not None else None
+    # Semicolons separate the frames of collapsed stacks
+    active = ActiveSpan(parent.path + (name.replace(";", ","),), span_id, attributes)
+    start, started = time.time(), time.perf_counter()
+    try:
+        with under(active):
+            yield
+    finally:
+        end_span(active, parent.span_id, start, time.perf_counter() - started)
+
+
+def span(name: str, **attributes):
+    """
+    Time a block of code (when profiling or tracing), nested under the thread's
+    current span.
+    """
+    if PROFILE is None and tracing.TRACER is None:
+        return NOT_PROFILING
+    return timed_span(name, attributes)
+
+
+def annotate(**attributes):
+    """
+    Add attributes to the current span, e.g., once it knows how many pages it got.
+    """
+    active = current()
+    if active is not ROOT:
+        active.attributes.update(attributes)
+
+
+def record(name: str, seconds: float, **attributes):
+    """
+    Add a span that was timed elsewhere (e.g., in a worker process), as if it
+    just ended.
+    """
+    if PROFILE is None and tracing.TRACER is None:
+        return
+    parent = current()
+    span_id = tracing.new_span_id() if tracing.TRACER is not None else None
+    active = ActiveSpan(parent.path + (name,), span_id, attributes)
+    end_span(active, parent.span_id, time.time() - seconds, seconds)
+
+
+def inherit(function: Callable) -> Callable:
+    """
+    Wrap a function that will run on another thread, so that its spans nest under
+    the span that is current here and now.
+    """
+    if PROFILE is None and tracing.TRACER is None:
+        return function
+    parent = current()
+
+    @functools.wraps(function)
+    def run_under(*args, **kwargs):
+        with under(parent):
+            return function(*args, **kwargs)
+
+    return run_under
@@ -0,0 +1,171 @@
+"""
+Following many Canvas progress jobs (exports, bulk updates) at once.
+
+A single background thread polls each job when it is due, backing off
+exponentially while the job runs, but never waiting much longer than the job's
+own completion rate says it needs. Every watched job gets a future, which
+resolves to the final progress object once Canvas says the job is done.
+"""
+
+from __future__ import annotations
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Callable, Optional, TYPE_CHECKING
+import logging
+import threading
+import time
+
+if TYPE_CHECKING:
+    from tqdm import tqdm
+
+logger = logging.getLogger("crony")
+
+# Seconds between polls of a single job
+MIN_DELAY = 1
+MAX_DELAY = 60
+BACKOFF = 2
+# Polls in a row that can fail (e.g., a dropped connection) before giving up on a job
+MAX_POLL_ERRORS = 5
+
+FINISHED_STATES = {"completed", "failed"}
+
+
+class ProgressFailed(Exception):
+    pass
+
+
+@dataclass
+class ProgressJob:
+    progress_id: int
+    future: Future
+    delay: float = MIN_DELAY
+    next_poll: float = field(default_factory=time.monotonic)
+    # The last reported completion (0-100), and when it was reported
+    completion: float = 0
+    reported_at: float = field(default_factory=time.monotonic)
+    # How many polls in a row have failed
+    errors: int = 0
+    bar: Optional[tqdm] = None
+
+    def next_delay(self, completion: float, now: float) -> float:
+        """
+        Back off exponentially, but poll again around when the job should finish
+        at the rate it has been going.
+        """
+        delay = min(self.delay * BACKOFF, MAX_DELAY)
+        if completion > self.completion and now > self.reported_at:
+            rate = (completion - self.completion) / (now - self.reported_at)
+            remaining = (100 - completion) / rate
+            delay = min(delay, max(MIN_DELAY, remaining))
+        return delay
+
+
+class ProgressPoller:
+    """
+    Polls Canvas progress jobs in a background thread.
+    :param fetch: Gets the current progress object for a progress id. A job only
+        fails on a "failed" state, or after MAX_POLL_ERRORS fetches in a row raise.
+    :param progress_bars: Whether to show a tqdm bar for each job.
+    """
+
+    def __init__(self, fetch: Callable[[int], dict], progress_bars: bool = False):
+        self.fetch = fetch
+        self.progress_bars = progress_bars
+        self.jobs: dict[int, ProgressJob] = {}
+        self.lock = threading.Lock()
+        self.wakeup = threading.Event()
+        self.thread: Optional[threading.Thread] = None
+
+    def watch(self, progress_id: int) -> Future:
+        """
+        Start following a progress job.
+        :return: A future for the job's final progress object, which raises
+            ProgressFailed if the job failed.
+        """
+        with self.lock:
+            if progress_id in self.jobs:
+                return self.jobs[progress_id].future
+            job = ProgressJob(progress_id, Future())
+            if self.progress_bars:
+                from tqdm import tqdm
+
+                bar_format = "{desc}: {percentage:3.0f}%|{bar}| {elapsed}"
+                job.bar = tqdm(
+                    total=100,
+                    desc=f"Canvas job {progress_id}",
+                    bar_format=bar_format,
+                    leave=False,
+                )
+            self.jobs[progress_id] = job
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(
+                    target=self.run, name="progress-poller", daemon=True
+                )
+                self.thread.start()
+        self.wakeup.set()
+        return job.future
+
+    def run(self):
+        while True:
+            with self.lock:
+                if not self.jobs:
+                    self.thread = None
+                    return
+                job = min(self.jobs.values(), key=lambda job: job.next_poll)
+            wait = job.next_poll - time.monotonic()
+            if wait > 0:
+                # A newly watched job might be due sooner than this one
+                self.wakeup.wait(wait)
+                self.wakeup.clear()
+                continue
+            self.poll(job)
+
+    def poll(self, job: ProgressJob):
+        try:
+            result = self.fetch(job.progress_id)
+        except Exception as error:
+            job.errors += 1
+            if job.errors >= MAX_POLL_ERRORS:
+                self.finish(job, error=error)
+                return
+            # The job itself may be fine, so try again after backing off
+            logger.warning(
+                f"Could not poll Canvas job {job.progress_id}"
+                f" ({job.errors}/{MAX_POLL_ERRORS}): {error}"
+            )
+            job.delay = min(job.delay * BACKOFF, MAX_DELAY)
+            job.next_poll = time.monotonic() + job.delay
+            return
+        job.errors = 0
+        state = result["workflow_state"]
+        completion = result.get("completion") or 0
+        if job.bar is not None:
+            job.bar.update(completion - job.bar.n)
+        logger.debug(
+            f"Canvas job {job.progress_id} is {state} ({completion:.1f}%): {result.get('message')}"
+        )
+        if state == "completed":
+            self.finish(job, result=result)
+        elif state == "failed":
+            self.finish(
+                job,
+                error=ProgressFailed(
+                    f"Canvas job {job.progress_id} failed: {result.get('message')}"
+                ),
+            )
+        else:
+            now = time.monotonic()
+            job.delay = job.next_delay(completion, now)
+            if completion != job.completion:
+                job.completion, job.reported_at = completion, now
+            job.next_poll = now + job.delay
+
+    def finish(self, job: ProgressJob, result: dict = None, error: Exception = None):
+        with self.lock:
+            del self.jobs[job.progress_id]
+        if job.bar is not None:
+            job.bar.close()
+        if error is not None:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(result)
@@ -1 +1,7 @@
-from reports.report import make_reports
+def __getattr__(name):
+    # Importing the reporters is slow, so wait until `make_reports` is actually used
+    if name == "make_reports":
+        from reports.report import make_reports
+
+        return make_reports
+    raise AttributeError(f"module 'reports' has no attribute {name!r}")
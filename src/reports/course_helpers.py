@@ -22,9 +22,10 @@ def get_staff_for_student(course: CourseData) -> dict[int, list[User]]:
     return staff_for_student
 
 
-def make_graded_piles(course: CourseData):
+def make_graded_piles(course: CourseData, staff_for_student=None):
     # Get each TA mapped to their list of students
-    staff_for_student = get_staff_for_student(course)
+    if staff_for_student is None:
+        staff_for_student = get_staff_for_student(course)
 
     # Process each submission, add it to our piles if ungraded
     ta_students_pile: dict[int, dict[GradingStatus, list[Submission]]] = {}
@@ -85,12 +86,13 @@ def make_ungraded_piles(course):
     return all_graded, grader_piles
 
 
-def make_grading_piles(course):
+def make_grading_piles(course, staff_for_student=None):
     """
     Makes grading piles for each TA, and a big pile of all ungraded submissions.
     """
     # Get each TA mapped to their list of students
-    staff_for_student = get_staff_for_student(course)
+    if staff_for_student is None:
+        staff_for_student = get_staff_for_student(course)
 
     # Process each submission, add it to our piles if ungraded
     ta_grading_piles: dict[int, dict[GradingStatus, list[Submission]]] = {}
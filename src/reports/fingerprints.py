@@ -0,0 +1,104 @@
+"""
+Stable fingerprints of what goes into each report, so that reports whose inputs
+have not changed since the last run can be skipped instead of being rendered and
+emailed again.
+"""
+
+from __future__ import annotations
+from dataclasses import fields, is_dataclass
+import hashlib
+import json
+import logging
+import os
+
+from reports.report_types import Report, ReportSet
+
+logger = logging.getLogger("crony")
+
+DEFAULT_STATE_PATH = "crony_state.json"
+
+
+def canonical(value):
+    """
+    Turn a payload into plain JSON data with a deterministic layout.
+    """
+    if is_dataclass(value):
+        return {
+            field.name: canonical(getattr(value, field.name)) for field in fields(value)
+        }
+    if isinstance(value, dict):
+        # Keep the order, since it is also the order things are rendered in
+        return [[canonical(key), canonical(item)] for key, item in value.items()]
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = [canonical(item) for item in value]
+        return sorted(items, key=repr) if isinstance(value, (set, frozenset)) else items
+    if isinstance(value, (str, int, float, bool)) or value is None:
+        return value
+    return str(value)
+
+
+def fingerprint(report: Report) -> str:
+    renderer = f"{report.renderer.__module__}.{report.renderer.__qualname__}"
+    data = json.dumps(
+        [renderer, report.filename, report.subject, canonical(report.payload)],
+        sort_keys=True,
+    )
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def report_key(report: Report) -> str:
+    return f"{report.course['course']['id']}/{report.filename}/{report.target['email']}"
+
+
+def select_recipients(
+    fingerprints: dict[str, str], emails: list[str]
+) -> dict[str, str]:
+    """
+    Only the fingerprints of the reports for these recipients (or all of them, if
+    there are no recipients to restrict to).
+    """
+    if not emails:
+        return fingerprints
+    return {
+        key: digest
+        for key, digest in fingerprints.items()
+        if key.rpartition("/")[2] in emails
+    }
+
+
+def load_fingerprints(path: str) -> dict[str, str]:
+    if not os.path.exists(path):
+        return {}
+    with open(path) as state_file:
+        return json.load(state_file)
+
+
+def save_fingerprints(path: str, fingerprints: dict[str, str]):
+    # Write to a temporary file first, so a crash never leaves a corrupted state
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "w") as state_file:
+        json.dump(fingerprints, state_file, indent=1, sort_keys=True)
+    os.replace(temporary_path, path)
+
+
+def drop_unchanged(
+    report_sets: list[ReportSet], known: dict[str, str]
+) -> dict[str, str]:
+    """
+    Remove every report whose fingerprint matches the one from the last run.
+    :param report_sets: The report sets to filter, in place.
+    :param known: The fingerprints from the last run.
+    :return: The fingerprints of the reports that remain (new or changed).
+    """
+    changed = {}
+    for report_set in report_sets:
+        kept = []
+        for report in report_set.reports:
+            key, digest = report_key(report), fingerprint(report)
+            if known.get(key) == digest:
+                logger.info(f"Skipping unchanged report {key}")
+                continue
+            changed[key] = digest
+            kept.append(report)
+        report_set.reports = kept
+    return changed
@@ -0,0 +1,84 @@
+"""
+Small, precompiled HTML templates for reports that are read right in the email.
+Styles are inlined, since most mail clients drop stylesheets.
+"""
+
+from __future__ import annotations
+from html import escape
+from string import Template
+
+PAGE_TEMPLATE = Template("""<!DOCTYPE html>
+<html><head><meta charset="utf-8"><title>$title</title></head>
+<body style="font-family: Helvetica, Arial, sans-serif; font-size: 14px;">
+$body
+</body></html>
+""")
+SECTION_TEMPLATE = Template(
+    """<h1 style="font-size: 22px; margin-bottom: 0;">$title</h1>
+<h2 style="font-size: 18px; font-weight: normal; margin: 0;">$course_name</h2>
+<h2 style="font-size: 18px; font-weight: normal; margin-top: 0;">$user_name</h2>
+$body
+"""
+)
+TABLE_TEMPLATE = Template(
+    """<table style="border-collapse: collapse; margin-bottom: 1em;">
+$rows</table>
+"""
+)
+ROW_TEMPLATE = Template('<tr style="$style">$cells</tr>\n')
+CELL_TEMPLATE = Template(
+    '<td style="border: 1px solid #999; padding: 2px 6px;">$text</td>'
+)
+HEADING_TEMPLATE = Template(
+    '<h3 style="font-size: 18px; margin-bottom: 0.2em;">$text</h3>\n'
+)
+LINK_TEMPLATE = Template('<li><a href="$url">$text</a></li>\n')
+
+STRIPE = "background-color: #f0f0f0;"
+
+
+def html_page(title: str, sections: list[str]) -> str:
+    return PAGE_TEMPLATE.substitute(title=escape(title), body="\n".join(sections))
+
+
+def html_section(title: str, course_name: str, user_name: str, body: str) -> str:
+    return SECTION_TEMPLATE.substitute(
+        title=escape(title),
+        course_name=escape(course_name),
+        user_name=escape(user_name),
+        body=body,
+    )
+
+
+def html_table(data: list[list[str]]) -> str:
+    rows = "".join(
+        ROW_TEMPLATE.substitute(
+            style=STRIPE if row_id % 2 == 0 else "",
+            cells="".join(
+                CELL_TEMPLATE.substitute(text=escape(datum)) for datum in row
+            ),
+        )
+        for row_id, row in enumerate(data)
+    )
+    return TABLE_TEMPLATE.substitute(rows=rows)
+
+
+def html_heading(text: str) -> str:
+    return HEADING_TEMPLATE.substitute(text=escape(text))
+
+
+def html_links(links: list[tuple[str, str]]) -> str:
+    items = "".join(
+        LINK_TEMPLATE.substitute(url=escape(url), text=escape(text))
+        for text, url in links
+    )
+    return f'<ul style="margin-top: 0;">\n{items}</ul>\n'
+
+
+def text_table(data: list[list[str]]) -> str:
+    widths = [max(len(row[column]) for row in data) for column in range(len(data[0]))]
+    return "".join(
+        "  ".join(datum.ljust(width) for datum, width in zip(row, widths)).rstrip()
+        + "\n"
+        for row in data
+    )
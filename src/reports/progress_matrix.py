@@ -0,0 +1,168 @@
+"""
+A compact, sparse student x assignment matrix of submission statuses and scores.
+
+It is built in a single pass over the course's submissions, and every summary
+(per student, per cohort, per assignment) is a reduction over its arrays,
+rather than a scan through nested dictionaries.
+"""
+
+from __future__ import annotations
+from dataclasses import dataclass
+
+import numpy as np
+
+from canvas_data import CourseData
+from reports.course_helpers import classify_submission
+
+# Status codes stored in the matrix; a missing entry means "no submission"
+UPCOMING, COMPLETED, MISSING, EXCUSED = 0, 1, 2, 3
+PROGRESS_STATUSES = ["Upcoming", "Completed", "Missing", "Excused"]
+
+STATUS_CODES = {
+    "graded": COMPLETED,
+    "not yet graded (late)": COMPLETED,
+    "resubmitted (late)": COMPLETED,
+    "not yet graded (ready)": COMPLETED,
+    "resubmitted (ready)": COMPLETED,
+    "not yet graded (early)": COMPLETED,
+    "resubmitted (early)": COMPLETED,
+    "missed due date": MISSING,
+    "missed lock date": MISSING,
+    "in progress": UPCOMING,
+    "future assignments": UPCOMING,
+}
+
+
+@dataclass
+class CompletionMatrix:
+    student_ids: list[int]
+    assignment_ids: list[int]
+    student_index: dict[int, int]
+    assignment_index: dict[int, int]
+    # One entry per submission, in coordinate (COO) form, sorted by row
+    rows: np.ndarray
+    columns: np.ndarray
+    codes: np.ndarray
+    # Percentage scores, NaN where there is no score
+    scores: np.ndarray
+    # Where each student's entries start (and the previous one's end), like the
+    # row pointers of a CSR matrix
+    indptr: np.ndarray
+
+    def _counts(self, axis_ids: np.ndarray, size: int) -> np.ndarray:
+        """Count each status code along one axis: shape (statuses, size)."""
+        flat = self.codes.astype(np.int64) * size + axis_ids
+        counts = np.bincount(flat, minlength=len(PROGRESS_STATUSES) * size)
+        return counts.reshape(len(PROGRESS_STATUSES), size)
+
+    def _mean_scores(self, axis_ids: np.ndarray, size: int) -> np.ndarray:
+        scored = ~np.isnan(self.scores)
+        totals = np.bincount(
+            axis_ids[scored], weights=self.scores[scored], minlength=size
+        )
+        counts = np.bincount(axis_ids[scored], minlength=size)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return totals / counts
+
+    def student_counts(self) -> np.ndarray:
+        return self._counts(self.rows, len(self.student_ids))
+
+    def assignment_counts(self) -> np.ndarray:
+        return self._counts(self.columns, len(self.assignment_ids))
+
+    def student_scores(self) -> np.ndarray:
+        return self._mean_scores(self.rows, len(self.student_ids))
+
+    def assignment_scores(self) -> np.ndarray:
+        return self._mean_scores(self.columns, len(self.assignment_ids))
+
+    def membership(self, groups: dict[str, list[int]]) -> np.ndarray:
+        """A (groups x students) incidence matrix, for reducing over cohorts."""
+        incidence = np.zeros((len(groups), len(self.student_ids)))
+        for group_index, student_ids in enumerate(groups.values()):
+            indexes = [
+                self.student_index[student_id]
+                for student_id in student_ids
+                if student_id in self.student_index
+            ]
+            incidence[group_index, indexes] = 1
+        return incidence
+
+    def group_counts(self, groups: dict[str, list[int]]) -> np.ndarray:
+        """Count each status code for each group of students: (statuses, groups)."""
+        return self.student_counts() @ self.membership(groups).T
+
+    def student_assignment_counts(self, student_ids: list[int]) -> np.ndarray:
+        """Count each status code per assignment, among only these students."""
+        chosen = np.zeros(len(self.student_ids), dtype=bool)
+        chosen[
+            [self.student_index[s] for s in student_ids if s in self.student_index]
+        ] = True
+        mask = chosen[self.rows]
+        flat = self.codes[mask].astype(np.int64) * len(self.assignment_ids)
+        flat += self.columns[mask]
+        counts = np.bincount(
+            flat, minlength=len(PROGRESS_STATUSES) * len(self.assignment_ids)
+        )
+        return counts.reshape(len(PROGRESS_STATUSES), len(self.assignment_ids))
+
+    def student_row(self, student_id: int) -> dict[int, tuple[int, float]]:
+        """Each assignment's status code and score for one student."""
+        index = self.student_index[student_id]
+        start, end = self.indptr[index], self.indptr[index + 1]
+        return {
+            self.assignment_ids[column]: (int(code), float(score))
+            for column, code, score in zip(
+                self.columns[start:end], self.codes[start:end], self.scores[start:end]
+            )
+        }
+
+
+def make_completion_matrix(course: CourseData) -> CompletionMatrix:
+    student_ids = list(course["students"])
+    student_index = {student_id: i for i, student_id in enumerate(student_ids)}
+    assignment_ids = [
+        assignment_id
+        for assignment_id, assignment in course["assignments"].items()
+        if assignment.get("published", True)
+    ]
+    assignment_index = {
+        assignment_id: i for i, assignment_id in enumerate(assignment_ids)
+    }
+    rows, columns, codes, scores = [], [], [], []
+    for submission in course["submissions"].values():
+        row = student_index.get(submission["user"]["id"])
+        column = assignment_index.get(submission["assignment"]["id"])
+        if row is None or column is None:
+            continue
+        if submission.get("excused"):
+            code = EXCUSED
+        elif submission.get("missing"):
+            code = MISSING
+        else:
+            status = classify_submission(submission, course["group_membership_ids"])
+            code = STATUS_CODES.get(status, UPCOMING)
+        score = submission["score"]
+        possible = submission["assignment"]["points_possible"]
+        rows.append(row)
+        columns.append(column)
+        codes.append(code)
+        scores.append(
+            100 * score / possible if score is not None and possible else np.nan
+        )
+    rows = np.array(rows, dtype=np.int32)
+    # Sorted by student once, so each student's entries are one slice
+    order = np.argsort(rows, kind="stable")
+    indptr = np.zeros(len(student_ids) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=len(student_ids)), out=indptr[1:])
+    return CompletionMatrix(
+        student_ids,
+        assignment_ids,
+        student_index,
+        assignment_index,
+        rows[order],
+        np.array(columns, dtype=np.int32)[order],
+        np.array(codes, dtype=np.int8)[order],
+        np.array(scores, dtype=np.float32)[order],
+        indptr,
+    )
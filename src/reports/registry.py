@@ -0,0 +1,95 @@
+"""
+The reporters that can run on a course, and the derived course views they share.
+
+A reporter declares which views it needs; each view is computed lazily, the
+first time any reporter asks for it, and then reused by every other reporter of
+the same course. Reporters can be turned on or off per course with the
+``reports`` list of the course's YAML file.
+"""
+
+from __future__ import annotations
+from dataclasses import dataclass
+from typing import Any, Callable
+import logging
+
+from canvas_data import CourseData
+from cli_config import CronyConfiguration
+from reports.report_types import Report
+
+logger = logging.getLogger("crony")
+
+
+class CourseViews:
+    """
+    Lazily computed, cached views of a single course (e.g., the grading piles).
+    """
+
+    def __init__(self, course: CourseData):
+        self.course = course
+        self.cache: dict[str, Any] = {}
+
+    def __getitem__(self, name: str) -> Any:
+        if name not in self.cache:
+            if name not in VIEWS:
+                raise KeyError(f"Unknown course view: {name!r}")
+            logger.debug(f"Computing course view {name!r}")
+            self.cache[name] = VIEWS[name](self)
+        return self.cache[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.cache
+
+
+View = Callable[[CourseViews], Any]
+VIEWS: dict[str, View] = {}
+
+
+def register_view(name: str):
+    def decorator(view: View) -> View:
+        VIEWS[name] = view
+        return view
+
+    return decorator
+
+
+MakeReports = Callable[[CourseData, CourseViews, CronyConfiguration], list[Report]]
+
+
+@dataclass
+class Reporter:
+    name: str
+    make: MakeReports
+    views: tuple[str, ...]
+    # Whether it runs for courses that do not list their reports
+    default: bool = True
+
+
+REPORTERS: dict[str, Reporter] = {}
+
+
+def register_reporter(name: str, views: list[str] = (), default: bool = True):
+    """
+    Register a reporter, which is called with the course, its views and the CLI arguments.
+    :param name: The name used to enable the reporter in a course's ``reports`` list.
+    :param views: The names of the course views that the reporter reads.
+    :param default: Whether to run it when a course does not list its reports.
+    """
+
+    def decorator(make: MakeReports) -> MakeReports:
+        REPORTERS[name] = Reporter(name, make, tuple(views), default)
+        return make
+
+    return decorator
+
+
+def get_enabled_reporters(course: CourseData) -> list[Reporter]:
+    """
+    The reporters turned on for this course (the default ones, if it does not say).
+    """
+    enabled = course.get("reports")
+    if enabled is None:
+        return [reporter for reporter in REPORTERS.values() if reporter.default]
+    unknown = set(enabled) - set(REPORTERS)
+    if unknown:
+        raise ValueError(f"Unknown reports for course {course['id']}: {unknown}")
+    return [reporter for name, reporter in REPORTERS.items() if name in enabled]
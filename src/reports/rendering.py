@@ -0,0 +1,88 @@
+"""
+Renders reports' payloads into finished bytes, spread across worker processes.
+
+Laying out PDFs and spreadsheets is pure-Python CPU work, so a process pool
+lets it scale with the number of cores. Reporters only collect small, picklable
+payloads; the renderers turn those into bytes in the workers.
+"""
+
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Optional
+import logging
+import os
+import time
+
+import profiling
+from reports.report_types import Report, ReportSet, Renderer
+
+logger = logging.getLogger("crony")
+
+
+def render_payload(job: tuple[Renderer, Any]) -> tuple[bytes, float]:
+    """
+    Render in a worker process.
+    :return: The rendered bytes, and how many seconds it took (for --profile).
+    """
+    renderer, payload = job
+    start = time.perf_counter()
+    content = renderer(payload)
+    return content, time.perf_counter() - start
+
+
+def render_reports(reports: list[Report], jobs: Optional[int] = None) -> list[Report]:
+    """
+    Render every report that has not been rendered yet. Reports that share the
+    same renderer and payload (e.g., one course's instructor reports) are only
+    rendered once, and all of them get the same bytes.
+    :param reports: The reports to render; their contents are filled in place.
+    :param jobs: How many worker processes to use (defaults to the number of cores).
+        With one job (or just one distinct report), everything renders in this process.
+    :return: The same reports, now rendered.
+    """
+    shared: dict[tuple[Renderer, int], list[Report]] = {}
+    for report in reports:
+        if not report.rendered:
+            key = (report.renderer, id(report.payload))
+            shared.setdefault(key, []).append(report)
+    pending = list(shared.values())
+    jobs = jobs or os.cpu_count() or 1
+    if jobs <= 1 or len(pending) <= 1:
+        for first, *rest in pending:
+            with profiling.span(
+                f"render {first.name}", report_type=first.name, reports=len(rest) + 1
+            ):
+                content = first.render()
+            for report in rest:
+                report.content = content
+        return reports
+    workers = min(jobs, len(pending))
+    logger.info(f"Rendering {len(pending)} reports with {workers} workers")
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        contents = pool.map(
+            render_payload,
+            [(group[0].renderer, group[0].payload) for group in pending],
+            chunksize=max(1, len(pending) // (4 * workers)),
+        )
+        for group, (content, seconds) in zip(pending, contents):
+            profiling.record(
+                f"render {group[0].name}",
+                seconds,
+                report_type=group[0].name,
+                reports=len(group),
+            )
+            for report in group:
+                report.content = content
+    return reports
+
+
+def render_report_sets(
+    report_sets: list[ReportSet], jobs: Optional[int] = None
+) -> list[ReportSet]:
+    """
+    Render the reports of all the courses together, sharing one pool of workers.
+    """
+    render_reports(
+        [report for report_set in report_sets for report in report_set.reports], jobs
+    )
+    return report_sets
@@ -1,18 +1,32 @@
 from __future__ import annotations
+import logging
 
+import profiling
 from canvas_data import CourseData
 from cli_config import CronyConfiguration
+from reports.registry import CourseViews, get_enabled_reporters
 from reports.report_types import ReportSet
-from reports.reporters.progress_reports import make_progress_reports
-from reports.reporters.ungraded_reports import make_ungraded_reports
-from reports.reporters.score_reports import make_score_reports
-from reports.reporters.grading_reports import make_grading_reports
+
+# Importing these registers the views and reporters (in this order)
+import reports.views
+import reports.reporters.progress_reports
+import reports.reporters.ungraded_reports
+import reports.reporters.score_reports
+import reports.reporters.grading_reports
+
+logger = logging.getLogger("crony")
 
 
 def make_reports(course: CourseData, args: CronyConfiguration) -> ReportSet:
     reports = ReportSet(course, args)
-    reports.extend(make_progress_reports(course, args))
-    reports.extend(make_ungraded_reports(course, args))
-    reports.extend(make_score_reports(course, args))
-    reports.extend(make_grading_reports(course, args))
+    # Views are shared between reporters, and only computed if one needs them
+    views = CourseViews(course)
+    for reporter in get_enabled_reporters(course):
+        logger.debug(f"Running {reporter.name} reporter (uses {reporter.views})")
+        with profiling.span(
+            f"reporter {reporter.name}", reporter=reporter.name, course_id=course["id"]
+        ):
+            made = reporter.make(course, views, args)
+            profiling.annotate(reports=len(made))
+        reports.extend(made)
     return reports
@@ -1,11 +1,48 @@
+from __future__ import annotations
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from fpdf import FPDF
+
+
+def start_pdf(title: str, course_name: str, user_name: str) -> FPDF:
+    # fpdf (and its font tools) take a while to import, so only renderers load it
+    from fpdf import FPDF
+
+    pdf = FPDF()
+    pdf.add_page()
+    # Page Header
+    pdf.set_font("helvetica", "B", size=22)
+    pdf.write(txt=f"{title}\n")
+    pdf.set_font("helvetica", size=18)
+    pdf.write(txt=course_name + "\n")
+    pdf.write(txt=user_name + "\n")
+    pdf.ln()
+    return pdf
+
+
+def pdf_bytes(pdf: FPDF) -> bytes:
+    return bytes(pdf.output())
+
+
 def make_table(pdf, data: list[list[str]]):
     line_height = pdf.font_size
     col_widths = [1.5 * pdf.epw / len(data[0])] + [
         pdf.epw / (1 + len(data[0])) for c in data[0]
     ]
+    # Measure each distinct string once; most cells fit on one line, and a plain
+    # cell is much cheaper than a multi_cell's word-wrapping.
+    text_widths = {
+        datum: pdf.get_string_width(datum) for datum in {d for row in data for d in row}
+    }
+    margin = 2 * pdf.c_margin
     pdf.set_fill_color(240, 240, 240)
     for row_id, row in enumerate(data):
+        fill = row_id % 2 == 0
         for datum, col_width in zip(row, col_widths):
+            if "\n" not in datum and text_widths[datum] <= col_width - margin:
+                pdf.cell(col_width, line_height, datum, border=1, fill=fill)
+                continue
             pdf.multi_cell(
                 col_width,
                 line_height,
@@ -14,6 +51,6 @@ def make_table(pdf, data: list[list[str]]):
                 new_x="RIGHT",
                 new_y="TOP",
                 max_line_height=pdf.font_size,
-                fill=row_id % 2 == 0,
+                fill=fill,
             )
         pdf.ln(line_height)
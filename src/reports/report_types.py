@@ -1,18 +1,34 @@
 from __future__ import annotations
+from typing import Any, Callable, Optional
 import os
 
-from fpdf import FPDF
-import xlsxwriter
-
 from canvas_data import CourseData, User
-from cli_config import CronyConfiguration
+from cli_config import CronyConfiguration, get_only_emails
 from filesystem import clean_filename
+from reports.html_tools import html_page
+
+# Renderers must be module-level functions so they can be sent to worker processes
+Renderer = Callable[[Any], bytes]
+
+
+def is_recipient(user: User, args: CronyConfiguration) -> bool:
+    """
+    Whether reports for this user will be delivered; others need not be made at all.
+    """
+    only_emails = get_only_emails(args)
+    return not only_emails or user["email"] in only_emails
+
+
+def any_recipients(users: list[User], args: CronyConfiguration) -> bool:
+    return any(is_recipient(user, args) for user in users)
 
 
 class Report:
     maintype: str
     subtype: str
     extension: str
+    # Whether the report is shown in the body of the email, instead of attached
+    embedded = False
 
     def __init__(
         self,
@@ -21,30 +37,49 @@ class Report:
         target: User,
         course: CourseData,
         args: CronyConfiguration,
+        renderer: Renderer = None,
+        payload: Any = None,
     ):
         self.course = course
         self.args = args
         self.name = name
         self.target = target
         self.subject = subject
+        self.renderer = renderer
+        self.payload = payload
+        self.content: Optional[bytes] = None
         self.path = None
-        self.filename = None
+        self.filename = self.get_filename()
 
     def get_filename(self):
         course_id = clean_filename(self.course["course"]["course_code"])
         name = clean_filename(self.target["name"])
         return f"{self.name}_{course_id}_{name}.{self.extension}"
 
-    def get_path(self):
-        return os.path.join(self.args["output"], self.filename)
-
-    def output(self):
-        raise NotImplementedError(
-            "Subclasses must implement the output method to generate the report."
-        )
-
-    def start(self):
-        pass
+    def get_path(self, folder: Optional[str] = None):
+        return os.path.join(folder or self.args["output"], self.filename)
+
+    @property
+    def rendered(self) -> bool:
+        return self.content is not None
+
+    def render(self) -> bytes:
+        if self.content is None:
+            if self.renderer is None:
+                raise NotImplementedError(
+                    "Reports must be given a renderer to generate their contents."
+                )
+            self.content = self.renderer(self.payload)
+        return self.content
+
+    def output(self, folder: Optional[str] = None):
+        """
+        Optionally save the rendered report to disk; it is emailed from memory.
+        :param folder: Where to write the file (defaults to the `output` argument).
+        """
+        self.path = self.get_path(folder)
+        with open(self.path, "wb") as report_file:
+            report_file.write(self.render())
 
     def __str__(self):
         return f"Report for {self.target['name']}"
@@ -54,33 +89,28 @@ class Report:
 
 
 class PdfReport(Report):
-    maintype = "pdf"
+    maintype = "application"
     subtype = "pdf"
     extension = "pdf"
 
-    def __init__(
-        self,
-        name: str,
-        subject: str,
-        target: User,
-        course: CourseData,
-        args: CronyConfiguration,
-        pdf: FPDF = None,
-    ):
-        super().__init__(name, subject, target, course, args)
-        self.pdf = pdf
-
-    def output(self):
-        self.filename = self.get_filename()
-        self.path = self.get_path()
-        self.pdf.output(self.path)
-
 
 class XlsxReport(Report):
-    maintype = "xlsx"
-    subtype = "xlsx"
+    maintype = "application"
+    subtype = "vnd.openxmlformats-officedocument.spreadsheetml.sheet"
     extension = "xlsx"
 
+
+class HtmlReport(Report):
+    """
+    A lightweight report that is read right in the email body. Its renderer makes an
+    HTML fragment; the text renderer makes the plain text alternative.
+    """
+
+    maintype = "text"
+    subtype = "html"
+    extension = "html"
+    embedded = True
+
     def __init__(
         self,
         name: str,
@@ -88,18 +118,23 @@ class XlsxReport(Report):
         target: User,
         course: CourseData,
         args: CronyConfiguration,
+        renderer: Renderer = None,
+        payload: Any = None,
+        text_renderer: Callable[[Any], str] = None,
     ):
-        super().__init__(name, subject, target, course, args)
-        self.xlsx = None
+        super().__init__(name, subject, target, course, args, renderer, payload)
+        self.text_renderer = text_renderer
 
-    def start(self):
-        self.filename = self.get_filename()
-        self.path = self.get_path()
-        self.xlsx = xlsxwriter.Workbook(self.get_path())
-        return self.xlsx
+    def html(self) -> str:
+        return self.render().decode("utf-8")
+
+    def text(self) -> str:
+        return self.text_renderer(self.payload)
 
-    def output(self):
-        self.xlsx.close()
+    def output(self, folder: Optional[str] = None):
+        self.path = self.get_path(folder)
+        with open(self.path, "w", encoding="utf-8") as report_file:
+            report_file.write(html_page(self.filename, [self.html()]))
 
 
 class ReportSet:
@@ -111,10 +146,10 @@ class ReportSet:
     def extend(self, reports: list[Report]):
         self.reports.extend(reports)
 
-    def output(self):
+    def output(self, folder: Optional[str] = None):
         # consolidate targets across reports?
         for report in self.reports:
-            report.output()
+            report.output(folder)
 
     def __str__(self):
         return (
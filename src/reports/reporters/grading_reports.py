@@ -1,9 +1,8 @@
 from dataclasses import dataclass
 from typing import Literal, get_args
+import io
 import math
-
-from fpdf import FPDF
-import xlsxwriter
+import re
 
 from canvas_data import CourseData, User, GradingStatus, Submission, Group, NOT_CRITICAL
 from canvas_request import days_between, past_date
@@ -16,8 +15,14 @@ from reports.course_helpers import (
     make_grading_piles,
     make_graded_piles,
 )
-from reports.report_tools import make_table
-from reports.report_types import Report, PdfReport, XlsxReport
+from reports.registry import CourseViews, register_reporter
+from reports.report_types import (
+    Report,
+    PdfReport,
+    XlsxReport,
+    is_recipient,
+    any_recipients,
+)
 from reports.stats_helpers import f
 
 """
@@ -31,17 +36,25 @@ Long term things to add:
 """
 
 
-def make_grading_reports(course: CourseData, args: CronyConfiguration) -> list[Report]:
+@register_reporter("grading", views=["graded piles"])
+def make_grading_reports(
+    course: CourseData, views: CourseViews, args: CronyConfiguration
+) -> list[Report]:
     """
     Create grading reports for the course.
     :param course: The course data.
+    :param views: The course's shared views.
     :param args: The CLI arguments.
     :return: A list of reports.
     """
     reports = []
 
+    # Only instructors get grading reports
+    if not any_recipients(course["instructors"], args):
+        return reports
+
     # Get each TA mapped to their list of students
-    all_graded, ta_students_pile, ta_graded_pile = make_graded_piles(course)
+    all_graded, ta_students_pile, ta_graded_pile = views["graded piles"]
 
     instructor_reports = make_grading_reports_instructor(
         course, all_graded, ta_students_pile, ta_graded_pile, args
@@ -61,6 +74,26 @@ MAIN_PAGE_HEADERS = [
     "Graded after 2 weeks",
 ]
 
+DETAIL_PAGE_HEADERS = [
+    "Assignment",
+    "Student",
+    "Score",
+    "Points Possible",
+    "Submitted At",
+    "Graded At",
+    "Days to Grade",
+]
+
+# Excel limits sheet names to 31 characters, without any of these
+INVALID_SHEET_CHARACTERS = re.compile(r"[\[\]:*?/\\]")
+
+
+@dataclass
+class GradingPayload:
+    rows: list[list]
+    # Each TA's name, and a row for every submission they graded
+    details: list[tuple[str, list[list]]]
+
 
 def make_grading_reports_instructor(
     course: CourseData,
@@ -80,88 +113,155 @@ def make_grading_reports_instructor(
     """
     reports = []
 
-    for instructor in course["instructors"]:
-        new_report = XlsxReport(
-            "grading",
-            "{course_name} Grading Report for {user_name}",
-            instructor,
-            course,
-            args,
-        )
-        workbook = new_report.start()
+    known_staff = {ta["id"] for ta in course["staff"].values()}
+    grader_tas = set(ta_graded_pile.keys())
+    all_tas = known_staff.union(grader_tas)
+    all_tas.discard(None)  # Remove any None entries if they exist
 
-        worksheet = workbook.add_worksheet("Grading Report")
+    rows = []
+    details = []
+    for ta_id in all_tas:
+        ta = course["users"][ta_id]
+        graded_submissions = ta_graded_pile.get(ta["id"], [])
 
-        for col_num, header in enumerate(MAIN_PAGE_HEADERS):
-            worksheet.write(0, col_num, header)
+        assigned_submissions_by_status = ta_students_pile.get(ta["id"], {})
+        all_assigned_submissions = [
+            submissions
+            for status, submissions in assigned_submissions_by_status.items()
+        ]
+        assigned_submissions = sum(
+            len(submissions) for submissions in all_assigned_submissions
+        )
 
-        known_staff = {ta["id"] for ta in course["staff"].values()}
-        grader_tas = set(ta_graded_pile.keys())
-        all_tas = known_staff.union(grader_tas)
-        all_tas.discard(None)  # Remove any None entries if they exist
+        ungraded_submissions = assigned_submissions - len(graded_submissions)
 
-        for row_num, ta_id in enumerate(all_tas, start=1):
-            ta = course["users"][ta_id]
-            worksheet.write(row_num, 0, ta["name"])
+        graded_within_week = (
+            100
+            * sum(
+                1
+                for submission in graded_submissions
+                if days_between(submission["graded_at"], submission["submitted_at"])
+                <= 7
+            )
+            // len(graded_submissions)
+            if graded_submissions
+            else 0
+        )
 
-            graded_submissions = ta_graded_pile.get(ta["id"], [])
-            worksheet.write(row_num, 1, len(graded_submissions))
+        graded_after_two_weeks = (
+            100
+            * sum(
+                1
+                for submission in graded_submissions
+                if days_between(submission["graded_at"], submission["submitted_at"])
+                > 14
+            )
+            // len(graded_submissions)
+            if graded_submissions
+            else 0
+        )
 
-            assigned_submissions_by_status = ta_students_pile.get(ta["id"], {})
-            all_assigned_submissions = [
-                submissions
-                for status, submissions in assigned_submissions_by_status.items()
+        rows.append(
+            [
+                ta["name"],
+                len(graded_submissions),
+                assigned_submissions,
+                ungraded_submissions,
+                f"{f(graded_within_week)}%",
+                f"{f(graded_after_two_weeks)}%",
             ]
-            assigned_submissions = sum(
-                len(submissions) for submissions in all_assigned_submissions
-            )
-            worksheet.write(row_num, 2, assigned_submissions)
-
-            ungraded_submissions = assigned_submissions - len(graded_submissions)
-            worksheet.write(row_num, 3, ungraded_submissions)
-
-            graded_within_week = (
-                100
-                * sum(
-                    1
-                    for submission in graded_submissions
-                    if days_between(submission["graded_at"], submission["submitted_at"])
-                    <= 7
-                )
-                // len(graded_submissions)
-                if graded_submissions
-                else 0
-            )
-            worksheet.write(row_num, 4, f"{f(graded_within_week)}%")
-
-            graded_after_two_weeks = (
-                100
-                * sum(
-                    1
-                    for submission in graded_submissions
-                    if days_between(submission["graded_at"], submission["submitted_at"])
-                    > 14
-                )
-                // len(graded_submissions)
-                if graded_submissions
-                else 0
+        )
+        details.append((ta["name"], make_detail_rows(graded_submissions)))
+
+    # for row_num, (ta_id, graded_pile) in enumerate(ta_graded_pile.items(), start=1):
+    #     ta = course["users"].get(ta_id)
+    #     if ta_id is None:
+    #         worksheet.write(row_num, 0, f"Not yet graded")
+    #         worksheet.write(row_num, 1, len(graded_pile))
+    #         continue
+    #     if not ta:
+    #         worksheet.write(row_num, 0, f"TA {ta_id} not found: {ta_id}")
+    #         worksheet.write(row_num, 1, len(graded_pile))
+    #         continue
+    #
+    #     worksheet.write(row_num, 0, ta["name"])
+    #     worksheet.write(row_num, 1, len(graded_pile))
+
+    payload = GradingPayload(rows, details)
+    for instructor in course["instructors"]:
+        if not is_recipient(instructor, args):
+            continue
+        reports.append(
+            XlsxReport(
+                "grading",
+                "{course_name} Grading Report for {user_name}",
+                instructor,
+                course,
+                args,
+                render_grading_instructor,
+                payload,
             )
-            worksheet.write(row_num, 5, f"{f(graded_after_two_weeks)}%")
-
-        # for row_num, (ta_id, graded_pile) in enumerate(ta_graded_pile.items(), start=1):
-        #     ta = course["users"].get(ta_id)
-        #     if ta_id is None:
-        #         worksheet.write(row_num, 0, f"Not yet graded")
-        #         worksheet.write(row_num, 1, len(graded_pile))
-        #         continue
-        #     if not ta:
-        #         worksheet.write(row_num, 0, f"TA {ta_id} not found: {ta_id}")
-        #         worksheet.write(row_num, 1, len(graded_pile))
-        #         continue
-        #
-        #     worksheet.write(row_num, 0, ta["name"])
-        #     worksheet.write(row_num, 1, len(graded_pile))
-
-        reports.append(new_report)
+        )
 
     return reports
+
+
+def make_detail_rows(graded_submissions: list[Submission]) -> list[list]:
+    rows = []
+    seen = set()
+    for submission in graded_submissions:
+        # A submission lands in a grader's pile once per TA of its student
+        if submission["id"] in seen:
+            continue
+        seen.add(submission["id"])
+        rows.append(
+            [
+                submission["assignment"]["name"],
+                submission["user"]["name"],
+                submission["score"],
+                submission["assignment"]["points_possible"],
+                submission["submitted_at"],
+                submission["graded_at"],
+                (
+                    days_between(submission["graded_at"], submission["submitted_at"])
+                    if submission["submitted_at"] and submission["graded_at"]
+                    else None
+                ),
+            ]
+        )
+    return rows
+
+
+def make_sheet_name(name: str, used: set[str]) -> str:
+    base = INVALID_SHEET_CHARACTERS.sub("-", name)[:28] or "TA"
+    sheet_name, suffix = base, 1
+    while sheet_name.lower() in used:
+        suffix += 1
+        sheet_name = f"{base} {suffix}"
+    used.add(sheet_name.lower())
+    return sheet_name
+
+
+def render_grading_instructor(payload: GradingPayload) -> bytes:
+    # Only loaded by the processes that actually write spreadsheets
+    import xlsxwriter
+
+    output = io.BytesIO()
+    # Constant memory mode flushes each row as soon as the next one starts, so
+    # rows must be written in order, one sheet after the other.
+    workbook = xlsxwriter.Workbook(output, {"constant_memory": True})
+    used_names = {"grading report"}
+
+    worksheet = workbook.add_worksheet("Grading Report")
+    worksheet.write_row(0, 0, MAIN_PAGE_HEADERS)
+    for row_num, row in enumerate(payload.rows, start=1):
+        worksheet.write_row(row_num, 0, row)
+
+    for ta_name, detail_rows in payload.details:
+        worksheet = workbook.add_worksheet(make_sheet_name(ta_name, used_names))
+        worksheet.write_row(0, 0, DETAIL_PAGE_HEADERS)
+        for row_num, row in enumerate(detail_rows, start=1):
+            worksheet.write_row(row_num, 0, row)
+
+    workbook.close()
+    return output.getvalue()
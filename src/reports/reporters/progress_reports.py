@@ -1,17 +1,318 @@
 from __future__ import annotations
 
-from canvas_data import CourseData
+from dataclasses import dataclass
+import math
+
+import numpy as np
+
+from canvas_data import CourseData, User
 from cli_config import CronyConfiguration
-from reports.report_types import Report
+from reports.html_tools import html_heading, html_section, html_table, text_table
+from reports.progress_matrix import (
+    CompletionMatrix,
+    PROGRESS_STATUSES,
+    COMPLETED,
+    MISSING,
+    EXCUSED,
+    UPCOMING,
+)
+from reports.registry import CourseViews, register_reporter
+from reports.report_types import Report, HtmlReport, is_recipient, any_recipients
+from reports.stats_helpers import f
+
+STATUS_HEADERS = ["Completed", "Missing", "Excused", "Upcoming"]
+STATUS_ORDER = [COMPLETED, MISSING, EXCUSED, UPCOMING]
+
+
+@dataclass
+class ProgressPayload:
+    title: str
+    course_name: str
+    user_name: str
+    # Each table, with its heading
+    tables: list[tuple[str, list[list[str]]]]
+
+
+def render_progress_html(payload: ProgressPayload) -> bytes:
+    body = "".join(
+        html_heading(heading) + html_table(table) for heading, table in payload.tables
+    )
+    section = html_section(payload.title, payload.course_name, payload.user_name, body)
+    return section.encode("utf-8")
+
+
+def render_progress_text(payload: ProgressPayload) -> str:
+    lines = [payload.title, payload.course_name, payload.user_name, ""]
+    for heading, table in payload.tables:
+        lines.append(heading)
+        lines.append(text_table(table))
+    return "\n".join(lines)
+
+
+def percent(part: float, whole: float) -> str:
+    return f"{f(100 * part / whole)}%" if whole else ""
+
+
+def score(value: float) -> str:
+    return "" if math.isnan(value) else f"{f(value)}%"
+
+
+def status_row(name: str, counts: np.ndarray, mean_score: float) -> list[str]:
+    """A table row from one column of a (statuses x ...) count matrix."""
+    total = int(counts.sum())
+    completed = int(counts[COMPLETED])
+    return [
+        name,
+        *(str(int(counts[code])) for code in STATUS_ORDER),
+        percent(completed, total - int(counts[EXCUSED])),
+        score(mean_score),
+    ]
+
+
+STATUS_TABLE_HEADER = ["", *STATUS_HEADERS, "Completion", "Average Score"]
+
+
+def make_student_table(
+    course: CourseData,
+    matrix: CompletionMatrix,
+    student_ids: list[int],
+    counts: np.ndarray,
+    scores: np.ndarray,
+) -> list[list[str]]:
+    """
+    :param counts: Every student's status counts (see `student_counts`).
+    :param scores: Every student's mean score (see `student_scores`).
+    """
+    table = [STATUS_TABLE_HEADER]
+    for student_id in sorted(
+        student_ids, key=lambda student_id: course["users"][student_id]["name"]
+    ):
+        index = matrix.student_index.get(student_id)
+        if index is None:
+            continue
+        table.append(
+            status_row(
+                course["users"][student_id]["name"], counts[:, index], scores[index]
+            )
+        )
+    return table
+
+
+def make_assignment_table(
+    course: CourseData, matrix: CompletionMatrix, counts: np.ndarray
+) -> list[list[str]]:
+    scores = matrix.assignment_scores()
+    table = [STATUS_TABLE_HEADER]
+    for index, assignment_id in enumerate(matrix.assignment_ids):
+        table.append(
+            status_row(
+                course["assignments"][assignment_id]["name"],
+                counts[:, index],
+                scores[index],
+            )
+        )
+    return table
+
+
+ACTIVITY_TABLE_HEADER = [
+    "",
+    "Page Views",
+    "Participations",
+    "On Time",
+    "Late",
+    "Missing",
+]
+
+
+def make_activity_table(course: CourseData, student_ids: list[int]) -> list[list[str]]:
+    """
+    The students' activity, from the course's Analytics API summaries.
+    """
+    summaries = course.get("student_summaries", {})
+    table = [ACTIVITY_TABLE_HEADER]
+    for student_id in sorted(
+        student_ids, key=lambda student_id: course["users"][student_id]["name"]
+    ):
+        if student_id not in summaries:
+            continue
+        summary = summaries[student_id]
+        tardiness = summary["tardiness_breakdown"]
+        table.append(
+            [
+                course["users"][student_id]["name"],
+                str(summary["page_views"]),
+                str(summary["participations"]),
+                str(tardiness["on_time"]),
+                str(tardiness["late"]),
+                str(tardiness["missing"]),
+            ]
+        )
+    return table
+
+
+def get_cohort_students(course: CourseData) -> dict[str, list[int]]:
+    return {
+        cohort_name: [
+            student["id"]
+            for student in course["group_memberships"].get(cohort_name, [])
+        ]
+        for cohort_name in course["cohorts"]
+    }
+
+
+@register_reporter("progress", views=["completion matrix"], default=False)
+def make_progress_reports(
+    course: CourseData, views: CourseViews, args: CronyConfiguration
+) -> list[Report]:
+    """
+    Create progress reports for the staff (their cohorts' students) and instructors.
+    :param course: The course data.
+    :param views: The course's shared views.
+    :param args: The CLI arguments.
+    :return: A list of reports.
+    """
+    reports = []
+    staff = {ta["id"]: ta for tas in course["cohorts"].values() for ta in tas}
+    if not any_recipients([*staff.values(), *course["instructors"]], args):
+        return reports
+
+    matrix: CompletionMatrix = views["completion matrix"]
+    cohorts = get_cohort_students(course)
+    # Shared by every TA's cohort tables and the instructors' summary
+    student_counts = matrix.student_counts()
+    student_scores = matrix.student_scores()
+
+    for ta in staff.values():
+        if not is_recipient(ta, args):
+            continue
+        ta_cohorts = {
+            cohort_name: students
+            for cohort_name, students in cohorts.items()
+            if any(
+                member["id"] == ta["id"] for member in course["cohorts"][cohort_name]
+            )
+        }
+        ta_students = sorted({s for students in ta_cohorts.values() for s in students})
+        tables = [
+            (
+                f"{cohort_name}:",
+                make_student_table(
+                    course, matrix, students, student_counts, student_scores
+                ),
+            )
+            for cohort_name, students in ta_cohorts.items()
+        ]
+        tables.append(
+            (
+                "Assignments:",
+                make_assignment_table(
+                    course, matrix, matrix.student_assignment_counts(ta_students)
+                ),
+            )
+        )
+        if course.get("student_summaries"):
+            tables.append(("Activity:", make_activity_table(course, ta_students)))
+        reports.append(
+            make_progress_report(course, ta, "Staff Progress Report", tables, args)
+        )
+
+    if any_recipients(course["instructors"], args):
+        membership = matrix.membership(cohorts)
+        cohort_counts = student_counts @ membership.T
+        has_score = ~np.isnan(student_scores)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cohort_scores = (membership @ np.nan_to_num(student_scores)) / (
+                membership @ has_score
+            )
+        cohort_table = [STATUS_TABLE_HEADER] + [
+            status_row(cohort_name, cohort_counts[:, index], cohort_scores[index])
+            for index, cohort_name in enumerate(cohorts)
+        ]
+        tables = [
+            ("Cohorts:", cohort_table),
+            (
+                "Assignments:",
+                make_assignment_table(course, matrix, matrix.assignment_counts()),
+            ),
+        ]
+        # Every instructor gets the same report
+        payload = ProgressPayload(
+            "Instructor Progress Report",
+            course["course"]["name"],
+            ", ".join(instructor["name"] for instructor in course["instructors"]),
+            tables,
+        )
+        for instructor in course["instructors"]:
+            if not is_recipient(instructor, args):
+                continue
+            reports.append(
+                HtmlReport(
+                    "progress",
+                    "{course_name} Instructor Progress Report for {user_name}",
+                    instructor,
+                    course,
+                    args,
+                    render_progress_html,
+                    payload,
+                    render_progress_text,
+                )
+            )
+    return reports
 
 
-def make_progress_reports(course: CourseData, args: CronyConfiguration) -> list[Report]:
+@register_reporter("student progress", views=["completion matrix"], default=False)
+def make_student_progress_reports(
+    course: CourseData, views: CourseViews, args: CronyConfiguration
+) -> list[Report]:
+    """
+    Create a progress report for every student, covering only their own work.
+    """
     reports = []
-    staff_reports = {}
-    instructor_reports = {}
-    student_reports = {}
-    for student in course['students']:
-        pass
+    if not any_recipients(list(course["students"].values()), args):
+        return reports
+    matrix: CompletionMatrix = views["completion matrix"]
+    for student_id, student in course["students"].items():
+        if not is_recipient(student, args):
+            continue
+        row = matrix.student_row(student_id)
+        table = [["Assignment", "Status", "Score"]]
+        for assignment_id in matrix.assignment_ids:
+            if assignment_id not in row:
+                continue
+            code, value = row[assignment_id]
+            table.append(
+                [
+                    course["assignments"][assignment_id]["name"],
+                    PROGRESS_STATUSES[code],
+                    score(value),
+                ]
+            )
+        reports.append(
+            make_progress_report(
+                course,
+                student,
+                "Student Progress Report",
+                [("Assignments:", table)],
+                args,
+            )
+        )
     return reports
 
 
+def make_progress_report(
+    course: CourseData,
+    target: User,
+    title: str,
+    tables: list[tuple[str, list[list[str]]]],
+    args: CronyConfiguration,
+) -> Report:
+    return HtmlReport(
+        "progress",
+        "{course_name} Progress Report for {user_name}",
+        target,
+        course,
+        args,
+        render_progress_html,
+        ProgressPayload(title, course["course"]["name"], target["name"], tables),
+        render_progress_text,
+    )
@@ -1,11 +1,9 @@
 from __future__ import annotations
 
 from dataclasses import dataclass
-from typing import Literal, get_args
+from typing import Literal, Optional, get_args
 import math
 
-from fpdf import FPDF
-
 from canvas_data import CourseData, User, GradingStatus, Submission, Group, NOT_CRITICAL
 from canvas_request import days_between, past_date
 from cli_config import CronyConfiguration
@@ -17,26 +15,48 @@ from reports.course_helpers import (
     make_grading_piles,
     make_ungraded_piles,
 )
-from reports.report_tools import make_table
-from reports.report_types import Report, PdfReport
-from reports.stats_helpers import f, iqr, get_normal_stats
+from reports.registry import CourseViews, register_reporter
+from reports.report_tools import make_table, start_pdf, pdf_bytes
+from reports.report_types import Report, PdfReport, is_recipient, any_recipients
+from reports.stats_helpers import f, ScoreStats, make_score_stats
+from reports.summary_store import save_score_summaries
 
 RECENTLY_THRESHOLD = 3  # days
 ANCIENT_THRESHOLD = 7  # days
 
 
-def make_score_reports(course: CourseData, args: CronyConfiguration) -> list[Report]:
+@register_reporter("score", views=["graded by grader", "score stats"])
+def make_score_reports(
+    course: CourseData, views: CourseViews, args: CronyConfiguration
+) -> list[Report]:
     reports = []
 
-    # Get each TA mapped to their list of students
-    staff_for_student = get_staff_for_student(course)
-
     # Process each submission, add it to our piles if ungraded
-    all_graded, grader_piles = make_ungraded_piles(course)
+    all_graded, grader_piles = views["graded by grader"]
+
+    # Keep mergeable summaries around for cross-course rollups
+    if args.get("summaries"):
+        save_score_summaries(course, grader_piles, args["summaries"])
+
+    # Skip the statistics if none of these reports would be delivered
+    graders = [course["users"][ta_id] for ta_id in grader_piles]
+    if not any_recipients([*graders, *course["instructors"]], args):
+        return reports
+
+    # Without any instructor reports, only the recipients' own stats are needed
+    if any_recipients(course["instructors"], args):
+        score_stats = views["score stats"]
+    else:
+        grader_piles = {
+            ta_id: graded
+            for ta_id, graded in grader_piles.items()
+            if is_recipient(course["users"][ta_id], args)
+        }
+        score_stats = make_score_stats(grader_piles)
 
     # Make a PDF for each TA
     staff_reports, staff_tables = make_score_reports_staff(
-        course, grader_piles, len(all_graded), args
+        course, grader_piles, score_stats, len(all_graded), args
     )
     # Make a PDF for the instructor
     instructor_reports = make_score_reports_instructor(
@@ -55,123 +75,104 @@ class StaffTables:
     normal_stats: list[list[str]]
 
 
+@dataclass
+class ScoreSection:
+    # None for the "All Assignments" section
+    assignment_name: Optional[str]
+    graded: int
+    points_possible: float
+    tables: StaffTables
+
+
+@dataclass
+class ScoreStaffPayload:
+    course_name: str
+    ta_name: str
+    sections: list[ScoreSection]
+
+
+@dataclass
+class ScoreInstructorPayload:
+    course_name: str
+    # Every instructor gets the same document, so they are all named in it
+    instructor_names: str
+    summary: list[str]
+    # The assignment header (or None for all of them), and each stat's combined tables
+    assignments: list[
+        tuple[Optional[tuple[str, float]], list[tuple[str, dict[str, list[list[str]]]]]]
+    ]
+
+
 def make_score_reports_staff(
     course: CourseData,
     grader_piles: dict[int, list[Submission]],
+    score_stats: dict[int, dict[Optional[int], ScoreStats]],
     total_graded: int,
     args: CronyConfiguration,
 ):
     staff_reports = []
     staff_tables = {}
-    for ta_id, graded in grader_piles.items():
+    for ta_id in grader_piles:
         ta = course["users"][ta_id]
-        # PDF
-        staff_pdf = FPDF()
-        staff_pdf.add_page()
-        # Page Header
-        staff_pdf.set_font("helvetica", "B", size=22)
-        staff_pdf.write(txt=f"Staff Score Report\n")
-        staff_pdf.set_font("helvetica", size=18)
-        staff_pdf.write(txt=course["course"]["name"] + "\n")
-        staff_pdf.write(txt=ta["name"] + "\n")
-        staff_pdf.ln()
-        # Summarize data
-        staff_pdf.set_font("helvetica", size=14)
-
-        # Group by graded
-        graded_by_assignment = {
-            None: list(graded),
-        }
-        for submission in graded:
-            assignment_id = submission["assignment"]["id"]
-            if assignment_id not in graded_by_assignment:
-                graded_by_assignment[assignment_id] = []
-            graded_by_assignment[assignment_id].append(submission)
-
-        for assignment_id, graded in graded_by_assignment.items():
-            if not graded:
-                continue
-            assignment = graded[0]["assignment"]
-            # Header information
-            staff_pdf.set_font(size=18)
-            if assignment_id is None:
-                staff_pdf.write(txt="All Assignments:\n")
-                staff_pdf.set_font(size=12)
-            else:
-                staff_pdf.write(txt=assignment["name"] + ":\n")
-                staff_pdf.set_font(size=12)
-                staff_pdf.write(txt=f"Graded: {len(graded)}\n")
-                staff_pdf.write(txt=f"Total Points: {assignment['points_possible']}\n")
+        sections = []
+        for assignment_id, stats in score_stats[ta_id].items():
             if assignment_id not in staff_tables:
                 staff_tables[assignment_id] = {}
 
             # Extents (Zeros and Perfects)
-            zeroes = [sub for sub in graded if sub["score"] == 0]
-            perfects = [
-                sub
-                for sub in graded
-                if sub["score"] == sub["assignment"]["points_possible"]
-            ]
             extents_table = [
                 ["", "Number", "Percent", "Out of Total"],
                 [
                     "Graded Submissions",
-                    str(len(graded)),
-                    f"{f(100*len(graded)/total_graded)}%",
+                    str(stats.count),
+                    f"{f(100*stats.count/total_graded)}%",
                     str(total_graded),
                 ],
                 [
                     "Zeroes",
-                    str(len(zeroes)),
-                    f"{f(100*len(zeroes)/len(graded))}%",
-                    str(len(graded)),
+                    str(stats.zeroes),
+                    f"{f(100*stats.zeroes/stats.count)}%",
+                    str(stats.count),
                 ],
                 [
                     "Perfects",
-                    str(len(perfects)),
-                    f"{f(100*len(perfects)/len(graded))}%",
-                    str(len(graded)),
+                    str(stats.perfects),
+                    f"{f(100*stats.perfects/stats.count)}%",
+                    str(stats.count),
                 ],
             ]
-            make_table(staff_pdf, extents_table)
-
-            all_scores = [
-                (
-                    100 * sub["score"] / sub["assignment"].get("points_possible", 0)
-                    if sub["assignment"]["points_possible"] and sub["score"]
-                    else sub["score"] or 0
-                )
-                for sub in graded
-            ]
-            nonzero_scores = [
-                (100 * sub["score"] / sub["assignment"]["points_possible"])
-                for sub in graded
-                if sub["score"] and sub["assignment"]["points_possible"]
-            ]
 
             # IQR (with and without zeroes)
-            staff_pdf.ln()
             iqr_table = [
                 ["", "Min", "25%", "Median", "75%", "Max"],
-                ["All Scores", *iqr(all_scores)],
-                ["Non-Zero Scores", *iqr(nonzero_scores)],
+                ["All Scores", *stats.all_scores.iqr()],
+                ["Non-Zero Scores", *stats.nonzero_scores.iqr()],
             ]
-            make_table(staff_pdf, iqr_table)
 
             # Mean, Variance, Std Dev
-            staff_pdf.ln()
             normal_stats = [
                 ["", "Mean", "Variance", "Std Dev"],
-                ["All Scores", *get_normal_stats(all_scores)],
-                ["Non-Zero Scores", *get_normal_stats(nonzero_scores)],
+                ["All Scores", *stats.all_scores.normal_stats()],
+                ["Non-Zero Scores", *stats.nonzero_scores.normal_stats()],
             ]
-            make_table(staff_pdf, normal_stats)
-            staff_pdf.ln()
 
-            staff_tables[assignment_id][ta_id] = StaffTables(
-                extents_table, iqr_table, normal_stats
-            )
+            tables = StaffTables(extents_table, iqr_table, normal_stats)
+            staff_tables[assignment_id][ta_id] = tables
+            if assignment_id is None:
+                sections.append(ScoreSection(None, stats.count, 0, tables))
+            else:
+                assignment = course["assignments"][assignment_id]
+                sections.append(
+                    ScoreSection(
+                        assignment["name"],
+                        stats.count,
+                        assignment["points_possible"],
+                        tables,
+                    )
+                )
 
+        if not is_recipient(ta, args):
+            continue
         # Grade distribution histogram
         # TODO: Make the histogram and embed it
         # Wrap it up
@@ -182,12 +183,37 @@ def make_score_reports_staff(
                 ta,
                 course,
                 args,
-                staff_pdf,
+                render_score_staff,
+                ScoreStaffPayload(course["course"]["name"], ta["name"], sections),
             )
         )
     return staff_reports, staff_tables
 
 
+def render_score_staff(payload: ScoreStaffPayload) -> bytes:
+    staff_pdf = start_pdf("Staff Score Report", payload.course_name, payload.ta_name)
+    # Summarize data
+    staff_pdf.set_font("helvetica", size=14)
+    for section in payload.sections:
+        # Header information
+        staff_pdf.set_font(size=18)
+        if section.assignment_name is None:
+            staff_pdf.write(txt="All Assignments:\n")
+            staff_pdf.set_font(size=12)
+        else:
+            staff_pdf.write(txt=section.assignment_name + ":\n")
+            staff_pdf.set_font(size=12)
+            staff_pdf.write(txt=f"Graded: {section.graded}\n")
+            staff_pdf.write(txt=f"Total Points: {section.points_possible}\n")
+        make_table(staff_pdf, section.tables.extents)
+        staff_pdf.ln()
+        make_table(staff_pdf, section.tables.iqr)
+        staff_pdf.ln()
+        make_table(staff_pdf, section.tables.normal_stats)
+        staff_pdf.ln()
+    return pdf_bytes(staff_pdf)
+
+
 def combine_tables(
     tables: list[list[list[str]]], names: list[str]
 ) -> dict[str, list[list[str]]]:
@@ -211,65 +237,57 @@ def make_score_reports_instructor(
     args: CronyConfiguration,
 ):
     instructor_reports = []
-    for instructor in course["instructors"]:
-        instructor_pdf = FPDF()
-        instructor_pdf.add_page()
-        # Page Header
-        instructor_pdf.set_font("helvetica", "B", size=22)
-        instructor_pdf.write(txt=f"Instructor Score Report\n")
-        instructor_pdf.set_font("helvetica", size=18)
-        instructor_pdf.write(txt=course["course"]["name"] + "\n")
-        instructor_pdf.write(txt=instructor["name"] + "\n")
-        instructor_pdf.ln()
-        # Overall summary
-        instructor_pdf.set_font("helvetica", size=12)
+    if not any_recipients(course["instructors"], args):
+        return instructor_reports
+    # Overall summary
+    expected_submissions = len(course["students"]) * len(course["assignments"])
+    summary = [
         #   TA Sts
-        instructor_pdf.write(txt=f"Staff: {len(assignment_staff_tables)}\n")
-        instructor_pdf.write(txt=f"Groups: {len(course['groups'])}\n")
-        instructor_pdf.write(txt=f"Students: {len(course['students'])}\n")
-        instructor_pdf.write(txt=f"Assignments: {len(course['assignments'])}\n")
-        expected_submissions = len(course["students"]) * len(course["assignments"])
-        instructor_pdf.write(
-            txt=f"Submissions: {len(course['submissions'])} ({expected_submissions} possible)\n"
-        )
-        instructor_pdf.write(
-            txt=f"Graded: {len(all_graded)} ({len(all_graded)/expected_submissions:.2%})\n"
-        )
-        instructor_pdf.ln()
+        f"Staff: {len(assignment_staff_tables)}",
+        f"Groups: {len(course['groups'])}",
+        f"Students: {len(course['students'])}",
+        f"Assignments: {len(course['assignments'])}",
+        f"Submissions: {len(course['submissions'])} ({expected_submissions} possible)",
+        f"Graded: {len(all_graded)} ({len(all_graded)/expected_submissions:.2%})",
+    ]
 
-        # List out the TA's progress
-        for assignment_id, staff_tables in assignment_staff_tables.items():
-            if assignment_id is not None:
-                assignment = course["assignments"][assignment_id]
-                instructor_pdf.set_font(size=18)
-                instructor_pdf.write(txt=assignment["name"] + ":\n")
-                instructor_pdf.set_font(size=12)
-                instructor_pdf.write(
-                    txt=f"Total Points: {assignment['points_possible']}\n"
-                )
-            instructor_pdf.ln()
-            for stat_name, stat_field in [
-                ("Extents", "extents"),
-                ("IQR of Percentage Scores", "iqr"),
-                ("Normal Stats of Percentage Scores", "normal_stats"),
-            ]:
-                instructor_pdf.set_font(size=14)
-                instructor_pdf.write(txt=stat_name + ":\n")
-                names = [course["users"][ta_id]["name"] for ta_id in staff_tables]
-                taken_tables = combine_tables(
+    # List out the TA's progress
+    assignments = []
+    for assignment_id, staff_tables in assignment_staff_tables.items():
+        header = None
+        if assignment_id is not None:
+            assignment = course["assignments"][assignment_id]
+            header = (assignment["name"], assignment["points_possible"])
+        names = [course["users"][ta_id]["name"] for ta_id in staff_tables]
+        stats = [
+            (
+                stat_name,
+                combine_tables(
                     [
                         getattr(staff_tables[ta_id], stat_field)
                         for ta_id in staff_tables
                     ],
                     names,
-                )
-                instructor_pdf.set_font(size=12)
-                for table_name, table in taken_tables.items():
-                    instructor_pdf.write(txt=table_name + ":\n")
-                    make_table(instructor_pdf, table)
-                    instructor_pdf.ln()
-            instructor_pdf.add_page()
+                ),
+            )
+            for stat_name, stat_field in [
+                ("Extents", "extents"),
+                ("IQR of Percentage Scores", "iqr"),
+                ("Normal Stats of Percentage Scores", "normal_stats"),
+            ]
+        ]
+        assignments.append((header, stats))
 
+    # Render just once, and send the same document to every instructor
+    payload = ScoreInstructorPayload(
+        course["course"]["name"],
+        ", ".join(instructor["name"] for instructor in course["instructors"]),
+        summary,
+        assignments,
+    )
+    for instructor in course["instructors"]:
+        if not is_recipient(instructor, args):
+            continue
         # Wrap it up
         instructor_reports.append(
             PdfReport(
@@ -278,7 +296,39 @@ def make_score_reports_instructor(
                 instructor,
                 course,
                 args,
-                instructor_pdf,
+                render_score_instructor,
+                payload,
             )
         )
     return instructor_reports
+
+
+def render_score_instructor(payload: ScoreInstructorPayload) -> bytes:
+    instructor_pdf = start_pdf(
+        "Instructor Score Report", payload.course_name, payload.instructor_names
+    )
+    # Overall summary
+    instructor_pdf.set_font("helvetica", size=12)
+    for line in payload.summary:
+        instructor_pdf.write(txt=line + "\n")
+    instructor_pdf.ln()
+
+    # List out the TA's progress
+    for header, stats in payload.assignments:
+        if header is not None:
+            assignment_name, points_possible = header
+            instructor_pdf.set_font(size=18)
+            instructor_pdf.write(txt=assignment_name + ":\n")
+            instructor_pdf.set_font(size=12)
+            instructor_pdf.write(txt=f"Total Points: {points_possible}\n")
+        instructor_pdf.ln()
+        for stat_name, taken_tables in stats:
+            instructor_pdf.set_font(size=14)
+            instructor_pdf.write(txt=stat_name + ":\n")
+            instructor_pdf.set_font(size=12)
+            for table_name, table in taken_tables.items():
+                instructor_pdf.write(txt=table_name + ":\n")
+                make_table(instructor_pdf, table)
+                instructor_pdf.ln()
+        instructor_pdf.add_page()
+    return pdf_bytes(instructor_pdf)
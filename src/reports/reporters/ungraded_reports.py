@@ -1,8 +1,7 @@
 from __future__ import annotations
+from dataclasses import dataclass
 import math
 
-from fpdf import FPDF
-
 from canvas_data import CourseData, User, GradingStatus, Submission, Group, NOT_CRITICAL
 from canvas_request import days_between, past_date
 from cli_config import CronyConfiguration
@@ -13,15 +12,37 @@ from reports.course_helpers import (
     days_old,
     make_grading_piles,
 )
-from reports.report_tools import make_table
-from reports.report_types import Report, PdfReport
+from reports.registry import CourseViews, register_reporter
+from reports.html_tools import (
+    html_heading,
+    html_links,
+    html_section,
+    html_table,
+    text_table,
+)
+from reports.report_tools import make_table, start_pdf, pdf_bytes
+from reports.report_types import (
+    Report,
+    PdfReport,
+    HtmlReport,
+    is_recipient,
+    any_recipients,
+)
 
 
-def make_ungraded_reports(course: CourseData, args: CronyConfiguration) -> list[Report]:
+@register_reporter("ungraded", views=["grading piles"])
+def make_ungraded_reports(
+    course: CourseData, views: CourseViews, args: CronyConfiguration
+) -> list[Report]:
     reports = []
     staff_reports = {}
 
-    big_pile, ta_grading_piles = make_grading_piles(course)
+    # Skip all the work if none of these reports would be delivered
+    graders = [*course["staff"].values(), *course["instructors"]]
+    if not any_recipients(graders, args):
+        return reports
+
+    big_pile, ta_grading_piles = views["grading piles"]
 
     # Make a PDF for each TA
     staff_reports = make_ungraded_reports_staff(
@@ -37,6 +58,53 @@ def make_ungraded_reports(course: CourseData, args: CronyConfiguration) -> list[
     return reports
 
 
+@dataclass
+class Link:
+    age: int
+    text: str
+    url: str
+
+
+@dataclass
+class UngradedStaffPayload:
+    course_name: str
+    ta_name: str
+    status_table: list[list[str]]
+    links: list[Link]
+
+
+@dataclass
+class UngradedInstructorPayload:
+    course_name: str
+    # Every instructor gets the same document, so they are all named in it
+    instructor_names: str
+    summary: list[str]
+    ta_tables: list[tuple[str, list[list[str]]]]
+    ta_links: list[tuple[str, list[Link]]]
+
+
+def make_status_table(
+    piles: dict[GradingStatus, list[Submission]],
+) -> list[list[str]]:
+    table_data = [["", "Total", "Past 3 Days", "Past Week", "Older"]]
+    for status, pile in piles.items():
+        if pile:
+            recent, ancient = check_recency(*pile)
+            normal = len(pile) - recent - ancient
+            table_data.append(
+                [
+                    status.title(),
+                    str(len(pile)),
+                    str(recent),
+                    str(normal),
+                    str(ancient),
+                ]
+            )
+            # staff_pdf.write(txt=f"{}: {len(pile)} total"
+            #                    f" ({recent} within past 3 days, {normal} within last week, {ancient} older)\n")
+    return table_data
+
+
 def make_ungraded_reports_staff(
     course: CourseData,
     big_pile: dict[GradingStatus, set[int]],
@@ -46,79 +114,89 @@ def make_ungraded_reports_staff(
     staff_reports = []
     for ta_id, piles in ta_grading_piles.items():
         ta = course["users"][ta_id]
-        # PDF
-        staff_pdf = FPDF()
-        staff_pdf.add_page()
-        # Page Header
-        staff_pdf.set_font("helvetica", "B", size=22)
-        staff_pdf.write(txt=f"Staff Ungraded Report\n")
-        staff_pdf.set_font("helvetica", size=18)
-        staff_pdf.write(txt=course["course"]["name"] + "\n")
-        staff_pdf.write(txt=ta["name"] + "\n")
-        staff_pdf.ln()
-        # Summarize data
-        staff_pdf.set_font("helvetica", size=14)
-        table_data = [["", "Total", "Past 3 Days", "Past Week", "Older"]]
-        for status, pile in piles.items():
-            if pile:
-                recent, ancient = check_recency(*pile)
-                normal = len(pile) - recent - ancient
-                table_data.append(
-                    [
-                        status.title(),
-                        str(len(pile)),
-                        str(recent),
-                        str(normal),
-                        str(ancient),
-                    ]
-                )
-                # staff_pdf.write(txt=f"{}: {len(pile)} total"
-                #                    f" ({recent} within past 3 days, {normal} within last week, {ancient} older)\n")
-        make_table(staff_pdf, table_data)
-        staff_pdf.ln()
-        # List all the actual links
-        staff_pdf.set_font("helvetica", size=14)
-        list_actual_links(staff_pdf, piles, course)
-        """
-        flat_pile = sorted([(days_old(submission), status, submission)
-                            for status, pile in piles.items()
-                            for submission in pile
-                            if status not in NOT_CRITICAL],
-                           key=lambda item: (-item[0], item[1]))
-        previous_age = None
-        if not flat_pile:
-            staff_pdf.write(txt="You are all caught up on grading! Great work!")
-        for age, status, submission in flat_pile:
-            log_age = round(math.log2(age)) if age > 0 else 0
-            if previous_age is None or log_age < previous_age:
-                previous_age = log_age
-                staff_pdf.set_font(size=18)
-                staff_pdf.write(txt=f"{age} day{'s' if age > 1 else ''} ago:\n")
-                staff_pdf.set_font(size=14)
-            assignment = submission['assignment']
-            url = course['speed_grader_url'].format(course_id=course['id'], assignment_id=assignment['id'],
-                                                    user_id=submission['user']['id'])
-            staff_pdf.write(txt="   ")
-            staff_pdf.set_font(style="U")
-            staff_pdf.write(txt=f"{assignment['name']}: {submission['user']['name']}", link=url)
-            staff_pdf.set_font()
-            staff_pdf.ln()
-        """
+        if not is_recipient(ta, args):
+            continue
+        payload = UngradedStaffPayload(
+            course["course"]["name"],
+            ta["name"],
+            make_status_table(piles),
+            collect_links(piles, course),
+        )
         # Wrap it up
-        staff_reports.append(
-            PdfReport(
-                "ungraded",
-                "{course_name} Grading Report for {user_name}",
-                ta,
-                course,
-                args,
-                staff_pdf,
+        if wants_pdf(ta, course):
+            staff_reports.append(
+                PdfReport(
+                    "ungraded",
+                    "{course_name} Grading Report for {user_name}",
+                    ta,
+                    course,
+                    args,
+                    render_ungraded_staff,
+                    payload,
+                )
+            )
+        else:
+            staff_reports.append(
+                HtmlReport(
+                    "ungraded",
+                    "{course_name} Grading Report for {user_name}",
+                    ta,
+                    course,
+                    args,
+                    render_ungraded_staff_html,
+                    payload,
+                    render_ungraded_staff_text,
+                )
             )
-        )
     return staff_reports
 
 
-def list_actual_links(staff_pdf, piles, course: CourseData):
+def wants_pdf(user: User, course: CourseData) -> bool:
+    return user["email"] in (course.get("pdf_reports") or [])
+
+
+def render_ungraded_staff(payload: UngradedStaffPayload) -> bytes:
+    staff_pdf = start_pdf("Staff Ungraded Report", payload.course_name, payload.ta_name)
+    # Summarize data
+    staff_pdf.set_font("helvetica", size=14)
+    make_table(staff_pdf, payload.status_table)
+    staff_pdf.ln()
+    # List all the actual links
+    staff_pdf.set_font("helvetica", size=14)
+    list_actual_links(staff_pdf, payload.links)
+    return pdf_bytes(staff_pdf)
+
+
+def render_ungraded_staff_html(payload: UngradedStaffPayload) -> bytes:
+    body = [html_table(payload.status_table)]
+    if not payload.links:
+        body.append("<p>You are all caught up on grading! Great work!</p>")
+    for heading, links in group_links(payload.links):
+        body.append(html_heading(heading + ":"))
+        body.append(html_links([(link.text, link.url) for link in links]))
+    section = html_section(
+        "Staff Ungraded Report", payload.course_name, payload.ta_name, "".join(body)
+    )
+    return section.encode("utf-8")
+
+
+def render_ungraded_staff_text(payload: UngradedStaffPayload) -> str:
+    lines = [
+        "Staff Ungraded Report",
+        payload.course_name,
+        payload.ta_name,
+        "",
+        text_table(payload.status_table),
+    ]
+    if not payload.links:
+        lines.append("You are all caught up on grading! Great work!")
+    for heading, links in group_links(payload.links):
+        lines.append(heading + ":")
+        lines.extend(f"   {link.text}: {link.url}" for link in links)
+    return "\n".join(lines) + "\n"
+
+
+def collect_links(piles, course: CourseData) -> list[Link]:
     flat_pile = sorted(
         [
             (days_old(submission), status, submission)
@@ -128,29 +206,49 @@ def list_actual_links(staff_pdf, piles, course: CourseData):
         ],
         key=lambda item: (-item[0], item[1]),
     )
-    previous_age = None
-    if not flat_pile:
-        staff_pdf.write(txt="You are all caught up on grading! Great work!")
+    links = []
     for age, status, submission in flat_pile:
-        log_age = round(math.log2(age)) if age > 0 else 0
-        if previous_age is None or log_age < previous_age:
-            previous_age = log_age
-            staff_pdf.set_font(size=18)
-            staff_pdf.write(txt=f"{age} day{'s' if age > 1 else ''} ago:\n")
-            staff_pdf.set_font(size=14)
         assignment = submission["assignment"]
         url = course["speed_grader_url"].format(
             course_id=course["id"],
             assignment_id=assignment["id"],
             user_id=submission["user"]["id"],
         )
-        staff_pdf.write(txt="   ")
-        staff_pdf.set_font(style="U")
-        staff_pdf.write(
-            txt=f"{assignment['name']}: {submission['user']['name']}", link=url
+        links.append(
+            Link(age, f"{assignment['name']}: {submission['user']['name']}", url)
         )
-        staff_pdf.set_font()
-        staff_pdf.ln()
+    return links
+
+
+def group_links(links: list[Link]) -> list[tuple[str, list[Link]]]:
+    """
+    Group the (oldest first) links under headings that get coarser with age.
+    """
+    groups = []
+    previous_age = None
+    for link in links:
+        age = link.age
+        log_age = round(math.log2(age)) if age > 0 else 0
+        if previous_age is None or log_age < previous_age:
+            previous_age = log_age
+            groups.append((f"{age} day{'s' if age > 1 else ''} ago", []))
+        groups[-1][1].append(link)
+    return groups
+
+
+def list_actual_links(staff_pdf, links: list[Link]):
+    if not links:
+        staff_pdf.write(txt="You are all caught up on grading! Great work!")
+    for heading, grouped_links in group_links(links):
+        staff_pdf.set_font(size=18)
+        staff_pdf.write(txt=heading + ":\n")
+        staff_pdf.set_font(size=14)
+        for link in grouped_links:
+            staff_pdf.write(txt="   ")
+            staff_pdf.set_font(style="U")
+            staff_pdf.write(txt=link.text, link=link.url)
+            staff_pdf.set_font()
+            staff_pdf.ln()
 
 
 def make_ungraded_reports_instructor(
@@ -160,64 +258,41 @@ def make_ungraded_reports_instructor(
     args: CronyConfiguration,
 ):
     instructor_reports = []
-    for instructor in course["instructors"]:
-        instructor_pdf = FPDF()
-        instructor_pdf.add_page()
-        # Page Header
-        instructor_pdf.set_font("helvetica", "B", size=22)
-        instructor_pdf.write(txt=f"Instructor Ungraded Report\n")
-        instructor_pdf.set_font("helvetica", size=18)
-        instructor_pdf.write(txt=course["course"]["name"] + "\n")
-        instructor_pdf.write(txt=instructor["name"] + "\n")
-        instructor_pdf.ln()
-        # Overall summary
-        instructor_pdf.set_font("helvetica", size=12)
+    if not any_recipients(course["instructors"], args):
+        return instructor_reports
+    # Overall summary
+    expected_submissions = len(course["students"]) * len(course["assignments"])
+    summary = [
         #   TA Sts
-        instructor_pdf.write(txt=f"Staff: {len(ta_grading_piles)}\n")
-        instructor_pdf.write(txt=f"Groups: {len(course['groups'])}\n")
-        instructor_pdf.write(txt=f"Students: {len(course['students'])}\n")
-        instructor_pdf.write(txt=f"Assignments: {len(course['assignments'])}\n")
-        expected_submissions = len(course["students"]) * len(course["assignments"])
-        instructor_pdf.write(
-            txt=f"Submissions: {len(course['submissions'])} ({expected_submissions} possible)\n"
-        )
-        for status, pile in big_pile.items():
-            if pile:
-                instructor_pdf.write(txt=f"{status.title()}: {len(pile)}\n")
-        instructor_pdf.ln()
-
-        # List out the TA's progress
-        for ta_id, piles in ta_grading_piles.items():
-            ta = course["users"][ta_id]
-            instructor_pdf.write(txt=ta["name"] + ":\n")
-            table_data = [["", "Total", "Past 3 Days", "Past Week", "Older"]]
-            for status, pile in piles.items():
-                if pile:
-                    recent, ancient = check_recency(*pile)
-                    normal = len(pile) - recent - ancient
-                    table_data.append(
-                        [
-                            status.title(),
-                            str(len(pile)),
-                            str(recent),
-                            str(normal),
-                            str(ancient),
-                        ]
-                    )
-                    # instructor_pdf.write(txt=f"  {status.title()}: {len(pile)} ({recent} recently, {ancient} more "
-                    #                         f"than a week ago)\n")
-            make_table(instructor_pdf, table_data)
-            instructor_pdf.ln()
-
-        instructor_pdf.set_font("helvetica", "B", size=22)
-        instructor_pdf.write(txt="Individual Links:\n")
-        for ta_id, piles in ta_grading_piles.items():
-            ta = course["users"][ta_id]
-            instructor_pdf.set_font("helvetica", "B", size=14)
-            instructor_pdf.write(txt=ta["name"] + ":\n")
-            instructor_pdf.set_font("helvetica", size=12)
-            list_actual_links(instructor_pdf, piles, course)
-            instructor_pdf.ln()
+        f"Staff: {len(ta_grading_piles)}",
+        f"Groups: {len(course['groups'])}",
+        f"Students: {len(course['students'])}",
+        f"Assignments: {len(course['assignments'])}",
+        f"Submissions: {len(course['submissions'])} ({expected_submissions} possible)",
+    ]
+    for status, pile in big_pile.items():
+        if pile:
+            summary.append(f"{status.title()}: {len(pile)}")
+    # List out the TA's progress
+    ta_tables = [
+        (course["users"][ta_id]["name"], make_status_table(piles))
+        for ta_id, piles in ta_grading_piles.items()
+    ]
+    ta_links = [
+        (course["users"][ta_id]["name"], collect_links(piles, course))
+        for ta_id, piles in ta_grading_piles.items()
+    ]
+    # Render just once, and send the same document to every instructor
+    payload = UngradedInstructorPayload(
+        course["course"]["name"],
+        ", ".join(instructor["name"] for instructor in course["instructors"]),
+        summary,
+        ta_tables,
+        ta_links,
+    )
+    for instructor in course["instructors"]:
+        if not is_recipient(instructor, args):
+            continue
         # Wrap it up
         instructor_reports.append(
             PdfReport(
@@ -226,7 +301,35 @@ def make_ungraded_reports_instructor(
                 instructor,
                 course,
                 args,
-                instructor_pdf,
+                render_ungraded_instructor,
+                payload,
             )
         )
     return instructor_reports
+
+
+def render_ungraded_instructor(payload: UngradedInstructorPayload) -> bytes:
+    instructor_pdf = start_pdf(
+        "Instructor Ungraded Report", payload.course_name, payload.instructor_names
+    )
+    # Overall summary
+    instructor_pdf.set_font("helvetica", size=12)
+    for line in payload.summary:
+        instructor_pdf.write(txt=line + "\n")
+    instructor_pdf.ln()
+
+    # List out the TA's progress
+    for ta_name, table_data in payload.ta_tables:
+        instructor_pdf.write(txt=ta_name + ":\n")
+        make_table(instructor_pdf, table_data)
+        instructor_pdf.ln()
+
+    instructor_pdf.set_font("helvetica", "B", size=22)
+    instructor_pdf.write(txt="Individual Links:\n")
+    for ta_name, links in payload.ta_links:
+        instructor_pdf.set_font("helvetica", "B", size=14)
+        instructor_pdf.write(txt=ta_name + ":\n")
+        instructor_pdf.set_font("helvetica", size=12)
+        list_actual_links(instructor_pdf, links)
+        instructor_pdf.ln()
+    return pdf_bytes(instructor_pdf)
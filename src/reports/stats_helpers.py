@@ -1,4 +1,15 @@
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import Optional
 import math
+import random
+
+import numpy as np
+
+from canvas_data import Submission
+
+QUANTILES = (0.0, 0.25, 0.5, 0.75, 1.0)
 
 
 def f(x):
@@ -30,3 +41,411 @@ def get_normal_stats(scores):
     variance = sum((x - mean) ** 2 for x in scores) / len(scores)
     std_dev = math.sqrt(variance)
     return [f(mean), f(variance), f(std_dev)]
+
+
+@dataclass
+class Distribution:
+    """
+    Summary of one group of percentage scores; mirrors `iqr` and `get_normal_stats`.
+    """
+
+    count: int
+    quantiles: tuple[float, ...]
+    mean: float
+    variance: float
+    std_dev: float
+
+    def iqr(self) -> list[str]:
+        if not self.count:
+            return ["", "", "", "", ""]
+        return [f(q) for q in self.quantiles]
+
+    def normal_stats(self) -> list[str]:
+        if not self.count:
+            return ["", "", ""]
+        return [f(self.mean), f(self.variance), f(self.std_dev)]
+
+
+@dataclass
+class ScoreStats:
+    count: int
+    zeroes: int
+    perfects: int
+    all_scores: Distribution
+    nonzero_scores: Distribution
+
+
+def grouped_distributions(
+    groups: np.ndarray, values: np.ndarray, group_count: int
+) -> list[Distribution]:
+    """
+    Compute a `Distribution` for every group id in one sorted, vectorized pass.
+    Quantiles use the same index rule as `iqr`: ``sorted[min(n - 1, ceil(n * q))]``.
+    :param groups: Integer group id for each value, in ``range(group_count)``.
+    :param values: The values to summarize.
+    :param group_count: How many groups there are (some may be empty).
+    :return: One distribution per group id.
+    """
+    counts = np.bincount(groups, minlength=group_count)
+    order = np.lexsort((values, groups))
+    ordered = values[order]
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    safe_counts = np.maximum(counts, 1)
+    quantiles = [
+        (
+            ordered[
+                np.minimum(
+                    starts + np.minimum(counts - 1, np.ceil(counts * q).astype(int)),
+                    max(len(ordered) - 1, 0),
+                )
+            ]
+            if len(ordered)
+            else np.zeros(group_count)
+        )
+        for q in QUANTILES
+    ]
+    means = np.bincount(groups, weights=values, minlength=group_count) / safe_counts
+    variances = (
+        np.bincount(
+            groups, weights=(values - means[groups]) ** 2, minlength=group_count
+        )
+        / safe_counts
+    )
+    std_devs = np.sqrt(variances)
+    return [
+        Distribution(
+            int(counts[g]),
+            tuple(float(q[g]) for q in quantiles),
+            float(means[g]),
+            float(variances[g]),
+            float(std_devs[g]),
+        )
+        for g in range(group_count)
+    ]
+
+
+def make_score_stats(
+    grader_piles: dict[int, list[Submission]],
+) -> dict[int, dict[Optional[int], ScoreStats]]:
+    """
+    Compute the score statistics for every (TA, assignment) cell, plus each TA's
+    "All Assignments" cell (keyed by ``None``), in a single grouped pass.
+    Assignments are ordered by their first appearance in each TA's pile.
+    :param grader_piles: Graded submissions for each grader.
+    :return: Statistics for each TA, by assignment id.
+    """
+    cells: dict[tuple[int, Optional[int]], int] = {}
+    cell_ids, scores, points = [], [], []
+    for ta_id, graded in grader_piles.items():
+        everything = cells.setdefault((ta_id, None), len(cells))
+        for submission in graded:
+            assignment_id = submission["assignment"]["id"]
+            cell = cells.setdefault((ta_id, assignment_id), len(cells))
+            score = submission["score"]
+            possible = submission["assignment"]["points_possible"]
+            for cell_id in (everything, cell):
+                cell_ids.append(cell_id)
+                scores.append(math.nan if score is None else score)
+                points.append(math.nan if possible is None else possible)
+    cell_ids = np.array(cell_ids, dtype=int)
+    scores = np.array(scores, dtype=float)
+    points = np.array(points, dtype=float)
+
+    known = ~np.isnan(scores)
+    scaled = known & (scores != 0) & ~np.isnan(points) & (points != 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        percents = np.where(scaled, 100 * scores / points, np.nan_to_num(scores))
+    zeroes = np.bincount(cell_ids, weights=known & (scores == 0), minlength=len(cells))
+    # Like comparing the raw values, a missing score on an assignment without points
+    # counts as perfect
+    perfect = (scores == points) | (np.isnan(scores) & np.isnan(points))
+    perfects = np.bincount(cell_ids, weights=perfect, minlength=len(cells))
+
+    all_scores = grouped_distributions(cell_ids, percents, len(cells))
+    nonzero_scores = grouped_distributions(
+        cell_ids[scaled], percents[scaled], len(cells)
+    )
+
+    stats: dict[int, dict[Optional[int], ScoreStats]] = {}
+    for (ta_id, assignment_id), cell in cells.items():
+        stats.setdefault(ta_id, {})[assignment_id] = ScoreStats(
+            all_scores[cell].count,
+            int(zeroes[cell]),
+            int(perfects[cell]),
+            all_scores[cell],
+            nonzero_scores[cell],
+        )
+    return stats
+
+
+def percent_score(submission: Submission) -> float:
+    """
+    The same percentage rule used for the "All Scores" rows of the score reports.
+    """
+    score = submission["score"]
+    possible = submission["assignment"]["points_possible"]
+    if possible and score:
+        return 100 * score / possible
+    return score or 0
+
+
+class RunningStats:
+    """
+    Welford's online mean/variance, mergeable with Chan et al.'s parallel update.
+    Exact up to floating point, regardless of how the data was partitioned.
+    """
+
+    def __init__(self, count: int = 0, mean: float = 0.0, m2: float = 0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2
+
+    def add(self, value: float):
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+
+    def merge(self, other: RunningStats) -> RunningStats:
+        count = self.count + other.count
+        if not count:
+            return RunningStats()
+        delta = other.mean - self.mean
+        mean = self.mean + delta * other.count / count
+        m2 = self.m2 + other.m2 + delta**2 * self.count * other.count / count
+        return RunningStats(count, mean, m2)
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / self.count if self.count else 0.0
+
+    @property
+    def std_dev(self) -> float:
+        return math.sqrt(self.variance)
+
+    def to_dict(self) -> dict:
+        return {"count": self.count, "mean": self.mean, "m2": self.m2}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> RunningStats:
+        return cls(data["count"], data["mean"], data["m2"])
+
+
+class KllSketch:
+    """
+    A KLL quantile sketch (Karnin, Lang & Liberty, 2016).
+
+    Keeps O(k) values no matter how many are added, and any two sketches can be
+    merged. Quantile estimates have a rank error of O(1/k): with the default
+    ``k=200`` a returned value's true rank is within about 1.7% of ``count`` of
+    the requested rank (99% confidence). The minimum and maximum are exact.
+    """
+
+    def __init__(self, k: int = 200, seed: Optional[int] = None):
+        self.k = k
+        self.count = 0
+        self.min = math.inf
+        self.max = -math.inf
+        self.compactors: list[list[float]] = [[]]
+        self._random = random.Random(seed)
+
+    def capacity(self, height: int) -> int:
+        depth = len(self.compactors) - height - 1
+        return max(2, math.ceil(self.k * (2 / 3) ** depth))
+
+    @property
+    def size(self) -> int:
+        return sum(len(items) for items in self.compactors)
+
+    def add(self, value: float):
+        self.count += 1
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.compactors[0].append(value)
+        if len(self.compactors[0]) >= self.capacity(0):
+            self._compress()
+
+    def merge(self, other: KllSketch) -> KllSketch:
+        # Seeded from this sketch, so that merging seeded sketches is repeatable
+        merged = KllSketch(max(self.k, other.k), self._random.getrandbits(32))
+        merged.count = self.count + other.count
+        merged.min = min(self.min, other.min)
+        merged.max = max(self.max, other.max)
+        height = max(len(self.compactors), len(other.compactors))
+        merged.compactors = [
+            [
+                *(self.compactors[h] if h < len(self.compactors) else []),
+                *(other.compactors[h] if h < len(other.compactors) else []),
+            ]
+            for h in range(height)
+        ]
+        merged._compress()
+        return merged
+
+    def _compress(self):
+        max_size = sum(self.capacity(h) for h in range(len(self.compactors)))
+        for height in range(len(self.compactors)):
+            items = self.compactors[height]
+            if len(items) < self.capacity(height):
+                continue
+            if height + 1 == len(self.compactors):
+                self.compactors.append([])
+            items.sort()
+            # Keep every other item (at double weight), starting at random
+            leftover = [items.pop()] if len(items) % 2 else []
+            self.compactors[height + 1].extend(items[self._random.randint(0, 1) :: 2])
+            self.compactors[height] = leftover
+            if self.size < max_size:
+                break
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return math.nan
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+        weighted = sorted(
+            (value, 2**height)
+            for height, items in enumerate(self.compactors)
+            for value in items
+        )
+        total = sum(weight for value, weight in weighted)
+        target = q * total
+        seen = 0
+        for value, weight in weighted:
+            seen += weight
+            if seen > target:
+                return value
+        return self.max
+
+    def to_dict(self) -> dict:
+        return {
+            "k": self.k,
+            "count": self.count,
+            "min": self.min if self.count else None,
+            "max": self.max if self.count else None,
+            "compactors": self.compactors,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> KllSketch:
+        sketch = cls(data["k"])
+        sketch.count = data["count"]
+        if sketch.count:
+            sketch.min = data["min"]
+            sketch.max = data["max"]
+        sketch.compactors = [list(items) for items in data["compactors"]] or [[]]
+        return sketch
+
+
+class MergeableDistribution:
+    """
+    A mergeable counterpart to `Distribution`: exact mean/variance and sketched quantiles.
+    """
+
+    def __init__(
+        self, running: RunningStats = None, sketch: Optional[KllSketch] = None
+    ):
+        self.running = running or RunningStats()
+        self.sketch = sketch or KllSketch()
+
+    @property
+    def count(self) -> int:
+        return self.running.count
+
+    def add(self, value: float):
+        self.running.add(value)
+        self.sketch.add(value)
+
+    def merge(self, other: MergeableDistribution) -> MergeableDistribution:
+        return MergeableDistribution(
+            self.running.merge(other.running), self.sketch.merge(other.sketch)
+        )
+
+    def iqr(self) -> list[str]:
+        if not self.count:
+            return ["", "", "", "", ""]
+        return [f(self.sketch.quantile(q)) for q in QUANTILES]
+
+    def normal_stats(self) -> list[str]:
+        if not self.count:
+            return ["", "", ""]
+        running = self.running
+        return [f(running.mean), f(running.variance), f(running.std_dev)]
+
+    def to_dict(self) -> dict:
+        return {"running": self.running.to_dict(), "sketch": self.sketch.to_dict()}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> MergeableDistribution:
+        return cls(
+            RunningStats.from_dict(data["running"]),
+            KllSketch.from_dict(data["sketch"]),
+        )
+
+
+class ScoreSummary:
+    """
+    A mergeable counterpart to `ScoreStats`, small enough to store per course and
+    combine across courses and terms without revisiting the raw scores.
+    """
+
+    def __init__(
+        self,
+        zeroes: int = 0,
+        perfects: int = 0,
+        all_scores: MergeableDistribution = None,
+        nonzero_scores: MergeableDistribution = None,
+    ):
+        self.zeroes = zeroes
+        self.perfects = perfects
+        self.all_scores = all_scores or MergeableDistribution()
+        self.nonzero_scores = nonzero_scores or MergeableDistribution()
+
+    @property
+    def count(self) -> int:
+        return self.all_scores.count
+
+    @classmethod
+    def from_submissions(cls, graded: list[Submission]) -> ScoreSummary:
+        summary = cls()
+        for submission in graded:
+            score = submission["score"]
+            possible = submission["assignment"]["points_possible"]
+            percent = percent_score(submission)
+            summary.all_scores.add(percent)
+            if score and possible:
+                summary.nonzero_scores.add(percent)
+            if score == 0:
+                summary.zeroes += 1
+            # Like `make_score_stats`, a missing score on an assignment without
+            # points counts as perfect
+            if score == possible:
+                summary.perfects += 1
+        return summary
+
+    def merge(self, other: ScoreSummary) -> ScoreSummary:
+        return ScoreSummary(
+            self.zeroes + other.zeroes,
+            self.perfects + other.perfects,
+            self.all_scores.merge(other.all_scores),
+            self.nonzero_scores.merge(other.nonzero_scores),
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            "zeroes": self.zeroes,
+            "perfects": self.perfects,
+            "all_scores": self.all_scores.to_dict(),
+            "nonzero_scores": self.nonzero_scores.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> ScoreSummary:
+        return cls(
+            data["zeroes"],
+            data["perfects"],
+            MergeableDistribution.from_dict(data["all_scores"]),
+            MergeableDistribution.from_dict(data["nonzero_scores"]),
+        )
@@ -0,0 +1,155 @@
+"""
+Stores per-course score summaries on disk, so that they can later be merged into
+rollups across courses and terms (per TA, per instructor, or for a department)
+without refetching or re-sorting any raw scores.
+"""
+
+from __future__ import annotations
+from typing import Optional
+import csv
+import json
+import os
+
+from canvas_data import CourseData, Submission
+from filesystem import clean_filename
+from reports.stats_helpers import ScoreSummary
+
+
+def save_score_summaries(
+    course: CourseData, grader_piles: dict[int, list[Submission]], folder: str
+) -> str:
+    """
+    Summarize each grader's scores for this course and write them to the folder.
+    :param course: The course data.
+    :param grader_piles: Graded submissions for each grader.
+    :param folder: Where to keep the summary files (one per course).
+    :return: The path of the written file.
+    """
+    staff = {}
+    for ta_id, graded in grader_piles.items():
+        ta = course["users"][ta_id]
+        staff[ta["email"]] = {
+            "name": ta["name"],
+            "summary": ScoreSummary.from_submissions(graded).to_dict(),
+        }
+    record = {
+        "course": {
+            "id": course["course"]["id"],
+            "name": course["course"]["name"],
+            "course_code": course["course"]["course_code"],
+        },
+        "instructors": [instructor["email"] for instructor in course["instructors"]],
+        "staff": staff,
+    }
+    os.makedirs(folder, exist_ok=True)
+    course_code = clean_filename(course["course"]["course_code"])
+    path = os.path.join(folder, f"scores_{course_code}_{course['course']['id']}.json")
+    with open(path, "w") as summary_file:
+        json.dump(record, summary_file)
+    return path
+
+
+def load_score_summaries(folder: str) -> list[dict]:
+    records = []
+    for filename in sorted(os.listdir(folder)):
+        if not filename.endswith(".json"):
+            continue
+        with open(os.path.join(folder, filename)) as summary_file:
+            records.append(json.load(summary_file))
+    return records
+
+
+def rollup_by_staff(records: list[dict]) -> dict[str, ScoreSummary]:
+    """
+    Merge every course's summary for each staff member (by email).
+    """
+    rollup: dict[str, ScoreSummary] = {}
+    for record in records:
+        for email, entry in record["staff"].items():
+            summary = ScoreSummary.from_dict(entry["summary"])
+            rollup[email] = rollup[email].merge(summary) if email in rollup else summary
+    return rollup
+
+
+def rollup_by_instructor(records: list[dict]) -> dict[str, ScoreSummary]:
+    """
+    Merge all the staff summaries of every course that each instructor teaches.
+    """
+    rollup: dict[str, ScoreSummary] = {}
+    for record in records:
+        course_summary = rollup_all([record])
+        for email in record["instructors"]:
+            rollup[email] = (
+                rollup[email].merge(course_summary)
+                if email in rollup
+                else course_summary
+            )
+    return rollup
+
+
+def rollup_all(records: list[dict]) -> ScoreSummary:
+    """
+    Merge everything into a single (e.g., department-wide) summary.
+    """
+    total = ScoreSummary()
+    for record in records:
+        for entry in record["staff"].values():
+            total = total.merge(ScoreSummary.from_dict(entry["summary"]))
+    return total
+
+
+ROLLUP_HEADER = [
+    "Scope",
+    "Who",
+    "Graded",
+    "Zeroes",
+    "Perfects",
+    "Mean",
+    "Variance",
+    "Std Dev",
+    "Min",
+    "Q1",
+    "Median",
+    "Q3",
+    "Max",
+]
+
+
+def get_rollup_row(scope: str, who: str, summary: ScoreSummary) -> list[str]:
+    return [
+        scope,
+        who,
+        str(summary.count),
+        str(summary.zeroes),
+        str(summary.perfects),
+        *summary.all_scores.normal_stats(),
+        *summary.all_scores.iqr(),
+    ]
+
+
+def make_rollup_rows(records: list[dict]) -> list[list[str]]:
+    """
+    A row for each staff member, each instructor, and everyone, from the stored
+    summaries of every course.
+    """
+    rows = [ROLLUP_HEADER]
+    for email, summary in sorted(rollup_by_staff(records).items()):
+        rows.append(get_rollup_row("staff", email, summary))
+    for email, summary in sorted(rollup_by_instructor(records).items()):
+        rows.append(get_rollup_row("instructor", email, summary))
+    rows.append(get_rollup_row("all", "", rollup_all(records)))
+    return rows
+
+
+def write_rollup(folder: str, output: Optional[str] = None) -> list[list[str]]:
+    """
+    Roll up the summaries stored in the folder, and write them as rollup.csv in
+    the output folder (if there is one).
+    :return: The rows of the rollup, starting with the header.
+    """
+    rows = make_rollup_rows(load_score_summaries(folder))
+    if output is not None:
+        os.makedirs(output, exist_ok=True)
+        with open(os.path.join(output, "rollup.csv"), "w", newline="") as csv_file:
+            csv.writer(csv_file).writerows(rows)
+    return rows
@@ -0,0 +1,50 @@
+"""
+The derived course views shared between reporters.
+"""
+
+from __future__ import annotations
+
+from reports.course_helpers import (
+    get_staff_for_student,
+    make_graded_piles,
+    make_ungraded_piles,
+)
+from reports.progress_matrix import make_completion_matrix
+from reports.registry import CourseViews, register_view
+from reports.stats_helpers import make_score_stats
+
+
+@register_view("staff for student")
+def staff_for_student_view(views: CourseViews):
+    return get_staff_for_student(views.course)
+
+
+@register_view("graded piles")
+def graded_piles_view(views: CourseViews):
+    """(big pile, each TA's students' submissions by status, each grader's submissions)"""
+    return make_graded_piles(views.course, views["staff for student"])
+
+
+@register_view("grading piles")
+def grading_piles_view(views: CourseViews):
+    """(big pile, each TA's students' submissions by status)"""
+    # Same piles as `make_grading_piles`, without classifying everything again
+    big_pile, ta_students_pile, ta_graded_pile = views["graded piles"]
+    return big_pile, ta_students_pile
+
+
+@register_view("graded by grader")
+def graded_by_grader_view(views: CourseViews):
+    """(every graded submission, each grader's graded submissions)"""
+    return make_ungraded_piles(views.course)
+
+
+@register_view("completion matrix")
+def completion_matrix_view(views: CourseViews):
+    return make_completion_matrix(views.course)
+
+
+@register_view("score stats")
+def score_stats_view(views: CourseViews):
+    all_graded, grader_piles = views["graded by grader"]
+    return make_score_stats(grader_piles)
@@ -8,6 +8,16 @@ class Settings(TypedDict):
     canvas_token: str
     mail_server: str
     mail_server_port: int
+    # Optional: how to log in to the mail server
+    mail_starttls: bool
+    mail_username: str
+    mail_password: str
+    # Optional: how many connections to send over, and how hard to use them
+    mail_connections: int
+    mail_messages_per_connection: int
+    mail_messages_per_minute: int
+    # Optional: split emails whose attachments would make them bigger than this (bytes)
+    mail_max_message_size: int
 
 
 def yaml_load(path):
@@ -0,0 +1,152 @@
+"""
+A trace of every run, so that slow runs can be tied to their courses, Canvas
+endpoints and reports, and runs compared over the semester.
+
+Every span (see `profiling.span`) becomes one line of JSON in the trace file,
+appended run after run. Each line is a complete event of the Chrome trace event
+format, with the span's id, its parent's id, the run's trace id and the span's
+attributes (course id, endpoint, pages, report type, recipients...) in `args`:
+
+    {"name": "GET users", "ph": "X", "ts": 1700000000000000, "dur": 1532000,
+     "pid": 4242, "tid": 4242, "args": {"trace_id": "...", "span_id": "...",
+     "parent_id": "...", "endpoint": "users", "course_id": 123, "pages": 4}}
+
+To open a run in Perfetto (ui.perfetto.dev) or chrome://tracing, gather its lines
+into a JSON array, e.g.:
+
+    jq -s '{traceEvents: map(select(.args.trace_id == "<id>"))}' crony_trace.jsonl > run.json
+
+Each run gets its own trace id; in `--daemon` mode, so does each scheduled run
+and each run after a deadline. Events are handed through a queue to a background
+thread (a QueueListener), so the spans never wait on the disk or on encoding JSON.
+If the trace file cannot be opened (e.g., on a read-only file system), the run
+goes on without a trace.
+"""
+
+from __future__ import annotations
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Any, Optional
+import json
+import logging
+import os
+import queue
+import threading
+import uuid
+
+logger = logging.getLogger("crony")
+
+DEFAULT_TRACE_PATH = "crony_trace.jsonl"
+# Old traces are rotated out like the log, keeping this many backups
+TRACE_BACKUPS = 5
+TRACE_MAX_BYTES = 1024**3
+
+
+def new_span_id() -> str:
+    return os.urandom(8).hex()
+
+
+class TraceQueueHandler(QueueHandler):
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The event is only turned into JSON on the writing thread
+        return record
+
+
+class TraceFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps(record.msg, default=str)
+
+
+class Tracer:
+    """
+    Writes the spans of one run to the trace file, from a background thread.
+    :param path: The JSONL file to append the events to.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.trace_id = uuid.uuid4().hex
+        self.pid = os.getpid()
+        # Opened first, so that nothing is left behind if it cannot be
+        file_handler = RotatingFileHandler(
+            filename=path,
+            encoding="utf-8",
+            backupCount=TRACE_BACKUPS,
+            maxBytes=TRACE_MAX_BYTES,
+        )
+        file_handler.setFormatter(TraceFormatter())
+        self.queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.logger = logging.getLogger("crony.trace")
+        # Only the trace file gets these, not the crony's log
+        self.logger.propagate = False
+        self.logger.setLevel(logging.INFO)
+        self.handler = TraceQueueHandler(self.queue)
+        self.logger.addHandler(self.handler)
+        self.listener = QueueListener(self.queue, file_handler)
+        self.listener.start()
+
+    def emit(
+        self,
+        name: str,
+        span_id: str,
+        parent_id: Optional[str],
+        start: float,
+        seconds: float,
+        attributes: dict[str, Any],
+    ):
+        """
+        Queue one finished span.
+        :param start: When it started, in seconds since the epoch.
+        """
+        self.logger.info(
+            {
+                "name": name,
+                "ph": "X",
+                "ts": round(start * 1_000_000),
+                "dur": round(seconds * 1_000_000),
+                "pid": self.pid,
+                "tid": threading.get_native_id(),
+                "args": {
+                    "trace_id": self.trace_id,
+                    "span_id": span_id,
+                    "parent_id": parent_id,
+                    "thread": threading.current_thread().name,
+                    **attributes,
+                },
+            }
+        )
+
+    def close(self):
+        """Write out every queued span, and stop the writing thread."""
+        self.listener.stop()
+        self.logger.removeHandler(self.handler)
+        for handler in self.listener.handlers:
+            handler.close()
+
+
+# The tracer of the current run, if it is being traced
+TRACER: Optional[Tracer] = None
+
+
+def start(path: str = DEFAULT_TRACE_PATH) -> Optional[Tracer]:
+    global TRACER
+    try:
+        TRACER = Tracer(path)
+    except OSError as error:
+        logger.warning(f"Not tracing, since the trace file cannot be opened: {error}")
+        TRACER = None
+    return TRACER
+
+
+def new_trace():
+    """
+    Give the spans from here on a new trace id, as a run of their own.
+    """
+    if TRACER is not None:
+        TRACER.trace_id = uuid.uuid4().hex
+
+
+def finish():
+    global TRACER
+    tracer, TRACER = TRACER, None
+    if tracer is not None:
+        tracer.close()
@@ -0,0 +1,108 @@
+"""
+Downloads in parallel byte ranges, and resuming them after a failure, against a
+local server that honors ranges and can be told to fail some of them.
+"""
+
+import os
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+import canvas_request
+from canvas_request import CanvasRequest, get_ranges_path
+
+PART_SIZE = 64 * 1024
+CONTENT = os.urandom(5 * PART_SIZE + 123)
+
+
+class RangeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # The starts of the ranges to fail, and the starts of every range asked for
+    failing: set[int] = set()
+    requested: list[int] = []
+
+    def log_message(self, *args):
+        pass
+
+    def send_body(self, status: int, body: bytes, headers: dict[str, str]):
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        first, _, last = self.headers["Range"].removeprefix("bytes=").partition("-")
+        start, end = int(first), int(last) if last else len(CONTENT) - 1
+        self.requested.append(start)
+        if start in self.failing:
+            self.send_body(500, b'{"errors": "failed"}', {})
+        elif start >= len(CONTENT):
+            self.send_body(416, b"", {"Content-Range": f"bytes */{len(CONTENT)}"})
+        else:
+            self.send_body(
+                206,
+                CONTENT[start : end + 1],
+                {"Content-Range": f"bytes {start}-{end}/{len(CONTENT)}"},
+            )
+
+
+@pytest.fixture
+def server():
+    RangeHandler.failing, RangeHandler.requested = set(), []
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), RangeHandler)
+    thread = threading.Thread(target=httpd.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{httpd.server_port}"
+    httpd.shutdown()
+    httpd.server_close()
+
+
+@pytest.fixture
+def canvas(server, monkeypatch):
+    monkeypatch.setattr(canvas_request, "DOWNLOAD_PART_SIZE", PART_SIZE)
+    monkeypatch.setattr(canvas_request, "DOWNLOAD_RETRIES", 0)
+    return CanvasRequest({"canvas_url": server, "canvas_token": "token"}, False)
+
+
+def read(path: str) -> bytes:
+    with open(path, "rb") as downloaded:
+        return downloaded.read()
+
+
+def test_download_ranges(canvas, server, tmp_path):
+    destination = str(tmp_path / "export.csv")
+    canvas.download_file(f"{server}/export.csv", destination)
+    assert read(destination) == CONTENT
+    assert not os.path.exists(get_ranges_path(destination + ".part"))
+
+
+def test_resume_after_failed_range(canvas, server, tmp_path):
+    destination = str(tmp_path / "export.csv")
+    partial = destination + ".part"
+    RangeHandler.failing = {2 * PART_SIZE}
+    with pytest.raises(Exception):
+        canvas.download_file(f"{server}/export.csv", destination)
+    assert not os.path.exists(destination)
+    # The full size, but not a prefix to continue from
+    assert os.path.getsize(partial) == len(CONTENT)
+    assert os.path.exists(get_ranges_path(partial))
+
+    RangeHandler.failing, RangeHandler.requested = set(), []
+    canvas.download_file(f"{server}/export.csv", destination)
+    assert read(destination) == CONTENT
+    assert not os.path.exists(partial)
+    assert not os.path.exists(get_ranges_path(partial))
+    # Only the failed range is downloaded again (after checking the size)
+    assert RangeHandler.requested == [0, 2 * PART_SIZE]
+
+
+def test_resume_prefix(canvas, server, tmp_path):
+    destination = str(tmp_path / "export.csv")
+    with open(destination + ".part", "wb") as partial_file:
+        partial_file.write(CONTENT[:1000])
+    canvas.download_file(f"{server}/export.csv", destination)
+    assert read(destination) == CONTENT
+    assert RangeHandler.requested == [1000]
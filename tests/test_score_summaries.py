@@ -0,0 +1,179 @@
+"""
+Score summaries are merged across courses and terms, so a merged summary has to
+agree with one made over all of the scores at once.
+"""
+
+import random
+
+import pytest
+
+from reports.stats_helpers import RunningStats, KllSketch, ScoreSummary
+from reports.summary_store import (
+    rollup_by_staff,
+    rollup_by_instructor,
+    rollup_all,
+    make_rollup_rows,
+)
+
+# How far (as a share of the values) a sketched quantile's rank may be off
+RANK_ERROR = 0.02
+
+
+def make_scores(count: int, seed: int) -> list[float]:
+    generator = random.Random(seed)
+    return [generator.uniform(0, 100) for _ in range(count)]
+
+
+def get_rank(values: list[float], value: float) -> float:
+    return sum(1 for other in values if other <= value) / len(values)
+
+
+def make_running(values: list[float]) -> RunningStats:
+    running = RunningStats()
+    for value in values:
+        running.add(value)
+    return running
+
+
+def make_sketch(values: list[float], seed: int = 0) -> KllSketch:
+    sketch = KllSketch(seed=seed)
+    for value in values:
+        sketch.add(value)
+    return sketch
+
+
+def make_submission(score, points_possible) -> dict:
+    return {"score": score, "assignment": {"points_possible": points_possible}}
+
+
+def test_running_stats_merge():
+    first, second = make_scores(1000, 1), make_scores(37, 2)
+    merged = make_running(first).merge(make_running(second))
+    combined = make_running(first + second)
+    assert merged.count == combined.count == 1037
+    assert merged.mean == pytest.approx(combined.mean)
+    assert merged.variance == pytest.approx(combined.variance)
+    assert merged.mean == pytest.approx(sum(first + second) / 1037)
+
+
+def test_running_stats_merge_empty():
+    running = make_running([3.0, 5.0])
+    for merged in [running.merge(RunningStats()), RunningStats().merge(running)]:
+        assert merged.count == 2
+        assert merged.mean == pytest.approx(4.0)
+        assert merged.variance == pytest.approx(running.variance)
+
+
+def test_running_stats_round_trip():
+    running = make_running(make_scores(50, 3))
+    loaded = RunningStats.from_dict(running.to_dict())
+    assert loaded.mean == pytest.approx(running.mean)
+    assert loaded.variance == pytest.approx(running.variance)
+
+
+@pytest.mark.parametrize("q", [0.1, 0.25, 0.5, 0.75, 0.9])
+def test_sketch_quantile_accuracy(q):
+    values = make_scores(20_000, 4)
+    estimate = make_sketch(values).quantile(q)
+    assert abs(get_rank(values, estimate) - q) < RANK_ERROR
+
+
+@pytest.mark.parametrize("q", [0.1, 0.25, 0.5, 0.75, 0.9])
+def test_sketch_merge_accuracy(q):
+    parts = [make_scores(count, seed) for seed, count in enumerate([9000, 5000, 300])]
+    merged = KllSketch(seed=len(parts))
+    for seed, part in enumerate(parts):
+        merged = merged.merge(make_sketch(part, seed))
+    values = [value for part in parts for value in part]
+    assert merged.count == len(values)
+    assert abs(get_rank(values, merged.quantile(q)) - q) < RANK_ERROR
+
+
+def test_sketch_keeps_extremes():
+    first, second = make_scores(5000, 5), make_scores(5000, 6)
+    merged = make_sketch(first).merge(make_sketch(second))
+    assert merged.quantile(0) == min(first + second)
+    assert merged.quantile(1) == max(first + second)
+
+
+def test_sketch_small_is_exact():
+    values = [5.0, 1.0, 4.0, 2.0, 3.0]
+    sketch = KllSketch.from_dict(make_sketch(values).to_dict())
+    assert [sketch.quantile(q) for q in [0.0, 0.5, 1.0]] == [1.0, 3.0, 5.0]
+
+
+def test_score_summary_merge():
+    generator = random.Random(7)
+    submissions = [
+        make_submission(generator.choice([0, 10, generator.uniform(0, 10)]), 10)
+        for _ in range(500)
+    ]
+    merged = ScoreSummary.from_submissions(submissions[:200]).merge(
+        ScoreSummary.from_submissions(submissions[200:])
+    )
+    combined = ScoreSummary.from_submissions(submissions)
+    assert merged.count == combined.count == 500
+    assert merged.zeroes == combined.zeroes
+    assert merged.perfects == combined.perfects
+    assert merged.all_scores.running.mean == pytest.approx(
+        combined.all_scores.running.mean
+    )
+    assert merged.nonzero_scores.count == combined.nonzero_scores.count
+    assert merged.all_scores.normal_stats() == combined.all_scores.normal_stats()
+
+
+def test_score_summary_perfects():
+    summary = ScoreSummary.from_submissions(
+        [
+            make_submission(10, 10),
+            make_submission(0, 10),
+            make_submission(None, 10),
+            make_submission(None, None),
+        ]
+    )
+    assert summary.perfects == 2
+    assert summary.zeroes == 1
+
+
+def make_record(instructors: list[str], staff: dict[str, list]) -> dict:
+    return {
+        "instructors": instructors,
+        "staff": {
+            email: {
+                "name": email,
+                "summary": ScoreSummary.from_submissions(submissions).to_dict(),
+            }
+            for email, submissions in staff.items()
+        },
+    }
+
+
+def test_rollups():
+    first = [make_submission(score, 10) for score in [0, 5, 10]]
+    second = [make_submission(score, 10) for score in [2, 4]]
+    third = [make_submission(score, 10) for score in [10, 10, 8, 6]]
+    records = [
+        make_record(["prof@udel.edu"], {"ta@udel.edu": first}),
+        make_record(["prof@udel.edu", "other@udel.edu"], {"ta@udel.edu": second}),
+        make_record(["other@udel.edu"], {"grader@udel.edu": third}),
+    ]
+    by_staff = rollup_by_staff(records)
+    assert by_staff["ta@udel.edu"].count == 5
+    assert by_staff["ta@udel.edu"].all_scores.running.mean == pytest.approx(42)
+    by_instructor = rollup_by_instructor(records)
+    assert by_instructor["prof@udel.edu"].count == 5
+    assert by_instructor["other@udel.edu"].count == 6
+    assert by_instructor["other@udel.edu"].perfects == 2
+    total = rollup_all(records)
+    assert total.count == 9
+    assert total.zeroes == 1
+    assert total.perfects == 3
+    assert total.all_scores.running.mean == pytest.approx(550 / 9)
+    rows = make_rollup_rows(records)
+    assert [row[:3] for row in rows[1:]] == [
+        ["staff", "grader@udel.edu", "4"],
+        ["staff", "ta@udel.edu", "5"],
+        ["instructor", "other@udel.edu", "6"],
+        ["instructor", "prof@udel.edu", "5"],
+        ["all", "", "9"],
+    ]
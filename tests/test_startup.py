@@ -0,0 +1,54 @@
+"""
+The crony runs many short invocations an hour, so starting it up must stay cheap:
+the heavy libraries behind the reports should only load when reports are built.
+"""
+
+import os
+import subprocess
+import sys
+
+SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src")
+# Seconds to import the CLI's modules; a few times what it takes on a laptop
+IMPORT_BUDGET = 1.0
+HEAVY_MODULES = ["fpdf", "xlsxwriter", "numpy", "requests_cache", "tqdm"]
+
+
+def run_python(*arguments: str) -> subprocess.CompletedProcess:
+    return subprocess.run(
+        [sys.executable, *arguments],
+        cwd=SRC,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+
+def get_import_time(module: str) -> float:
+    """Seconds to import the module (and everything it imports) in a new interpreter."""
+    result = run_python("-X", "importtime", "-c", f"import {module}")
+    for line in result.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        timings = line.partition(":")[2].split("|")
+        if len(timings) == 3 and timings[2].strip() == module:
+            return int(timings[1]) / 1_000_000
+    raise ValueError(f"No import time reported for {module}")
+
+
+def test_import_budget():
+    # Take the best of a few runs, to not fail on one unlucky moment
+    best = min(get_import_time("canvas_crony") for attempt in range(3))
+    assert best < IMPORT_BUDGET, f"Importing canvas_crony took {best:.2f}s"
+
+
+def test_no_heavy_imports():
+    result = run_python(
+        "-c",
+        "import sys, canvas_crony; print(' '.join(sorted(sys.modules)))",
+    )
+    loaded = set(result.stdout.split())
+    assert not loaded.intersection(HEAVY_MODULES)
+
+
+def test_help_skips_imports():
+    result = run_python("-X", "importtime", "__main__.py", "--help")
+    assert "canvas_crony" not in result.stderr